@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+"""
+Compare the per-call latency of S3 requests made with a new boto3 client per call, as bignbit did before the shared
+client registry, with requests made through bignbit.utils.get_aws_client.
+
+S3 is mocked with moto, so the numbers cover client creation (endpoint resolution, credential lookup, service model
+loading) and request handling, but not the TLS handshakes a new client also pays against real AWS. Results are
+printed as JSON, including the latency of --threads threads sharing the registry client.
+
+Usage:
+    python bench_aws_clients.py [--calls N] [--threads N]
+"""
+import argparse
+import json
+import os
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+from moto import mock_s3
+
+from bignbit import utils
+
+
+def latencies(call, calls: int, threads: int = 1) -> list:
+    """Seconds taken by each of calls invocations of call on a pool of threads"""
+    def timed(_):
+        start = time.perf_counter()
+        call()
+        return time.perf_counter() - start
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        return list(executor.map(timed, range(calls)))
+
+
+def summary(seconds: list) -> dict:
+    """Median and 95th percentile latency in milliseconds"""
+    return {
+        'median_ms': statistics.median(seconds) * 1000,
+        'p95_ms': statistics.quantiles(seconds, n=20)[-1] * 1000
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark per-call AWS client creation against the shared registry.")
+    parser.add_argument('--calls', type=int, default=200)
+    parser.add_argument('--threads', type=int, default=8)
+    args = parser.parse_args()
+
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    with mock_s3():
+        boto3.client('s3').create_bucket(Bucket='bench')
+        boto3.client('s3').put_object(Bucket='bench', Key='object', Body=b'data')
+
+        def new_client():
+            boto3.client('s3').head_object(Bucket='bench', Key='object')
+
+        def registry_client():
+            utils.get_aws_client('s3').head_object(Bucket='bench', Key='object')
+
+        results = {
+            'calls': args.calls,
+            'new_client_per_call': summary(latencies(new_client, args.calls)),
+            'registry_client': summary(latencies(registry_client, args.calls)),
+            f'registry_client_{args.threads}_threads': summary(latencies(registry_client, args.calls, args.threads))
+        }
+    results['median_speedup'] = results['new_client_per_call']['median_ms'] / results['registry_client']['median_ms']
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
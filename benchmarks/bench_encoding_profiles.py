@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+"""
+Compare the output encoding profiles of the OPERA HLS treatment on the sample DSWx browse image.
+
+The sample image is reprojected to the GIBS grid once, then written with every profile. For each profile the median
+encode time, the output size and the time it takes to transfer the output at the given bandwidth are reported as JSON.
+When --bucket is given the output is also uploaded to that S3 bucket and the measured upload time is reported.
+
+Usage:
+    python bench_encoding_profiles.py [--image PATH] [--repeat N] [--bandwidth-mbps MBPS] [--bucket BUCKET]
+"""
+import argparse
+import json
+import pathlib
+import statistics
+import tempfile
+import time
+
+import boto3
+from osgeo import gdal
+
+from bignbit.apply_opera_hls_treatment import GIBS_RESOLUTION, GIBS_SRS
+from bignbit.encoding_profiles import EncodingProfile, PROFILES
+
+SAMPLE_IMAGE = pathlib.Path(__file__).resolve().parent.parent.joinpath(
+    'tests', 'data', 'OPERA_L3_DSWx-HLS_T48SUE_20190302T034350Z_20230131T222341Z_L8_30_v0.0_BROWSE.tiff')
+
+
+def encode(warped: gdal.Dataset, destination: pathlib.Path, profile: EncodingProfile) -> float:
+    """Write warped with profile and return the elapsed seconds"""
+    destination.unlink(missing_ok=True)
+    start = time.perf_counter()
+    gdal.Translate(str(destination), warped, format=profile.driver, creationOptions=profile.creation_options())
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the OPERA HLS output encoding profiles.")
+    parser.add_argument('--image', type=pathlib.Path, default=SAMPLE_IMAGE)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--bandwidth-mbps', type=float, default=100.0,
+                        help="Bandwidth used to estimate the transfer time of each output")
+    parser.add_argument('--bucket', help="Optional S3 bucket to measure real upload times against")
+    args = parser.parse_args()
+
+    gdal.UseExceptions()
+    s3_client = boto3.client('s3') if args.bucket else None
+    results = {'image': str(args.image), 'bandwidth_mbps': args.bandwidth_mbps, 'profiles': {}}
+    with tempfile.TemporaryDirectory() as tmp:
+        # Warp into memory once so every profile encodes the same pixels and only the encoding is timed
+        warped = gdal.Warp('', str(args.image), format='MEM', dstSRS=GIBS_SRS, xRes=GIBS_RESOLUTION,
+                           yRes=GIBS_RESOLUTION)
+        for name, profile in PROFILES.items():
+            destination = pathlib.Path(tmp).joinpath(f'{name}.tiff')
+            encode_seconds = [encode(warped, destination, profile) for _ in range(args.repeat)]
+            output_bytes = destination.stat().st_size
+            result = {
+                'driver': profile.driver,
+                'creation_options': profile.creation_options(),
+                'encode_seconds': statistics.median(encode_seconds),
+                'output_bytes': output_bytes,
+                'estimated_transfer_seconds': output_bytes * 8 / (args.bandwidth_mbps * 1e6)
+            }
+            if s3_client:
+                start = time.perf_counter()
+                s3_client.upload_file(str(destination), args.bucket, f'bench_encoding_profiles/{name}.tiff')
+                result['upload_seconds'] = time.perf_counter() - start
+            results['profiles'][name] = result
+
+    default_bytes = results['profiles']['default']['output_bytes']
+    for result in results['profiles'].values():
+        result['size_vs_default'] = result['output_bytes'] / default_bytes
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+"""
+Compare warping the sample DSWx browse image into its GIBS sub-tiles with gdal.Warp against the gather-based
+'index_map' resampling engine.
+
+The same image is treated --revisits times, as if the MGRS tile were revisited with new pixel values. For each
+engine the time of the first (cold) and of the median later (warm) revisit is reported as JSON, along with whether
+every sub-tile is pixel-identical between the engines.
+
+Usage:
+    python bench_index_map_warp.py [--image PATH] [--mgrs T48SUE] [--revisits N]
+"""
+import argparse
+import json
+import pathlib
+import statistics
+import tempfile
+import time
+
+from osgeo import gdal
+
+from bignbit.apply_opera_hls_treatment import the_opera_hls_treatment, TreatmentOptions
+
+SAMPLE_IMAGE = pathlib.Path(__file__).resolve().parent.parent.joinpath(
+    'tests', 'data', 'OPERA_L3_DSWx-HLS_T48SUE_20190302T034350Z_20230131T222341Z_L8_30_v0.0_BROWSE.tiff')
+
+
+def revisit(image: pathlib.Path, mgrs_grid_code: str, working_dirpath: pathlib.Path, options: TreatmentOptions):
+    """Treat image once and return the elapsed seconds and the sub-tiles written"""
+    start = time.perf_counter()
+    sub_tiles = the_opera_hls_treatment(image, working_dirpath, mgrs_grid_code, options)
+    return time.perf_counter() - start, sub_tiles
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the index map resampling engine against gdal.Warp.")
+    parser.add_argument('--image', type=pathlib.Path, default=SAMPLE_IMAGE)
+    parser.add_argument('--mgrs', default='T48SUE')
+    parser.add_argument('--revisits', type=int, default=5)
+    args = parser.parse_args()
+
+    gdal.UseExceptions()
+    results = {'image': str(args.image), 'revisits': args.revisits}
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = pathlib.Path(tmp)
+        engines = {
+            'gdal': TreatmentOptions(sub_tile_grid='auto'),
+            'index_map': TreatmentOptions(sub_tile_grid='auto', resampling_engine='index_map',
+                                          index_map_dir=str(tmp.joinpath('index_maps')))
+        }
+        sub_tiles = {}
+        for name, options in engines.items():
+            seconds = []
+            for visit in range(args.revisits):
+                elapsed, sub_tiles[name] = revisit(args.image, args.mgrs, tmp.joinpath(name, str(visit)), options)
+                seconds.append(elapsed)
+            results[name] = {
+                'cold_seconds': seconds[0],
+                'warm_seconds': statistics.median(seconds[1:]) if len(seconds) > 1 else None
+            }
+
+        results['sub_tiles'] = len(sub_tiles['gdal'])
+        results['pixel_identical'] = all(
+            (gdal.Open(str(warped)).ReadAsArray() == gdal.Open(str(gathered)).ReadAsArray()).all()
+            for warped, gathered in zip(sub_tiles['gdal'], sub_tiles['index_map']))
+
+    if results['gdal']['warm_seconds'] and results['index_map']['warm_seconds']:
+        results['warm_speedup'] = results['gdal']['warm_seconds'] / results['index_map']['warm_seconds']
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
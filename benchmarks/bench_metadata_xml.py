@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+"""
+Compare generating and hashing the ImageryMetadata-v1.2 xml of every image set of a granule by building an
+ElementTree per image set (create_metadata_xml) with rendering it from a MetadataXmlTemplate built once per granule.
+
+Reports, as JSON, the time per image set of each generator, with and without the SHA512 hash computed for the CNM by
+get_mdxml_cnm_file_meta, and whether the outputs are byte identical.
+
+Usage:
+    python bench_metadata_xml.py [--image-sets N] [--repeat N]
+"""
+import argparse
+import hashlib
+import json
+import timeit
+from unittest.mock import patch
+
+from bignbit.handle_big_result import create_metadata_xml, MetadataXmlTemplate
+
+GRANULE = ('2019-03-02T03:43:50.000000Z', '2019-03-02T03:43:55.000000Z', '2019-03-02T03:44:00.000000Z', '2019061',
+           False, 'T48SUE')
+PRODUCTION_TIME = '2025-01-01T00:00:00.000000Z'
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ImageryMetadata xml generation.")
+    parser.add_argument('--image-sets', type=int, default=500, help="Image sets per granule")
+    parser.add_argument('--repeat', type=int, default=5, help="Granules timed; the best run is reported")
+    args = parser.parse_args()
+
+    def element_tree():
+        return [create_metadata_xml(*GRANULE) for _ in range(args.image_sets)]
+
+    def template():
+        granule_template = MetadataXmlTemplate(*GRANULE)
+        return [granule_template.render() for _ in range(args.image_sets)]
+
+    def hashed(generator):
+        return lambda: [hashlib.sha512(document).hexdigest() for document in generator()]
+
+    with patch('bignbit.handle_big_result._production_time', return_value=PRODUCTION_TIME):
+        results = {
+            'image_sets': args.image_sets,
+            'byte_identical': element_tree() == template()
+        }
+        for name, generator in (('element_tree', element_tree), ('template', template)):
+            for variant, function in (('', generator), ('_with_sha512', hashed(generator))):
+                seconds = min(timeit.repeat(function, number=1, repeat=args.repeat))
+                results[f'{name}{variant}_us_per_image_set'] = seconds / args.image_sets * 1e6
+
+    results['speedup'] = results['element_tree_us_per_image_set'] / results['template_us_per_image_set']
+    results['speedup_with_sha512'] = (results['element_tree_with_sha512_us_per_image_set']
+                                      / results['template_with_sha512_us_per_image_set'])
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+"""
+Compare loading the MGRS/GIBS intersection table from the original pickle with the lazily loaded sqlite index.
+
+Reports, as JSON, the time to make the table available (what a cold start pays at import), the time of the first and
+of subsequent lookups, and the peak Python memory allocated.
+
+Usage:
+    python bench_mgrs_gibs_index.py [--pickle PATH] [--synthetic-tiles N] [--lookups N]
+
+If --pickle is not given, or does not exist, a synthetic table of --synthetic-tiles tiles is generated instead.
+"""
+import argparse
+import json
+import pathlib
+import pickle
+import random
+import string
+import tempfile
+import time
+import tracemalloc
+
+from bignbit.mgrs_gibs_index import MgrsGibsIndex, build_index
+
+DATA_DIR = pathlib.Path(__file__).resolve().parent.parent.joinpath('bignbit', 'data')
+
+
+def synthetic_table(tiles: int) -> dict:
+    """Intersection table with the same shape as the IMPACT data: ~6 sub-tiles per MGRS tile"""
+    rng = random.Random(0)
+    letters = string.ascii_uppercase
+    table = {}
+    while len(table) < tiles:
+        code = f'{rng.randint(1, 60):02d}{rng.choice(letters)}{rng.choice(letters)}{rng.choice(letters)}'
+        col, row = rng.randint(1, 318), rng.randint(1, 158)
+        table[code] = [{'GID': f'{col + c:03d}{row + r:03d}',
+                        'minlon': -180 + (col + c - 1) * 1.125, 'minlat': -90 + (row + r - 1) * 1.125,
+                        'maxlon': -180 + (col + c) * 1.125, 'maxlat': -90 + (row + r) * 1.125}
+                       for c in range(3) for r in range(2)]
+    return table
+
+
+def measure(load, lookup, codes):
+    """Time load() and lookups of codes, tracking peak allocated memory"""
+    tracemalloc.start()
+    start = time.perf_counter()
+    table = load()
+    load_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    lookup(table, codes[0])
+    first_lookup_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for code in codes:
+        lookup(table, code)
+    lookup_seconds = (time.perf_counter() - start) / len(codes)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        'load_seconds': load_seconds,
+        'first_lookup_seconds': first_lookup_seconds,
+        'mean_lookup_seconds': lookup_seconds,
+        'peak_python_bytes': peak
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the MGRS/GIBS intersection index against the pickle.")
+    parser.add_argument('--pickle', type=pathlib.Path, default=DATA_DIR.joinpath('mgrs_gibs_intersection.json.pickle'))
+    parser.add_argument('--synthetic-tiles', type=int, default=57000)
+    parser.add_argument('--lookups', type=int, default=1000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        pickle_filepath = args.pickle
+        if not pickle_filepath.exists():
+            pickle_filepath = pathlib.Path(tmp).joinpath('synthetic.pickle')
+            with open(pickle_filepath, 'wb') as fp:
+                pickle.dump(synthetic_table(args.synthetic_tiles), fp)
+
+        with open(pickle_filepath, 'rb') as fp:
+            codes = list(pickle.load(fp))
+        codes = random.Random(1).choices(codes, k=args.lookups)
+
+        index_filepath = pathlib.Path(tmp).joinpath('index.sqlite')
+        with open(pickle_filepath, 'rb') as fp:
+            build_index(pickle.load(fp), index_filepath)
+
+        def load_pickle():
+            with open(pickle_filepath, 'rb') as fp:
+                return pickle.load(fp)
+
+        results = {
+            'source': str(args.pickle) if args.pickle.exists() else f'synthetic ({args.synthetic_tiles} tiles)',
+            'pickle_bytes': pickle_filepath.stat().st_size,
+            'index_bytes': index_filepath.stat().st_size,
+            'pickle': measure(load_pickle, lambda table, code: table[code], codes),
+            'sqlite': measure(lambda: MgrsGibsIndex(index_filepath), lambda table, code: table[code], codes)
+        }
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+"""
+Offline benchmark of the OPERA HLS treatment on synthetic UTM rasters and on the sample DSWx browse image.
+
+For every scenario the images are staged in a moto S3 bucket and treated stage by stage:
+
+    warp      the_opera_hls_treatment
+    checksum  create_file_metadata
+    upload    upload_transformed_images
+    end2end   transform_images (download, warp, checksum and upload, honouring --options)
+
+For each stage the wall time, CPU time, bytes written and peak resident memory are reported as JSON so runs can be
+compared. Synthetic scenarios cover a UTM tile (109.8 km, like an MGRS tile) at --sizes pixels square with --tiles
+images per scenario; sub-tiles are computed from the raster footprint so no intersection table is needed.
+
+Usage:
+    python bench_opera_hls_treatment.py [--sizes 1830 3660] [--tiles 1 4] [--no-sample]
+                                        [--options '{"maxWorkers": 4}'] [--output results.json]
+"""
+import argparse
+import contextlib
+import json
+import pathlib
+import tempfile
+import time
+
+import boto3
+import numpy as np
+from moto import mock_s3
+from osgeo import gdal, osr
+
+from bignbit.apply_opera_hls_treatment import (create_file_metadata, the_opera_hls_treatment, transform_images,
+                                               TreatmentOptions, upload_transformed_images)
+from bignbit.resource_monitor import ResourceMonitor
+
+SAMPLE_IMAGE = pathlib.Path(__file__).resolve().parent.parent.joinpath(
+    'tests', 'data', 'OPERA_L3_DSWx-HLS_T48SUE_20190302T034350Z_20230131T222341Z_L8_30_v0.0_BROWSE.tiff')
+MGRS_GRID_CODE = 'T48SUE'
+TILE_METERS = 109800
+
+
+def synthetic_image(filepath: pathlib.Path, size: int, seed: int):
+    """
+    Write a paletted DSWx-like Byte GeoTIFF of size x size pixels covering the T48SUE UTM tile, with a nodata
+    (255) swath along one edge like a partially covered acquisition
+    """
+    rng = np.random.default_rng(seed)
+    pixels = rng.choice(np.array([0, 1, 2, 3, 252], dtype=np.uint8), size=(size, size), p=[.6, .15, .1, .05, .1])
+    pixels[:, :size // 5] = 255
+
+    dataset = gdal.GetDriverByName('GTiff').Create(str(filepath), size, size, 1, gdal.GDT_Byte,
+                                                   options=['COMPRESS=DEFLATE', 'TILED=YES'])
+    dataset.SetGeoTransform((199980.0, TILE_METERS / size, 0.0, 3700020.0, 0.0, -TILE_METERS / size))
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(32648)
+    dataset.SetProjection(srs.ExportToWkt())
+    band = dataset.GetRasterBand(1)
+    band.WriteArray(pixels)
+    band.SetNoDataValue(255)
+    colors = gdal.ColorTable()
+    for value, color in ((0, (255, 255, 255)), (1, (0, 0, 255)), (2, (180, 213, 244)), (3, (0, 255, 255)),
+                         (252, (0, 0, 0))):
+        colors.SetColorEntry(value, color)
+    band.SetColorTable(colors)
+    dataset.FlushCache()
+
+
+@contextlib.contextmanager
+def stage(results: dict, name: str):
+    """
+    Record wall time, CPU time and peak RSS of the enclosed block in results[name]. The block may store the bytes it
+    wrote in the yielded dict under 'bytes_written'.
+    """
+    measurement = {'bytes_written': 0}
+    with ResourceMonitor(tempfile.gettempdir(), interval=0.02) as monitor:
+        wall, cpu = time.perf_counter(), time.process_time()
+        yield measurement
+        measurement['wall_seconds'] = time.perf_counter() - wall
+        measurement['cpu_seconds'] = time.process_time() - cpu
+    measurement['peak_rss_bytes'] = monitor.usage()['peak_rss_bytes']
+    results[name] = measurement
+
+
+def run_scenario(name: str, images: list, options: TreatmentOptions, workdir: pathlib.Path) -> dict:
+    """Stage images in (mocked) S3 and measure every stage of the treatment"""
+    s3_client = boto3.client('s3', region_name='us-east-1')
+    source_bucket, staging_bucket = f'{name}-source', f'{name}-staging'
+    s3_client.create_bucket(Bucket=source_bucket)
+    s3_client.create_bucket(Bucket=staging_bucket)
+    cma_file_list = []
+    for image in images:
+        s3_client.upload_file(str(image), source_bucket, f'granule/{image.name}')
+        cma_file_list.append({'fileName': image.name, 'bucket': source_bucket, 'key': f'granule/{image.name}'})
+
+    results = {'images': len(images), 'source_bytes': sum(image.stat().st_size for image in images), 'stages': {}}
+    stages = results['stages']
+    transformed = []
+    with stage(stages, 'warp') as measurement:
+        for index, image in enumerate(images):
+            transformed += the_opera_hls_treatment(image, workdir.joinpath('staged', str(index)), MGRS_GRID_CODE,
+                                                   options)
+        measurement['bytes_written'] = sum(pathlib.Path(t).stat().st_size for t in transformed
+                                           if not str(t).startswith('/vsimem/'))
+    results['sub_tiles'] = len(transformed)
+    with stage(stages, 'checksum'):
+        file_metadata = create_file_metadata(transformed, staging_bucket)
+    with stage(stages, 'upload') as measurement:
+        measurement['bytes_written'] = sum(pathlib.Path(f['local_filepath']).stat().st_size for f in file_metadata
+                                           if not f['local_filepath'].startswith('/vsimem/'))
+        upload_transformed_images(file_metadata)
+    with stage(stages, 'end2end') as measurement:
+        end2end = transform_images(cma_file_list, workdir.joinpath('end2end'), MGRS_GRID_CODE, staging_bucket, options)
+        measurement['bytes_written'] = sum(
+            s3_client.head_object(Bucket=staging_bucket, Key=f['key'])['ContentLength'] for f in end2end)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the OPERA HLS treatment offline.")
+    parser.add_argument('--sizes', type=int, nargs='*', default=[1830, 3660],
+                        help="Sizes in pixels of the synthetic square UTM rasters")
+    parser.add_argument('--tiles', type=int, nargs='*', default=[1, 4],
+                        help="Numbers of images treated together in the synthetic scenarios")
+    parser.add_argument('--no-sample', action='store_true', help="Skip the scenario using the sample DSWx image")
+    parser.add_argument('--options', default='{}', help="operaHLSTreatmentOptions as JSON")
+    parser.add_argument('--output', type=pathlib.Path, help="Also write the results to this file")
+    args = parser.parse_args()
+
+    gdal.UseExceptions()
+    treatment_options = {'subTileGrid': 'computed', **json.loads(args.options)}
+    options = TreatmentOptions.from_dataset_config({'operaHLSTreatmentOptions': treatment_options})
+    results = {'options': treatment_options, 'scenarios': {}}
+    with tempfile.TemporaryDirectory() as tmp, mock_s3():
+        tmp = pathlib.Path(tmp)
+        scenarios = {}
+        if not args.no_sample:
+            scenarios['sample'] = [SAMPLE_IMAGE]
+        for size in args.sizes:
+            for tiles in args.tiles:
+                images = []
+                for index in range(tiles):
+                    image = tmp.joinpath('images', f'{size}-{tiles}', SAMPLE_IMAGE.name.replace('v0.0', f'v{index}.0'))
+                    image.parent.mkdir(parents=True, exist_ok=True)
+                    synthetic_image(image, size, seed=index)
+                    images.append(image)
+                scenarios[f'synthetic-{size}px-{tiles}tiles'] = images
+
+        for name, images in scenarios.items():
+            results['scenarios'][name] = run_scenario(name, images, options, tmp.joinpath('work', name))
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        args.output.write_text(output)
+    print(output)
+
+
+if __name__ == '__main__':
+    main()
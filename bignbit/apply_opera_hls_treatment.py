@@ -2,35 +2,264 @@
 """
 Transforms each image in the input using specific processing required to produce an image for display in GITC
 """
+import concurrent.futures
+import contextlib
 import datetime
+import io
+import itertools
+import json
 import logging
+import math
 import os
 import pathlib
-import pickle
-from typing import Dict, List
+import resource
+import shutil
+import tempfile
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List
 
-import boto3
-import importlib_resources
+import numpy as np
 from cumulus_logger import CumulusLogger
 from cumulus_process import Process
-from osgeo import gdal
+from osgeo import gdal, osr
 
-from bignbit import utils
+from bignbit import gibs_grid, payload_offload, utils
+from bignbit.encoding_profiles import EncodingProfile
+from bignbit.index_maps import gather, index_map_key, IndexMap, IndexMapStore
+from bignbit.mgrs_gibs_index import MgrsGibsIndex
+from bignbit.opera_hls_output_cache import CHECKSUM_METADATA_KEY, OutputCache
+from bignbit.resource_monitor import ResourceMonitor
 
 CUMULUS_LOGGER = CumulusLogger('apply_opera_hls_treatment')
 
+GIBS_SRS = "+proj=longlat +ellps=WGS84 +datum=WGS84 +no_defs"
+GIBS_RESOLUTION = 2.74658203125e-4
 
-def load_mgrs_gibs_intersection():
+
+# Loaded lazily on the first lookup so module import does not pay to read the table
+MGRS_GIBS_INTERSECTION = MgrsGibsIndex.packaged()
+
+
+@dataclass
+class TreatmentOptions:  # pylint: disable=too-many-instance-attributes
     """
-        load gibs intersection json pickle file
+    Tuning options for the OPERA HLS treatment. Populated from the optional ``operaHLSTreatmentOptions`` object in the
+    dataset configuration; every option defaults to the original serial behavior.
+
+    Attributes
+    ----------
+    max_workers
+        Number of sub-tiles warped concurrently. 1 warps the sub-tiles one after another.
+    executor
+        'thread' or 'process'. Process pools require /dev/shm which is not available in AWS Lambda.
+    gdal_cachemax_mb
+        GDAL block cache size in megabytes made available to each worker
+    gdal_num_threads
+        Number of threads (or 'ALL_CPUS') GDAL uses within a single warp operation
+    warp_memory_mb
+        Memory in megabytes gdal.Warp may use for its working buffers. Larger warps are processed in chunks that fit.
+        None for the GDAL default of 64 MB.
+    warp_optimize_size
+        Split warps into chunks aligned with the output blocks (GDAL warp option OPTIMIZE_SIZE) so that each output
+        block is written once, which bounds memory and temporary file growth for large outputs
+    shared_warped_vrt
+        Open the source image once and cut every sub-tile from a single warped VRT instead of warping each sub-tile
+        from the source image
+    stream_source
+        Read the source image directly from S3 with GDAL range requests instead of downloading it to local disk first
+    vsi_cache_size_mb
+        Size in megabytes of the GDAL VSI cache used when streaming the source image
+    in_memory_output
+        Write sub-tiles to GDAL's /vsimem/ in-memory file system instead of local disk, then hash and upload them
+        straight from memory. Not supported with the 'process' executor.
+    pipeline
+        Overlap downloading, warping, checksumming and uploading in transform_images instead of running them one after
+        another for each file
+    pipeline_queue_size
+        Maximum number of source images downloaded ahead of the warp stage, and of finished sub-tiles waiting to be
+        checksummed and uploaded
+    pipeline_upload_workers
+        Number of threads checksumming and uploading finished sub-tiles
+    skip_empty_sub_tiles
+        Skip sub-tiles that would contain only nodata. Sub-tiles that do not touch the valid-data footprint of the
+        source (evaluated on a low resolution copy of its mask) are not warped at all, and sub-tiles whose warped
+        output has no valid pixels are dropped.
+    footprint_size
+        Size in pixels of the longest side of the low resolution mask used to evaluate the source footprint
+    reuse_outputs
+        Store sub-tiles under a key derived from the source ETag, MGRS grid code and output parameters, and reuse the
+        sub-tiles already in the staging bucket instead of reprocessing a source image whose outputs all exist
+    encoding
+        Driver and compression used to write the sub-tiles
+    sub_tile_grid
+        How the GIBS sub-tiles of a granule are found. 'table' looks the MGRS grid code up in the MGRS/GIBS
+        intersection index, 'computed' computes the sub-tiles intersecting the footprint of the source image, 'auto'
+        uses the index and computes the sub-tiles of MGRS grid codes that are not in it.
+    resampling_engine
+        'gdal' warps every sub-tile with gdal.Warp. 'index_map' resamples with nearest neighbour source-pixel index
+        maps that are computed with gdal.Warp once per MGRS tile, GID and source grid and then reused, giving
+        identical pixels. Can not be combined with shared_warped_vrt, warp_memory_mb or warp_optimize_size, which
+        change how gdal.Warp chunks a sub-tile and so which source pixels it picks.
+    index_map_dir
+        Local directory in which index maps are kept
+    index_map_max_mb
+        Size in megabytes above which the least recently used index maps are deleted from index_map_dir
+    index_map_bucket
+        Optional S3 bucket in which index maps are kept so they outlive the local directory
+    record_resource_usage
+        Sample the peak memory, /tmp and GDAL block cache usage of the treatment on a background thread and report it
+        under 'opera_hls_resource_usage'
     """
-    ref = importlib_resources.files('bignbit').joinpath('data/mgrs_gibs_intersection.json.pickle')
-    with ref.open('rb') as fp:
-        data = pickle.load(fp)
-    return data
+    max_workers: int = 1
+    executor: str = 'thread'
+    gdal_cachemax_mb: int | None = None
+    gdal_num_threads: int | str | None = None
+    warp_memory_mb: int | None = None
+    warp_optimize_size: bool = False
+    shared_warped_vrt: bool = False
+    stream_source: bool = False
+    vsi_cache_size_mb: int = 64
+    in_memory_output: bool = False
+    pipeline: bool = False
+    pipeline_queue_size: int = 4
+    pipeline_upload_workers: int = 4
+    skip_empty_sub_tiles: bool = False
+    footprint_size: int = 512
+    reuse_outputs: bool = False
+    encoding: EncodingProfile = field(default_factory=EncodingProfile)
+    sub_tile_grid: str = 'auto'
+    resampling_engine: str = 'gdal'
+    index_map_dir: str = '/tmp/index_maps'
+    index_map_max_mb: int = 256
+    index_map_bucket: str | None = None
+    record_resource_usage: bool = False
+
+    def __post_init__(self):
+        if self.executor not in ('thread', 'process'):
+            raise ValueError(f"Unsupported executor '{self.executor}', must be 'thread' or 'process'")
+        if self.in_memory_output and self.executor == 'process':
+            # /vsimem/ files written in a child process are not visible to the parent
+            raise ValueError("In-memory output can not be used with the 'process' executor")
+        if self.sub_tile_grid not in ('auto', 'table', 'computed'):
+            raise ValueError(f"Unsupported sub-tile grid '{self.sub_tile_grid}', must be 'auto', 'table' or 'computed'")
+        if self.resampling_engine not in ('gdal', 'index_map'):
+            raise ValueError(f"Unsupported resampling engine '{self.resampling_engine}', must be 'gdal' or 'index_map'")
+        if self.resampling_engine == 'index_map' and self.shared_warped_vrt:
+            raise ValueError("The 'index_map' resampling engine can not be used with a shared warped VRT")
+        if self.resampling_engine == 'index_map' and (self.warp_memory_mb or self.warp_optimize_size):
+            # The index map is warped in a single chunk, like the Byte warp of a sub-tile with the default settings
+            raise ValueError("The 'index_map' resampling engine can not be used with warpMemoryMB or warpOptimizeSize")
+
+    @classmethod
+    def from_dataset_config(cls, dataset_config: dict) -> 'TreatmentOptions':
+        """
+        Build the treatment options from a dataset configuration
+
+        Parameters
+        ----------
+        dataset_config
+            The dataset configuration ('datasetConfigurationForBIG.config') for the collection being processed
+
+        Returns
+        -------
+        TreatmentOptions
+            Options found in the dataset configuration, defaults for anything not specified
+        """
+        options = dataset_config.get('operaHLSTreatmentOptions', {})
+        gdal_cachemax_mb = options.get('gdalCacheMaxMB')
+        warp_memory_mb = options.get('warpMemoryMB')
+
+        return cls(
+            max_workers=max(1, int(options.get('maxWorkers', 1))),
+            executor=options.get('executor', 'thread').lower(),
+            gdal_cachemax_mb=int(gdal_cachemax_mb) if gdal_cachemax_mb is not None else None,
+            gdal_num_threads=options.get('gdalNumThreads'),
+            warp_memory_mb=int(warp_memory_mb) if warp_memory_mb is not None else None,
+            warp_optimize_size=bool(options.get('warpOptimizeSize', False)),
+            shared_warped_vrt=bool(options.get('sharedWarpedVrt', False)),
+            stream_source=bool(options.get('streamSource', False)),
+            vsi_cache_size_mb=int(options.get('vsiCacheSizeMB', 64)),
+            in_memory_output=bool(options.get('inMemoryOutput', False)),
+            pipeline=bool(options.get('pipeline', False)),
+            pipeline_queue_size=max(1, int(options.get('pipelineQueueSize', 4))),
+            pipeline_upload_workers=max(1, int(options.get('pipelineUploadWorkers', 4))),
+            skip_empty_sub_tiles=bool(options.get('skipEmptySubTiles', False)),
+            footprint_size=max(1, int(options.get('footprintSize', 512))),
+            reuse_outputs=bool(options.get('reuseOutputs', False)),
+            encoding=EncodingProfile.from_config(options.get('outputEncoding')),
+            sub_tile_grid=options.get('subTileGrid', 'auto').lower(),
+            resampling_engine=options.get('resamplingEngine', 'gdal').lower(),
+            index_map_dir=options.get('indexMapDir', '/tmp/index_maps'),
+            index_map_max_mb=max(1, int(options.get('indexMapMaxMB', 256))),
+            index_map_bucket=options.get('indexMapBucket'),
+            record_resource_usage=bool(options.get('recordResourceUsage', False))
+        )
+
+    def output_parameters(self) -> Dict:
+        """
+        Parameters that determine the content of the sub-tiles, used to identify reusable outputs
+        """
+        return {
+            'srs': GIBS_SRS,
+            'resolution': GIBS_RESOLUTION,
+            'format': self.encoding.driver,
+            'creationOptions': self.encoding.creation_options(),
+            'sharedWarpedVrt': self.shared_warped_vrt,
+            # Skipped sub-tiles are recorded under the same key prefix, so runs that skip differently must not share it
+            'skipEmptySubTiles': self.skip_empty_sub_tiles,
+            'footprintSize': self.footprint_size if self.skip_empty_sub_tiles else None
+        }
+
+    def warp_kwargs(self) -> Dict:
+        """
+        Keyword arguments for gdal.Warp controlling threads, memory and chunking
+        """
+        warp_kwargs = {}
+        warp_options = []
+        if self.gdal_num_threads:
+            warp_kwargs['multithread'] = True
+            warp_options.append(f'NUM_THREADS={self.gdal_num_threads}')
+        if self.warp_optimize_size:
+            warp_options.append('OPTIMIZE_SIZE=TRUE')
+        if warp_options:
+            warp_kwargs['warpOptions'] = warp_options
+        if self.warp_memory_mb:
+            warp_kwargs['warpMemoryLimit'] = self.warp_memory_mb * 1024 * 1024
+        return warp_kwargs
 
+    def gdal_cachemax_bytes(self, concurrent_treatments: int = 1) -> int | None:
+        """
+        Size of the process-wide GDAL block cache for concurrent_treatments treatments with these options, or None when
+        gdal_cachemax_mb is not set. Thread workers share the cache, so it holds gdal_cachemax_mb for each of them;
+        process workers size their own cache, leaving gdal_cachemax_mb to each treatment in the calling process.
+        """
+        if not self.gdal_cachemax_mb:
+            return None
+        workers = self.max_workers if self.executor == 'thread' else 1
+        return self.gdal_cachemax_mb * 1024 * 1024 * workers * max(1, concurrent_treatments)
+
+    def index_map_store(self) -> IndexMapStore:
+        """
+        Where index maps are kept for the 'index_map' resampling engine
+        """
+        return IndexMapStore(self.index_map_dir, self.index_map_bucket, max_bytes=self.index_map_max_mb * 1024 * 1024)
 
-MGRS_GIBS_INTERSECTION = load_mgrs_gibs_intersection()
+    def vsi_config_options(self) -> Dict[str, str]:
+        """
+        GDAL configuration options used while reading a streamed source image. Empty when the source is not streamed.
+        """
+        if not self.stream_source:
+            return {}
+        return {
+            'VSI_CACHE': 'TRUE',
+            'VSI_CACHE_SIZE': str(self.vsi_cache_size_mb * 1024 * 1024),
+            # Avoid listing the "directory" of the object on open, the image has no sidecar files
+            'GDAL_DISABLE_READDIR_ON_OPEN': 'EMPTY_DIR',
+            'GDAL_HTTP_MERGE_CONSECUTIVE_RANGES': 'YES',
+            'GDAL_HTTP_MULTIPLEX': 'YES'
+        }
 
 
 class CMA(Process):
@@ -41,6 +270,7 @@ class CMA(Process):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.logger = CUMULUS_LOGGER
+        self.input = payload_offload.OffloadedPayload(self.input)
 
     def process(self) -> List[Dict]:
         """
@@ -49,24 +279,145 @@ class CMA(Process):
         Returns
         -------
         List[Dict]
-          A list of CMA file dictionaries pointing to the transformed image(s)
+          A list of CMA file dictionaries pointing to the transformed image(s). When resource usage is recorded, the
+          peak memory, /tmp and GDAL cache usage of the treatment is reported under 'opera_hls_resource_usage'. When
+          empty sub-tiles are skipped, the skipped sub-tiles are listed under 'opera_hls_skipped_sub_tiles'.
         """
         cma_file_list = self.input['big']
         staging_bucket = self.config.get('bignbit_staging_bucket')
 
+        options = TreatmentOptions.from_dataset_config(self.input.get('datasetConfigurationForBIG', {}).get('config', {}))
+
         mgrs_grid_code = utils.extract_mgrs_grid_code(self.input['granule_umm_json'])
-        file_metadata_list = transform_images(cma_file_list, pathlib.Path(f"{self.path}"), mgrs_grid_code,
-                                              staging_bucket)
+        skipped_sub_tiles = []
+        resource_usage = {}
+        try:
+            file_metadata_list = transform_images(cma_file_list, pathlib.Path(f"{self.path}"), mgrs_grid_code,
+                                                  staging_bucket, options, skipped_sub_tiles, resource_usage)
+        finally:
+            # A failed treatment must not leave in-memory sub-tiles behind in the warm Lambda
+            remove_in_memory_dir(pathlib.Path(f"{self.path}"))
         del self.input['big']
         self.input['big'] = file_metadata_list
+        if options.record_resource_usage:
+            self.input['opera_hls_resource_usage'] = resource_usage
+        if options.skip_empty_sub_tiles:
+            CUMULUS_LOGGER.info(f'Skipped {len(skipped_sub_tiles)} empty sub-tiles, '
+                                f'produced {len(file_metadata_list)} sub-tiles')
+            self.input['opera_hls_skipped_sub_tiles'] = skipped_sub_tiles
+        return payload_offload.offload_payload(self.input)
+
+
+class BatchCMA(Process):
+    """
+    A cumulus message adapter treating many granules in one invocation, for backfills. The input holds a 'granules'
+    list, see process_granules, and the output reports the result and any failure of every granule.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.logger = CUMULUS_LOGGER
+
+    def process(self) -> Dict:
+        """
+        Applies the OPERA HLS treatment to every granule in the input
+
+        Returns
+        -------
+        Dict
+          The input with 'granules' replaced by the per-granule results and the per-granule errors under 'failures'
+        """
+        staging_bucket = self.config.get('bignbit_staging_bucket')
+        options = TreatmentOptions.from_dataset_config(self.input.get('datasetConfigurationForBIG', {}).get('config', {}))
+        granule_workers = int(self.config.get('granule_workers', 1))
+
+        results = process_granules(self.input['granules'], pathlib.Path(f"{self.path}"), staging_bucket, options,
+                                   granule_workers)
+        self.input['granules'] = results['granules']
+        self.input['failures'] = results['failures']
         return self.input
 
 
+def process_granules(granules: List[Dict], temp_dir: pathlib.Path, staging_bucket: str,
+                     options: TreatmentOptions | None = None, granule_workers: int = 1) -> Dict[str, List[Dict]]:
+    """
+    Apply the OPERA HLS treatment to many granules sharing one process, so module import, the MGRS/GIBS index and
+    the AWS clients are set up once instead of once per granule. Granules are treated on a pool of granule_workers
+    threads. A failing granule is recorded and does not stop the others.
+
+    Parameters
+    ----------
+    granules
+        Granules to treat. Each is a dict with a 'granuleId', the CMA file list of its images under 'big' and either
+        its 'mgrs_grid_code' or its 'granule_umm_json' from which the MGRS grid code is extracted.
+    temp_dir
+        Temporary working directory on local disk. Each granule works in its own sub-directory, removed once the
+        granule is done.
+    staging_bucket
+        Staging bucket to which transformed files should be written
+    options
+        Tuning options for the treatment of every granule. The GDAL configuration options and block cache are set once
+        for the batch, see TreatmentOptions.gdal_cachemax_bytes.
+    granule_workers
+        Number of granules treated concurrently
+
+    Returns
+    -------
+    Dict[str, List[Dict]]
+        'granules': for every successful granule, in input order, its 'granuleId', 'mgrs_grid_code', transformed file
+        metadata under 'big', skipped sub-tiles under 'opera_hls_skipped_sub_tiles' and, when options record it,
+        resource usage under 'opera_hls_resource_usage'.
+        'failures': for every failed granule, in input order, its 'granuleId' with the 'errorType' and 'error' message.
+    """
+    options = options or TreatmentOptions()
+
+    def treat(granule_index: int, granule: Dict) -> Dict:
+        granule_dir = temp_dir.joinpath(f'granule_{granule_index:06d}')
+        try:
+            mgrs_grid_code = granule.get('mgrs_grid_code') or utils.extract_mgrs_grid_code(granule['granule_umm_json'])
+            skipped_sub_tiles = []
+            resource_usage = {}
+            file_metadata_list = transform_images(granule['big'], granule_dir, mgrs_grid_code, staging_bucket, options,
+                                                  skipped_sub_tiles, resource_usage, set_gdal_cache=False)
+            result = {
+                'granuleId': granule.get('granuleId'),
+                'mgrs_grid_code': mgrs_grid_code,
+                'big': file_metadata_list,
+                'opera_hls_skipped_sub_tiles': skipped_sub_tiles
+            }
+            if options.record_resource_usage:
+                result['opera_hls_resource_usage'] = resource_usage
+            return result
+        finally:
+            remove_in_memory_dir(granule_dir)
+            shutil.rmtree(granule_dir, ignore_errors=True)
+
+    results = {'granules': [], 'failures': []}
+    # GDAL configuration options and block cache size are process-wide, so they are set once for the batch. Granule
+    # threads setting and restoring them would undo them under the granules still being treated.
+    cachemax_bytes = options.gdal_cachemax_bytes(granule_workers)
+    with gdal_config_options(options.vsi_config_options()), gdal_cache_max(cachemax_bytes), \
+            concurrent.futures.ThreadPoolExecutor(max_workers=max(1, granule_workers)) as executor:
+        futures = [executor.submit(treat, granule_index, granule) for granule_index, granule in enumerate(granules)]
+        for granule, future in zip(granules, futures):
+            try:
+                results['granules'].append(future.result())
+            except Exception as e:  # pylint: disable=broad-except
+                CUMULUS_LOGGER.error(f"Failed to treat granule {granule.get('granuleId')}: {e}")
+                results['failures'].append({'granuleId': granule.get('granuleId'), 'errorType': type(e).__name__,
+                                            'error': str(e)})
+
+    CUMULUS_LOGGER.info(f"Treated {len(results['granules'])} granules, {len(results['failures'])} failed")
+    return results
+
+
 def transform_images(cma_file_list: List[Dict], temp_dir: pathlib.Path, mgrs_grid_code: str,
-                     staging_bucket: str) -> List[Dict]:
+                     staging_bucket: str, options: TreatmentOptions | None = None,
+                     skipped_sub_tiles: List[Dict] | None = None,
+                     resource_usage: Dict | None = None, set_gdal_cache: bool = True) -> List[Dict]:
     """
     Applies special OPERA HLS processing to each input image. Each input image will result in multiple output transformed
-    images.
+    images. The GDAL block cache is sized for options (see TreatmentOptions.gdal_cachemax_bytes) for the whole call.
 
     Parameters
     ----------
@@ -78,43 +429,310 @@ def transform_images(cma_file_list: List[Dict], temp_dir: pathlib.Path, mgrs_gri
         MGRS grid code for the current granule being processed
     staging_bucket
         Staging bucket to which transformed files should be written
+    options
+        Tuning options for the treatment, defaults to TreatmentOptions()
+    skipped_sub_tiles
+        Optional list that a dict is appended to for every sub-tile skipped because it was empty
+    resource_usage
+        Optional dict that is updated with the peak RSS, peak /tmp usage and peak GDAL block cache usage of this call
+        (see ResourceMonitor.usage) when options.record_resource_usage is set
+    set_gdal_cache
+        Size the process-wide GDAL block cache for this call. False when the caller sized it already, such as
+        process_granules for a whole batch.
 
     Returns
     -------
     List[Dict]
         List of CMA File metadata dicts for each transformed image
     """
-    file_metadata_results = []
-    for cma_file_meta in cma_file_list:
-        granule_filename = cma_file_meta['filename'] if 'filename' in cma_file_meta else cma_file_meta['fileName']
-        CUMULUS_LOGGER.info(f'Processing file {granule_filename}')
+    options = options or TreatmentOptions()
+    with gdal_cache_max(options.gdal_cachemax_bytes() if set_gdal_cache else None):
+        if not options.record_resource_usage:
+            return _transform_images(cma_file_list, temp_dir, mgrs_grid_code, staging_bucket, options,
+                                     skipped_sub_tiles)
+
+        with ResourceMonitor(tempfile.gettempdir(), probes={'gdal_cache_bytes': gdal.GetCacheUsed}) as monitor:
+            file_metadata_results = _transform_images(cma_file_list, temp_dir, mgrs_grid_code, staging_bucket,
+                                                      options, skipped_sub_tiles)
+        usage = {**monitor.usage(), 'gdal_cache_max_bytes': gdal.GetCacheMax()}
+
+    CUMULUS_LOGGER.info(f'Resource usage: {json.dumps(usage)}')
+    if resource_usage is not None:
+        resource_usage.update(usage)
+    return file_metadata_results
 
-        # Download the file for processing
-        source_image_local_filepath = get_file(cma_file_meta['bucket'], cma_file_meta['key'],
-                                               temp_dir.joinpath(cma_file_meta['key']))
-        CUMULUS_LOGGER.info(f'Downloaded: {source_image_local_filepath}')
 
-        # Reproject and resample image to sub-tiles
-        transformed_images_dirpath = temp_dir.joinpath(source_image_local_filepath.stem)
-        transformed_images_dirpath.mkdir(parents=True)
-        transformed_images_filepaths = the_opera_hls_treatment(source_image_local_filepath, transformed_images_dirpath,
-                                                               mgrs_grid_code)
-        CUMULUS_LOGGER.info(f'Created new images: {[str(t) for t in transformed_images_filepaths]}')
+def _transform_images(cma_file_list: List[Dict], temp_dir: pathlib.Path, mgrs_grid_code: str,
+                      staging_bucket: str, options: TreatmentOptions,
+                      skipped_sub_tiles: List[Dict] | None = None) -> List[Dict]:
+    """
+    Applies the treatment to every input image, reusing existing outputs when enabled. See transform_images.
+    """
+    file_metadata_per_file: List[List[Dict] | None] = [None] * len(cma_file_list)
+    key_prefixes: List[str | None] = [None] * len(cma_file_list)
+    sub_tile_filenames = []
+    skipped = [] if skipped_sub_tiles is None else skipped_sub_tiles
+    if options.reuse_outputs:
+        cache = OutputCache(staging_bucket, options.output_parameters())
+        for file_index, cma_file_meta in enumerate(cma_file_list):
+            key_prefixes[file_index] = cache.prefix_for(cma_file_meta['bucket'], cma_file_meta['key'], mgrs_grid_code)
+            # Only the header of the source is read, and only when the sub-tiles have to be computed from its footprint
+            with gdal_config_options(options.vsi_config_options()):
+                sub_tiles = _find_sub_tiles(mgrs_grid_code, f"/vsis3/{cma_file_meta['bucket']}/{cma_file_meta['key']}",
+                                            options.sub_tile_grid)
+            sub_tile_filenames.append([_sub_tile_filename(pathlib.PurePosixPath(cma_file_meta['key']).name,
+                                                          mgrs_grid_code, sub_tile['GID'])
+                                       for sub_tile in sub_tiles])
+            file_metadata_per_file[file_index] = cache.lookup(key_prefixes[file_index], sub_tile_filenames[file_index],
+                                                              skipped)
+            if file_metadata_per_file[file_index] is not None:
+                CUMULUS_LOGGER.info(f'Reusing {len(file_metadata_per_file[file_index])} existing sub-tiles for '
+                                    f'{cma_file_meta["key"]} from s3://{staging_bucket}/{key_prefixes[file_index]}')
 
-        # Create new file metadata for each new image
-        file_metadata_dicts = create_file_metadata(transformed_images_filepaths, staging_bucket)
-        file_metadata_results.extend(file_metadata_dicts)
+    to_process = [file_index for file_index, file_metadata in enumerate(file_metadata_per_file) if file_metadata is None]
+    if options.pipeline:
+        processed = _transform_images_pipelined([cma_file_list[i] for i in to_process], temp_dir, mgrs_grid_code,
+                                                staging_bucket, options, skipped,
+                                                [key_prefixes[i] for i in to_process])
+    else:
+        processed = [_transform_image(cma_file_list[i], temp_dir, mgrs_grid_code, staging_bucket, options,
+                                      skipped, key_prefixes[i])
+                     for i in to_process]
 
-        # Upload new images to s3
-        s3_uris = upload_transformed_images(file_metadata_dicts)
-        CUMULUS_LOGGER.info(f'Uploaded files: {s3_uris}')
+    for file_index, file_metadata in zip(to_process, processed):
+        file_metadata_per_file[file_index] = file_metadata
+        if options.reuse_outputs and options.skip_empty_sub_tiles:
+            # Remember the sub-tiles that were skipped as empty so a re-run does not have to reprocess the file
+            produced = {f['fileName'] for f in file_metadata}
+            skipped_by_name = {s['fileName']: s for s in skipped}
+            cache.mark_empty(key_prefixes[file_index],
+                             [skipped_by_name.get(name, {'GID': None, 'fileName': name, 'reason': 'empty'})
+                              for name in sub_tile_filenames[file_index] if name not in produced])
 
-        CUMULUS_LOGGER.info(f'Finished processing file {granule_filename}')
+    if options.reuse_outputs:
+        # Report skipped sub-tiles in sub-tile order, so reused and reprocessed files give the same output
+        order = {name: index for index, name in enumerate(itertools.chain.from_iterable(sub_tile_filenames))}
+        skipped.sort(key=lambda sub_tile: order.get(sub_tile['fileName'], len(order)))
 
     # List returned is CMA file metadata dicts for all images.
+    return list(itertools.chain.from_iterable(file_metadata_per_file))
+
+
+def _transform_image(cma_file_meta: Dict, temp_dir: pathlib.Path, mgrs_grid_code: str, staging_bucket: str,
+                     options: TreatmentOptions, skipped_sub_tiles: List[Dict] | None = None,
+                     key_prefix: str | None = None) -> List[Dict]:
+    """
+    Download, transform and upload a single input image, see transform_images
+    """
+    granule_filename = cma_file_meta['filename'] if 'filename' in cma_file_meta else cma_file_meta['fileName']
+    CUMULUS_LOGGER.info(f'Processing file {granule_filename}')
+
+    # Stream or download the file for processing
+    source_image_filepath = get_source_image(cma_file_meta['bucket'], cma_file_meta['key'],
+                                             temp_dir.joinpath(cma_file_meta['key']), options)
+
+    # Reproject and resample image to sub-tiles
+    transformed_images_dirpath = temp_dir.joinpath(source_image_filepath.stem)
+    transformed_images_dirpath.mkdir(parents=True)
+    with gdal_config_options(options.vsi_config_options()):
+        transformed_images_filepaths = the_opera_hls_treatment(source_image_filepath, transformed_images_dirpath,
+                                                               mgrs_grid_code, options,
+                                                               skipped_sub_tiles=skipped_sub_tiles)
+    CUMULUS_LOGGER.info(f'Created new images: {[str(t) for t in transformed_images_filepaths]}')
+    if options.in_memory_output:
+        in_memory_bytes = sum(gdal.VSIStatL(str(t)).size for t in transformed_images_filepaths)
+        CUMULUS_LOGGER.info(f'In-memory output for {granule_filename}: {in_memory_bytes} bytes')
+
+    # Create new file metadata for each new image
+    file_metadata_dicts = create_file_metadata(transformed_images_filepaths, staging_bucket, key_prefix)
+
+    # Upload new images to s3
+    s3_uris = upload_transformed_images(file_metadata_dicts)
+    CUMULUS_LOGGER.info(f'Uploaded files: {s3_uris}')
+
+    CUMULUS_LOGGER.info(f'Finished processing file {granule_filename}, peak RSS {peak_rss_bytes()} bytes')
+    return file_metadata_dicts
+
+
+def _transform_images_pipelined(cma_file_list: List[Dict], temp_dir: pathlib.Path, mgrs_grid_code: str,
+                                staging_bucket: str, options: TreatmentOptions,
+                                skipped_sub_tiles: List[Dict] | None = None,
+                                key_prefixes: List[str | None] | None = None) -> List[List[Dict]]:
+    """
+    Pipelined variant of transform_images. Source images are fetched up to options.pipeline_queue_size files ahead of
+    the warp stage on a background thread, and each sub-tile is checksummed and uploaded on a pool of
+    options.pipeline_upload_workers threads as soon as it has been written, while the remaining sub-tiles are still
+    being warped. At most options.pipeline_queue_size finished sub-tiles wait for upload before warping pauses.
+
+    Returns the file metadata of each input image in the same order as transform_images. Time spent in each stage is
+    logged once all files are done.
+    """
+    key_prefixes = key_prefixes or [None] * len(cma_file_list)
+    timings = StageTimings()
+    upload_slots = threading.BoundedSemaphore(options.pipeline_queue_size)
+    results: Dict[tuple, concurrent.futures.Future] = {}
+
+    def fetch(cma_file_meta: Dict) -> pathlib.PurePath:
+        with timings.stage('download'):
+            return get_source_image(cma_file_meta['bucket'], cma_file_meta['key'],
+                                    temp_dir.joinpath(cma_file_meta['key']), options)
+
+    def checksum_and_upload(transformed_image: pathlib.PurePath, key_prefix: str | None) -> Dict:
+        try:
+            with timings.stage('checksum'):
+                file_metadata = create_file_metadata([transformed_image], staging_bucket, key_prefix)[0]
+            with timings.stage('upload'):
+                upload_transformed_images([file_metadata])
+            return file_metadata
+        finally:
+            upload_slots.release()
+
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as downloader, \
+            concurrent.futures.ThreadPoolExecutor(max_workers=options.pipeline_upload_workers) as uploader:
+        downloads = [downloader.submit(fetch, cma_file_meta)
+                     for cma_file_meta in cma_file_list[:options.pipeline_queue_size]]
+        try:
+            for file_index, cma_file_meta in enumerate(cma_file_list):
+                if file_index + options.pipeline_queue_size < len(cma_file_list):
+                    downloads.append(downloader.submit(fetch, cma_file_list[file_index + options.pipeline_queue_size]))
+                source_image_filepath = downloads[file_index].result()
+
+                def enqueue_upload(sub_tile_index: int, transformed_image: pathlib.PurePath, file_index=file_index):
+                    upload_slots.acquire()  # pylint: disable=consider-using-with
+                    results[(file_index, sub_tile_index)] = uploader.submit(checksum_and_upload, transformed_image,
+                                                                            key_prefixes[file_index])
+
+                transformed_images_dirpath = temp_dir.joinpath(source_image_filepath.stem)
+                transformed_images_dirpath.mkdir(parents=True)
+                with timings.stage('warp'), gdal_config_options(options.vsi_config_options()):
+                    the_opera_hls_treatment(source_image_filepath, transformed_images_dirpath, mgrs_grid_code, options,
+                                            on_sub_tile_complete=enqueue_upload, skipped_sub_tiles=skipped_sub_tiles)
+                CUMULUS_LOGGER.info(f'Finished warping {cma_file_meta["key"]}')
+        except BaseException:
+            for download in downloads:
+                download.cancel()
+            raise
+
+        file_metadata_results = [[] for _ in cma_file_list]
+        for file_index, sub_tile_index in sorted(results):
+            file_metadata_results[file_index].append(results[(file_index, sub_tile_index)].result())
+
+    timings.seconds['total'] = time.perf_counter() - start
+    CUMULUS_LOGGER.info(f'Pipeline stage timings (seconds): {timings.seconds}, peak RSS {peak_rss_bytes()} bytes')
     return file_metadata_results
 
 
+class StageTimings:  # pylint: disable=too-few-public-methods
+    """
+    Thread safe accumulator of the time spent in named processing stages
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.seconds: Dict[str, float] = {}
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        """
+        Context manager adding the time spent inside it to the total for stage name
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.seconds[name] = self.seconds.get(name, 0.0) + elapsed
+
+
+def get_source_image(bucket: str, key: str, local_filepath: pathlib.Path,
+                     options: TreatmentOptions | None = None) -> pathlib.PurePath:
+    """
+    Locate the source image for GDAL. When options.stream_source is set, the object is read in place through GDAL's
+    /vsis3/ virtual file system using range requests; if GDAL cannot open it that way the object is downloaded to
+    local_filepath instead.
+
+    Parameters
+    ----------
+    bucket
+        Name of bucket
+    key
+        Key of object in bucket
+    local_filepath
+        Full path including filename of location object should be downloaded to if it is not streamed
+    options
+        Tuning options for the treatment, defaults to TreatmentOptions()
+
+    Returns
+    -------
+    pathlib.PurePath
+        The /vsis3/ path of the object or the path to the downloaded file
+    """
+    options = options or TreatmentOptions()
+    if options.stream_source:
+        vsi_path = pathlib.PurePosixPath(f'/vsis3/{bucket}/{key}')
+        with gdal_config_options(options.vsi_config_options()):
+            try:
+                dataset = gdal.Open(str(vsi_path))
+            except RuntimeError as e:
+                CUMULUS_LOGGER.warning(f'Unable to open {vsi_path}: {e}')
+                dataset = None
+        if dataset is not None:
+            CUMULUS_LOGGER.info(f'Streaming: {vsi_path}')
+            return vsi_path
+        CUMULUS_LOGGER.warning(f'Could not stream {vsi_path}, falling back to download')
+
+    source_image_local_filepath = get_file(bucket, key, local_filepath)
+    CUMULUS_LOGGER.info(f'Downloaded: {source_image_local_filepath}')
+    return source_image_local_filepath
+
+
+@contextlib.contextmanager
+def gdal_config_options(config_options: Dict[str, str]):
+    """
+    Context manager that sets GDAL configuration options and restores their previous values on exit. GDAL
+    configuration options are process-wide; options that already have the requested value are neither set nor
+    restored, so nested uses under options set for a whole batch (see process_granules) leave them alone.
+
+    Parameters
+    ----------
+    config_options
+        GDAL configuration option names and values
+    """
+    previous = {name: gdal.GetConfigOption(name) for name, value in config_options.items()
+                if gdal.GetConfigOption(name) != value}
+    try:
+        for name in previous:
+            gdal.SetConfigOption(name, config_options[name])
+        yield
+    finally:
+        for name, value in previous.items():
+            gdal.SetConfigOption(name, value)
+
+
+@contextlib.contextmanager
+def gdal_cache_max(cachemax_bytes: int | None):
+    """
+    Context manager that sets the process-wide GDAL block cache to cachemax_bytes, growing or shrinking it, and
+    restores its previous size on exit
+
+    Parameters
+    ----------
+    cachemax_bytes
+        Block cache size in bytes, None to leave the cache alone
+    """
+    if cachemax_bytes is None:
+        yield
+        return
+    previous = gdal.GetCacheMax()
+    gdal.SetCacheMax(cachemax_bytes)
+    try:
+        yield
+    finally:
+        gdal.SetCacheMax(previous)
+
+
 def get_file(bucket: str, key: str, local_filepath: pathlib.Path) -> pathlib.Path:
     """
     Download a file from s3
@@ -133,19 +751,17 @@ def get_file(bucket: str, key: str, local_filepath: pathlib.Path) -> pathlib.Pat
     pathlib.Path
         Path to downloaded file
     """
-    s3 = boto3.resource('s3')
-    bucket = s3.Bucket(bucket)
-    obj = bucket.Object(key)
-
     local_filepath.resolve().parent.mkdir(parents=True, exist_ok=True)
     with open(local_filepath, 'wb') as data:
-        obj.download_fileobj(data)
+        utils.get_aws_client('s3').download_fileobj(bucket, key, data)
 
     return local_filepath
 
 
 def the_opera_hls_treatment(source_image_filepath: pathlib.Path, working_dirpath: pathlib.Path,
-                            mgrs_grid_code: str) -> List[pathlib.Path]:
+                            mgrs_grid_code: str, options: TreatmentOptions | None = None,
+                            on_sub_tile_complete: Callable[[int, pathlib.PurePath], None] | None = None,
+                            skipped_sub_tiles: List[Dict] | None = None) -> List[pathlib.PurePath]:
     """
     What is the OPERA treatment? Well, it is special.
 
@@ -171,53 +787,538 @@ def the_opera_hls_treatment(source_image_filepath: pathlib.Path, working_dirpath
         Directory used for intermediate files
     mgrs_grid_code
         MGRS grid code for the current granule being processed
+    options
+        Tuning options for the treatment. When options.max_workers > 1 the sub-tiles are warped concurrently; the
+        returned list is in the same order as a serial run.
+    on_sub_tile_complete
+        Optional callback invoked on the calling thread with (index, path) as soon as each sub-tile has been written,
+        index being an ordering key that increases with the position of the sub-tile in the MGRS/GIBS intersection
+        list. Not called for sub-tiles dropped because they were empty.
+    skipped_sub_tiles
+        Optional list that a dict with the 'GID', 'fileName' and 'reason' is appended to for every sub-tile skipped
+        because options.skip_empty_sub_tiles is set and it contained no valid data
 
     Returns
     -------
-    List[pathlib.Path]
-        Absolute paths to each transformed output tif file
+    List[pathlib.PurePath]
+        Absolute paths to each transformed output tif file, under /vsimem/ when options.in_memory_output is set
     """
-    try:
-        # Need to strip off the leading 'T' from the actual grid code in order to look it up in the json data
-        # this is done using a slice on the string mgrs_grid_code[1:]
-        if mgrs_grid_code.startswith('T'):
-            sub_tiles = MGRS_GIBS_INTERSECTION[mgrs_grid_code[1:]]
-        else:
-            sub_tiles = MGRS_GIBS_INTERSECTION[mgrs_grid_code]
-    except KeyError as e:
-        raise KeyError(f"Could not locate grid code {mgrs_grid_code[1:]} in mgrs_gibs_intersection.json.pickle") from e
+    options = options or TreatmentOptions()
+    sub_tiles = _find_sub_tiles(mgrs_grid_code, source_image_filepath, options.sub_tile_grid)
+
+    if options.in_memory_output:
+        output_dirpath = pathlib.PurePosixPath(f'/vsimem{working_dirpath.resolve()}')
+    else:
+        output_dirpath = working_dirpath
+
+    if options.skip_empty_sub_tiles:
+        has_data = _sub_tiles_with_valid_data(source_image_filepath, sub_tiles, options.footprint_size)
+    else:
+        has_data = [True] * len(sub_tiles)
 
     result_image_filepaths = []
-    for sub_tile in sub_tiles:
+    sub_tile_bounds = []
+    sub_tile_gids = []
+    for sub_tile, sub_tile_has_data in zip(sub_tiles, has_data):
         # Build a new filename for each sub tile by locating the MGRS tile id in the source filename and
         # appending f"_{sub_tile['GID'}}" immediately after the MGRS tile id.
         # Example:
         #  OPERA_L3_DSWx-HLS_T01WCU_20210827T002611Z_20230131T090316Z_S2A_30_v1.0_BROWSE        (original)
         #  OPERA_L3_DSWx-HLS_T01WCU_318143_20210827T002611Z_20230131T090316Z_S2A_30_v1.0_BROWSE (new)
         # Each sub tile is also placed in its own sub-directory by GID
-        destination_subtile_dirpath = working_dirpath.joinpath(sub_tile['GID'])
-        destination_subtile_dirpath.mkdir(parents=True)
-        sub_tile_filename = f"{mgrs_grid_code}_{sub_tile['GID']}".join(
-            source_image_filepath.stem.split(mgrs_grid_code)) + source_image_filepath.suffix
+        sub_tile_filename = _sub_tile_filename(source_image_filepath.name, mgrs_grid_code, sub_tile['GID'])
+        if not sub_tile_has_data:
+            _record_skipped(skipped_sub_tiles, sub_tile['GID'], sub_tile_filename, 'outside valid data footprint')
+            continue
+        destination_subtile_dirpath = output_dirpath.joinpath(sub_tile['GID'])
+        if not options.in_memory_output:
+            destination_subtile_dirpath.mkdir(parents=True)
         destination_subtile_filepath = destination_subtile_dirpath.joinpath(sub_tile_filename)
         result_image_filepaths.append(destination_subtile_filepath)
+        sub_tile_bounds.append((sub_tile['minlon'], sub_tile['minlat'], sub_tile['maxlon'], sub_tile['maxlat']))
+        sub_tile_gids.append(sub_tile['GID'])
+
+    if not result_image_filepaths:
+        return []
+
+    dropped = set()
 
+    def on_job_complete(index: int, result: str | None):
+        if result is None:
+            dropped.add(index)
+            _record_skipped(skipped_sub_tiles, sub_tile_gids[index], result_image_filepaths[index].name,
+                            'empty after warp')
+        elif on_sub_tile_complete:
+            on_sub_tile_complete(index, result_image_filepaths[index])
+
+    _resample_sub_tiles(source_image_filepath, working_dirpath, mgrs_grid_code,
+                        list(zip(result_image_filepaths, sub_tile_bounds, sub_tile_gids)), options, on_job_complete)
+
+    return [filepath for index, filepath in enumerate(result_image_filepaths) if index not in dropped]
+
+
+def _resample_sub_tiles(source_image_filepath: pathlib.Path, working_dirpath: pathlib.Path, mgrs_grid_code: str,
+                        sub_tiles: List[tuple], options: TreatmentOptions,
+                        on_job_complete: Callable[[int, str | None], None]):
+    """
+    Write every sub-tile with the resampling approach selected by options
+
+    Parameters
+    ----------
+    source_image_filepath
+        Path to the source image
+    working_dirpath
+        Directory used for intermediate files
+    mgrs_grid_code
+        MGRS grid code of the source image
+    sub_tiles
+        (destination path, (minlon, minlat, maxlon, maxlat), GID) of every sub-tile to write
+    options
+        Tuning options for the treatment
+    on_job_complete
+        Called with (index, result) as each sub-tile is written, see _run_sub_tile_jobs
+    """
+    if options.shared_warped_vrt:
+        # Open and reproject the source once, then cut every sub_tile out of the shared warped raster
+        vrt_filepath = working_dirpath.joinpath(source_image_filepath.stem + '.warped.vrt')
+        union_bounds = _build_warped_vrt(source_image_filepath, vrt_filepath,
+                                         [bounds for _, bounds, _ in sub_tiles], options.warp_kwargs())
+        jobs = [(str(vrt_filepath), str(destination), _sub_tile_window(union_bounds, bounds),
+                 options.skip_empty_sub_tiles, options.encoding)
+                for destination, bounds, _ in sub_tiles]
+        try:
+            _run_sub_tile_jobs(_cut_sub_tile, jobs, options, on_job_complete)
+        finally:
+            # Worker threads release their handles when the pool shuts down, the serial path runs on this thread
+            getattr(_WARPED_VRT_HANDLES, 'datasets', {}).pop(str(vrt_filepath), None)
+    elif options.resampling_engine == 'index_map':
+        # Resample each sub_tile with a (cached) nearest neighbour index map over the source pixels
+        jobs = [(str(source_image_filepath), str(destination), bounds, (mgrs_grid_code, gid),
+                 options.index_map_store(), options.skip_empty_sub_tiles, options.encoding)
+                for destination, bounds, gid in sub_tiles]
+        try:
+            _run_sub_tile_jobs(_gather_sub_tile, jobs, options, on_job_complete)
+        finally:
+            getattr(_GATHER_SOURCES, 'datasets', {}).pop(str(source_image_filepath), None)
+    else:
         # Use gdalwarp to reproject and rescale each sub_tile
-        gdal.Warp(str(destination_subtile_filepath), str(source_image_filepath),
-                  outputBounds=(sub_tile['minlon'], sub_tile['minlat'], sub_tile['maxlon'], sub_tile['maxlat']),
-                  dstSRS="+proj=longlat +ellps=WGS84 +datum=WGS84 +no_defs", xRes=2.74658203125e-4,
-                  yRes=2.74658203125e-4, creationOptions=["COMPRESS=LZW", "TILED=YES"], format="GTiff")
+        jobs = [(str(source_image_filepath), str(destination), bounds, options.warp_kwargs(),
+                 options.skip_empty_sub_tiles, options.encoding)
+                for destination, bounds, _ in sub_tiles]
+        _run_sub_tile_jobs(_warp_sub_tile, jobs, options, on_job_complete)
+
+
+def _lookup_sub_tiles(mgrs_grid_code: str) -> List[Dict]:
+    """
+    Find the GIBS sub-tiles intersecting the given MGRS grid code
+    """
+    try:
+        # Need to strip off the leading 'T' from the actual grid code in order to look it up in the json data
+        # this is done using a slice on the string mgrs_grid_code[1:]
+        if mgrs_grid_code.startswith('T'):
+            return MGRS_GIBS_INTERSECTION[mgrs_grid_code[1:]]
+        return MGRS_GIBS_INTERSECTION[mgrs_grid_code]
+    except KeyError as e:
+        raise KeyError(f"Could not locate grid code {mgrs_grid_code[1:]} in the MGRS/GIBS intersection index") from e
+
+
+def _sub_tile_filename(source_image_filename: str, mgrs_grid_code: str, gid: str) -> str:
+    """
+    Name of the sub-tile with the given GID cut from the source image
+    """
+    source_image_filename = pathlib.PurePosixPath(source_image_filename)
+    return f"{mgrs_grid_code}_{gid}".join(source_image_filename.stem.split(mgrs_grid_code)) + source_image_filename.suffix
+
+
+def _find_sub_tiles(mgrs_grid_code: str, source_image_filepath: str | pathlib.PurePath,
+                    sub_tile_grid: str = 'table') -> List[Dict]:
+    """
+    Find the GIBS sub-tiles of a source image, see TreatmentOptions.sub_tile_grid. The source image is only opened
+    when the sub-tiles are computed.
+    """
+    if sub_tile_grid != 'computed':
+        try:
+            return _lookup_sub_tiles(mgrs_grid_code)
+        except (KeyError, FileNotFoundError):
+            if sub_tile_grid == 'table':
+                raise
+            CUMULUS_LOGGER.info(f'Grid code {mgrs_grid_code} not in the MGRS/GIBS intersection index, computing '
+                                f'sub-tiles from the footprint of {source_image_filepath}')
+    return gibs_grid.sub_tiles_intersecting(_source_footprint(source_image_filepath))
+
+
+def _source_footprint(source_image_filepath: str | pathlib.PurePath, steps: int = 16) -> List[tuple]:
+    """
+    Outline of the source image in GIBS longitude/latitude with steps vertices along each edge
+    """
+    dataset = gdal.Open(str(source_image_filepath))
+    width, height = dataset.RasterXSize, dataset.RasterYSize
+    outline = [(width * i / steps, 0) for i in range(steps)]
+    outline += [(width, height * i / steps) for i in range(steps)]
+    outline += [(width * (steps - i) / steps, height) for i in range(steps)]
+    outline += [(0, height * (steps - i) / steps) for i in range(steps)]
+    geotransform = dataset.GetGeoTransform()
+    projected = [gdal.ApplyGeoTransform(geotransform, x, y) for x, y in outline]
+
+    source_srs = osr.SpatialReference(wkt=dataset.GetProjection())
+    source_srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    to_lonlat = osr.CoordinateTransformation(source_srs, _gibs_srs())
+    return [(lon, lat) for lon, lat, _ in to_lonlat.TransformPoints(projected)]
+
+
+def _gibs_srs() -> osr.SpatialReference:
+    """
+    The GIBS longitude/latitude spatial reference with longitude first
+    """
+    srs = osr.SpatialReference()
+    srs.ImportFromProj4(GIBS_SRS)
+    srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    return srs
+
+
+def _record_skipped(skipped_sub_tiles: List[Dict] | None, gid: str, filename: str, reason: str):
+    """
+    Log a skipped sub-tile and add it to skipped_sub_tiles if a list was given
+    """
+    CUMULUS_LOGGER.info(f'Skipping sub-tile {gid} ({filename}): {reason}')
+    if skipped_sub_tiles is not None:
+        skipped_sub_tiles.append({'GID': gid, 'fileName': filename, 'reason': reason})
+
+
+def _sub_tiles_with_valid_data(source_image_filepath: pathlib.PurePath, sub_tiles: List[Dict],
+                               footprint_size: int) -> List[bool]:
+    """
+    Cheaply determine which sub-tiles overlap valid data in the source image without warping them.
+
+    The mask of the source (derived by GDAL from nodata, alpha or an internal mask) is read at a resolution whose
+    longest side is footprint_size pixels, using overviews when available. A low resolution pixel counts as valid if
+    any full resolution pixel within it is valid, and each sub-tile is tested using the bounding box of its outline
+    in source pixel coordinates, widened by one low resolution pixel, so the check errs on the side of keeping
+    sub-tiles.
+
+    Parameters
+    ----------
+    source_image_filepath
+        Path to the source image
+    sub_tiles
+        Sub-tile dicts from the MGRS/GIBS intersection
+    footprint_size
+        Longest side in pixels of the low resolution mask
+
+    Returns
+    -------
+    List[bool]
+        For each sub-tile, False if it certainly contains no valid data
+    """
+    dataset = gdal.Open(str(source_image_filepath))
+    band = dataset.GetRasterBand(1)
+    scale = max(1.0, max(dataset.RasterXSize, dataset.RasterYSize) / footprint_size)
+    mask_width = max(1, math.ceil(dataset.RasterXSize / scale))
+    mask_height = max(1, math.ceil(dataset.RasterYSize / scale))
+    if band.GetMaskFlags() & gdal.GMF_ALL_VALID:
+        mask = None
+    else:
+        mask = band.GetMaskBand().ReadAsArray(buf_xsize=mask_width, buf_ysize=mask_height, buf_type=gdal.GDT_Float32,
+                                              resample_alg=gdal.GRIORA_Average) > 0
+
+    source_srs = osr.SpatialReference(wkt=dataset.GetProjection())
+    source_srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    to_source = osr.CoordinateTransformation(_gibs_srs(), source_srs)
+    inverse_geotransform = gdal.InvGeoTransform(dataset.GetGeoTransform())
+
+    has_data = []
+    for sub_tile in sub_tiles:
+        # Densify the outline of the sub-tile since straight lines in lon/lat are curved in UTM
+        steps = [i / 16 for i in range(17)]
+        outline = [(sub_tile['minlon'] + (sub_tile['maxlon'] - sub_tile['minlon']) * t, lat)
+                   for t in steps for lat in (sub_tile['minlat'], sub_tile['maxlat'])]
+        outline += [(lon, sub_tile['minlat'] + (sub_tile['maxlat'] - sub_tile['minlat']) * t)
+                    for t in steps for lon in (sub_tile['minlon'], sub_tile['maxlon'])]
+        pixels = [gdal.ApplyGeoTransform(inverse_geotransform, x, y)
+                  for x, y, _ in to_source.TransformPoints(outline)]
+        x0 = max(0, math.floor(min(p[0] for p in pixels) / scale) - 1)
+        x1 = min(mask_width, math.ceil(max(p[0] for p in pixels) / scale) + 1)
+        y0 = max(0, math.floor(min(p[1] for p in pixels) / scale) - 1)
+        y1 = min(mask_height, math.ceil(max(p[1] for p in pixels) / scale) + 1)
+        if x0 >= x1 or y0 >= y1:
+            has_data.append(False)
+        else:
+            has_data.append(mask is None or bool(mask[y0:y1, x0:x1].any()))
 
-    return result_image_filepaths
+    return has_data
 
 
-def create_file_metadata(transformed_images_filepaths: List[pathlib.Path], staging_bucket: str) -> List[Dict]:
+def _drop_if_empty(destination_filepath: str) -> str | None:
+    """
+    Delete the sub-tile at destination_filepath if it has no valid pixels
+
+    Returns
+    -------
+    str | None
+        destination_filepath, or None if it was empty and has been deleted
+    """
+    dataset = gdal.Open(destination_filepath)
+    band = dataset.GetRasterBand(1)
+    empty = not band.GetMaskFlags() & gdal.GMF_ALL_VALID and not band.GetMaskBand().ReadAsArray().any()
+    dataset = None
+    if empty:
+        gdal.Unlink(destination_filepath)
+        return None
+    return destination_filepath
+
+
+def _run_sub_tile_jobs(func: Callable[..., str | None], jobs: List[tuple], options: TreatmentOptions,
+                       on_job_complete: Callable[[int, str | None], None] | None = None):
+    """
+    Call func once for each tuple of arguments in jobs, either serially or on a thread or process pool depending on
+    options. on_job_complete, if given, is called on the calling thread with the index and the result of each job as
+    it finishes.
+    """
+    if options.max_workers == 1 or len(jobs) < 2:
+        for index, job in enumerate(jobs):
+            result = func(*job)
+            if on_job_complete:
+                on_job_complete(index, result)
+        return
+
+    max_workers = min(options.max_workers, len(jobs))
+    CUMULUS_LOGGER.info(f'Processing {len(jobs)} sub-tiles using {max_workers} {options.executor} workers')
+
+    if options.executor == 'process':
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=max_workers, initializer=_init_warp_process,
+                                                          initargs=(options.gdal_cachemax_mb,))
+    else:
+        # Threads share the block cache sized for all of them by transform_images
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+
+    with executor:
+        futures = {executor.submit(func, *job): index for index, job in enumerate(jobs)}
+        for future in concurrent.futures.as_completed(futures):
+            result = future.result()
+            if on_job_complete:
+                on_job_complete(futures[future], result)
+
+
+def _init_warp_process(gdal_cachemax_mb: int | None):
+    """
+    Initializer for process pool workers
+    """
+    if gdal_cachemax_mb:
+        gdal.SetCacheMax(gdal_cachemax_mb * 1024 * 1024)
+
+
+def _build_warped_vrt(source_image_filepath: pathlib.Path, vrt_filepath: pathlib.Path, sub_tile_bounds: List[tuple],
+                      warp_kwargs: Dict | None = None) -> tuple:
+    """
+    Create a warped VRT on the GIBS grid covering the union of all sub-tile bounds
+
+    Parameters
+    ----------
+    source_image_filepath
+        Path to the source image
+    vrt_filepath
+        Path of the VRT to create
+    sub_tile_bounds
+        (minlon, minlat, maxlon, maxlat) of every sub-tile
+    warp_kwargs
+        Additional gdal.Warp arguments applied when the VRT is read, see TreatmentOptions.warp_kwargs
+
+    Returns
+    -------
+    tuple
+        (minlon, minlat, maxlon, maxlat) of the VRT
+    """
+    union_bounds = (min(b[0] for b in sub_tile_bounds), min(b[1] for b in sub_tile_bounds),
+                    max(b[2] for b in sub_tile_bounds), max(b[3] for b in sub_tile_bounds))
+    gdal.Warp(str(vrt_filepath), str(source_image_filepath), outputBounds=union_bounds, dstSRS=GIBS_SRS,
+              xRes=GIBS_RESOLUTION, yRes=GIBS_RESOLUTION, format="VRT", **(warp_kwargs or {}))
+    return union_bounds
+
+
+def _sub_tile_window(union_bounds: tuple, sub_tile_bounds: tuple) -> tuple:
+    """
+    Pixel window (xoff, yoff, xsize, ysize) of a sub-tile within a raster on the GIBS grid covering union_bounds
+    """
+    return (round((sub_tile_bounds[0] - union_bounds[0]) / GIBS_RESOLUTION),
+            round((union_bounds[3] - sub_tile_bounds[3]) / GIBS_RESOLUTION),
+            round((sub_tile_bounds[2] - sub_tile_bounds[0]) / GIBS_RESOLUTION),
+            round((sub_tile_bounds[3] - sub_tile_bounds[1]) / GIBS_RESOLUTION))
+
+
+_WARPED_VRT_HANDLES = threading.local()
+
+
+def _cut_sub_tile(vrt_filepath: str, destination_filepath: str, src_win: tuple, drop_empty: bool = False,
+                  encoding: EncodingProfile | None = None) -> str | None:
+    """
+    Write a single GIBS sub-tile by copying a pixel window out of the shared warped VRT
+
+    The VRT is opened once per worker thread (or process) and reused for every sub-tile that worker handles, so the
+    source image is only decoded and the coordinate transformer only built once per worker.
+
+    Parameters
+    ----------
+    vrt_filepath
+        Path to the warped VRT created by _build_warped_vrt
+    destination_filepath
+        Path of the GeoTIFF to create
+    src_win
+        Pixel window (xoff, yoff, xsize, ysize) of the sub-tile within the VRT
+    drop_empty
+        Delete the sub-tile if it has no valid pixels
+    encoding
+        Driver and compression of the sub-tile, defaults to EncodingProfile()
+
+    Returns
+    -------
+    str | None
+        destination_filepath, or None if the sub-tile was empty and dropped
+    """
+    encoding = encoding or EncodingProfile()
+    handles = getattr(_WARPED_VRT_HANDLES, 'datasets', None)
+    if handles is None:
+        handles = _WARPED_VRT_HANDLES.datasets = {}
+    if vrt_filepath not in handles:
+        handles[vrt_filepath] = gdal.Open(vrt_filepath)
+
+    gdal.Translate(destination_filepath, handles[vrt_filepath], srcWin=src_win,
+                   creationOptions=encoding.creation_options(), format=encoding.driver)
+    return _drop_if_empty(destination_filepath) if drop_empty else destination_filepath
+
+
+def _warp_sub_tile(source_image_filepath: str, destination_filepath: str, output_bounds: tuple,
+                   warp_kwargs: Dict | None = None, drop_empty: bool = False,
+                   encoding: EncodingProfile | None = None) -> str | None:
+    """
+    Reproject and rescale the source image into a single GIBS sub-tile
+
+    Parameters
+    ----------
+    source_image_filepath
+        Path to the source image
+    destination_filepath
+        Path of the GeoTIFF to create
+    output_bounds
+        (minlon, minlat, maxlon, maxlat) of the sub-tile
+    warp_kwargs
+        Additional gdal.Warp arguments, see TreatmentOptions.warp_kwargs
+    drop_empty
+        Delete the sub-tile if it has no valid pixels
+    encoding
+        Driver and compression of the sub-tile, defaults to EncodingProfile()
+
+    Returns
+    -------
+    str | None
+        destination_filepath, or None if the sub-tile was empty and dropped
+    """
+    encoding = encoding or EncodingProfile()
+
+    gdal.Warp(destination_filepath, source_image_filepath, outputBounds=output_bounds, dstSRS=GIBS_SRS,
+              xRes=GIBS_RESOLUTION, yRes=GIBS_RESOLUTION, creationOptions=encoding.creation_options(),
+              format=encoding.driver, **(warp_kwargs or {}))
+    return _drop_if_empty(destination_filepath) if drop_empty else destination_filepath
+
+
+_GATHER_SOURCES = threading.local()
+
+
+def _gather_sub_tile(source_image_filepath: str, destination_filepath: str, output_bounds: tuple,
+                     sub_tile_id: tuple, store: IndexMapStore, drop_empty: bool = False,
+                     encoding: EncodingProfile | None = None) -> str | None:
+    """
+    Write a single GIBS sub-tile by gathering source pixels through a nearest neighbour index map. The result is
+    identical to _warp_sub_tile; only the first sub-tile of a given MGRS tile, GID and source grid pays for the warp.
+
+    Parameters
+    ----------
+    source_image_filepath
+        Path to the source image
+    destination_filepath
+        Path of the GeoTIFF to create
+    output_bounds
+        (minlon, minlat, maxlon, maxlat) of the sub-tile
+    sub_tile_id
+        (MGRS grid code, GID) of the sub-tile
+    store
+        Where index maps are kept
+    drop_empty
+        Delete the sub-tile if it has no valid pixels
+    encoding
+        Driver and compression of the sub-tile, defaults to EncodingProfile()
+
+    Returns
+    -------
+    str | None
+        destination_filepath, or None if the sub-tile was empty and dropped
+    """
+    encoding = encoding or EncodingProfile()
+    sources = getattr(_GATHER_SOURCES, 'datasets', None)
+    if sources is None:
+        sources = _GATHER_SOURCES.datasets = {}
+    if source_image_filepath not in sources:
+        dataset = gdal.Open(source_image_filepath)
+        sources[source_image_filepath] = (dataset, [dataset.GetRasterBand(b + 1).ReadAsArray()
+                                                    for b in range(dataset.RasterCount)])
+    source, source_arrays = sources[source_image_filepath]
+
+    source_grid = {'projection': source.GetProjection(), 'geotransform': list(source.GetGeoTransform()),
+                   'size': [source.RasterXSize, source.RasterYSize]}
+    output_grid = {'srs': GIBS_SRS, 'bounds': list(output_bounds), 'resolution': GIBS_RESOLUTION}
+    key = index_map_key(*sub_tile_id, source_grid, output_grid)
+    index_map = store.get(key)
+    if index_map is None:
+        index_map = _build_index_map(source, output_bounds)
+        store.put(key, index_map)
+
+    height, width = index_map.indices.shape
+    gathered = gdal.GetDriverByName('MEM').Create('', width, height, source.RasterCount,
+                                                  source.GetRasterBand(1).DataType)
+    gathered.SetGeoTransform(index_map.geotransform)
+    gathered.SetProjection(index_map.projection)
+    gathered.SetMetadata(source.GetMetadata())
+    for band_number, source_array in enumerate(source_arrays, start=1):
+        source_band = source.GetRasterBand(band_number)
+        band = gathered.GetRasterBand(band_number)
+        nodata = source_band.GetNoDataValue()
+        band.WriteArray(gather(source_array, index_map.indices, 0 if nodata is None else nodata))
+        if nodata is not None:
+            band.SetNoDataValue(nodata)
+        if source_band.GetColorTable() is not None:
+            band.SetColorTable(source_band.GetColorTable())
+        band.SetColorInterpretation(source_band.GetColorInterpretation())
+
+    gdal.Translate(destination_filepath, gathered, creationOptions=encoding.creation_options(), format=encoding.driver)
+    return _drop_if_empty(destination_filepath) if drop_empty else destination_filepath
+
+
+def _build_index_map(source: gdal.Dataset, output_bounds: tuple) -> IndexMap:
+    """
+    Compute the nearest neighbour index map of a sub-tile by warping a raster holding the flat index of every source
+    pixel with the same parameters as _warp_sub_tile. Output pixels outside the source are -1.
+    """
+    index_raster = gdal.GetDriverByName('MEM').Create('', source.RasterXSize, source.RasterYSize, 1, gdal.GDT_Int32)
+    index_raster.SetGeoTransform(source.GetGeoTransform())
+    index_raster.SetProjection(source.GetProjection())
+    index_raster.GetRasterBand(1).WriteArray(
+        np.arange(source.RasterXSize * source.RasterYSize, dtype=np.int32).reshape(source.RasterYSize,
+                                                                                   source.RasterXSize))
+    # Warp in a single chunk, like the much smaller Byte warp of the sub-tile does, so the approximate transformer
+    # interpolates over exactly the same output rows
+    warped = gdal.Warp('', index_raster, format='MEM', outputBounds=output_bounds, dstSRS=GIBS_SRS,
+                       xRes=GIBS_RESOLUTION, yRes=GIBS_RESOLUTION, dstNodata=-1, resampleAlg='near',
+                       warpMemoryLimit=2 ** 31 - 1)
+    return IndexMap(warped.GetRasterBand(1).ReadAsArray(), warped.GetGeoTransform(), warped.GetProjection())
+
+
+def create_file_metadata(transformed_images_filepaths: List[pathlib.PurePath], staging_bucket: str,
+                         key_prefix: str | None = None) -> List[Dict]:
     """
     Generate a new CMA file metadata dictionary for each transformed image using the original CMA metadata as a
     template.
 
     One additional key is added to the dict 'local_filepath' which is the full absolute filepath to the transformed
-    image on disk to facilitate uploads in a later step.
+    image on disk (or in /vsimem/) to facilitate uploads in a later step.
 
     Parameters
     ----------
@@ -225,20 +1326,33 @@ def create_file_metadata(transformed_images_filepaths: List[pathlib.Path], stagi
         Local filepaths to each output transformed image
     staging_bucket
         Staging bucket to which transformed files should be written
+    key_prefix
+        Key prefix for the transformed images in the staging bucket, defaults to opera_hls_processing/ followed by
+        today's date
 
     Returns
     -------
     List[Dict]
         List of CMA file metadata dict for each output transformed image
     """
+    if key_prefix is None:
+        key_prefix = f'opera_hls_processing/{datetime.datetime.now(datetime.timezone.utc).strftime("%Y%m%d")}'
     new_cma_file_meta_list = []
     for transformed_image in transformed_images_filepaths:
+        if is_in_memory(transformed_image):
+            with VsiFileReader(str(transformed_image)) as image:
+                checksum = utils.sha512sum_fileobj(image)
+            local_filepath = str(transformed_image)
+        else:
+            checksum = utils.sha512sum(transformed_image)
+            local_filepath = str(pathlib.Path(transformed_image).resolve())
+
         file_dict = {
             "fileName": transformed_image.name,
             "bucket": staging_bucket,
-            "key": f'opera_hls_processing/{datetime.datetime.now(datetime.timezone.utc).strftime("%Y%m%d")}/{transformed_image.name}',
-            "local_filepath": str(transformed_image.resolve()),
-            "checksum": utils.sha512sum(transformed_image),
+            "key": f'{key_prefix}/{transformed_image.name}',
+            "local_filepath": local_filepath,
+            "checksum": checksum,
             "checksumType": "SHA512"
         }
 
@@ -249,7 +1363,8 @@ def create_file_metadata(transformed_images_filepaths: List[pathlib.Path], stagi
 
 def upload_transformed_images(image_file_metadatas: List[Dict]) -> List[str]:
     """
-    Uploads to s3
+    Uploads to s3. Images held in /vsimem/ are uploaded straight from memory and released once uploaded, or once an
+    upload fails. The checksum of each image is stored as object metadata so the upload can be reused by a later run.
 
     Parameters
     ----------
@@ -262,12 +1377,80 @@ def upload_transformed_images(image_file_metadatas: List[Dict]) -> List[str]:
       s3 uri to uploaded object
     """
     s3_uris = []
-    for image_file_metadata in image_file_metadatas:
-        s3_uris.append(utils.upload_to_s3(image_file_metadata['local_filepath'], image_file_metadata['bucket'],
-                                          image_file_metadata['key']))
+    try:
+        for image_file_metadata in image_file_metadatas:
+            local_filepath = image_file_metadata['local_filepath']
+            metadata = {CHECKSUM_METADATA_KEY: image_file_metadata['checksum']}
+            if is_in_memory(local_filepath):
+                with VsiFileReader(local_filepath) as image:
+                    s3_uris.append(utils.upload_fileobj_to_s3(image, image_file_metadata['bucket'],
+                                                              image_file_metadata['key'], metadata))
+                gdal.Unlink(local_filepath)
+            else:
+                s3_uris.append(utils.upload_to_s3(local_filepath, image_file_metadata['bucket'],
+                                                  image_file_metadata['key'], metadata))
+    finally:
+        # Release the in-memory images left over when an upload failed
+        for image_file_metadata in image_file_metadatas:
+            local_filepath = image_file_metadata['local_filepath']
+            if is_in_memory(local_filepath) and gdal.VSIStatL(local_filepath) is not None:
+                gdal.Unlink(local_filepath)
     return s3_uris
 
 
+def is_in_memory(filepath: str | pathlib.PurePath) -> bool:
+    """
+    True if filepath is in GDAL's /vsimem/ in-memory file system
+    """
+    return str(filepath).startswith('/vsimem/')
+
+
+def remove_in_memory_dir(working_dirpath: pathlib.Path):
+    """
+    Delete every file in the /vsimem/ counterpart of working_dirpath, where in-memory sub-tiles of a treatment working
+    in working_dirpath are written (see the_opera_hls_treatment)
+    """
+    in_memory_dirpath = f'/vsimem{working_dirpath.resolve()}'
+    for name in gdal.ReadDirRecursive(in_memory_dirpath) or []:
+        if not name.endswith('/'):
+            gdal.Unlink(f'{in_memory_dirpath}/{name}')
+
+
+class VsiFileReader(io.RawIOBase):
+    """
+    Read-only binary file object over a file in a GDAL virtual file system such as /vsimem/. Data is read directly
+    into the caller's buffer in chunks so the file is never copied as a whole.
+    """
+
+    def __init__(self, vsi_filepath: str):
+        super().__init__()
+        self._fp = gdal.VSIFOpenL(vsi_filepath, 'rb')
+        if self._fp is None:
+            raise FileNotFoundError(vsi_filepath)
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        data = gdal.VSIFReadL(1, len(buffer), self._fp)
+        buffer[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        if self._fp is not None:
+            gdal.VSIFCloseL(self._fp)
+            self._fp = None
+        super().close()
+
+
+def peak_rss_bytes() -> int:
+    """
+    Peak resident set size of this process in bytes
+    """
+    # ru_maxrss is reported in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
 def lambda_handler(event, context):
     """handler that gets called by aws lambda
     Parameters
@@ -281,7 +1464,28 @@ def lambda_handler(event, context):
         dict
             A CMA json message
     """
+    _configure_logging(event, context)
+    return CMA.cumulus_handler(event, context=context)
 
+
+def batch_lambda_handler(event, context):
+    """handler that gets called by aws lambda to treat a batch of granules, see BatchCMA
+    Parameters
+    ----------
+    event: dictionary
+        event from a lambda call
+    context: dictionary
+        context from a lambda call
+    Returns
+    ----------
+        dict
+            A CMA json message
+    """
+    _configure_logging(event, context)
+    return BatchCMA.cumulus_handler(event, context=context)
+
+
+def _configure_logging(event, context):
     levels = {
         'critical': logging.CRITICAL,
         'error': logging.ERROR,
@@ -295,8 +1499,6 @@ def lambda_handler(event, context):
     CUMULUS_LOGGER.logger.level = levels.get(logging_level, 'info')
     CUMULUS_LOGGER.setMetadata(event, context)
 
-    return CMA.cumulus_handler(event, context=context)
-
 
 if __name__ == "__main__":
     CMA()
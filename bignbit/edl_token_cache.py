@@ -0,0 +1,312 @@
+"""
+Shared cache of EDL user tokens across Lambda invocations and workers.
+
+A token is looked up in a TokenStore before URS is asked for one. A stored token is used as is until it is within
+the refresh margin of its expiration; then one worker refreshes it while the others keep using the stored token. When
+there is no usable token at all, the workers that do not get the refresh lock wait for the one that does instead of
+all calling URS at once.
+
+Two stores are provided: FileTokenStore keeps tokens in a directory (e.g. /tmp, shared by the warm invocations and
+threads of a Lambda container, or a mounted file system shared more widely) and locks with flock. S3TokenStore keeps
+tokens in a private S3 location shared by every Lambda and locks with a lease object created by a conditional write.
+"""
+import fcntl
+import hashlib
+import json
+import os
+import pathlib
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Iterator, Protocol, Tuple
+from urllib.parse import urlparse
+
+import botocore.exceptions
+from cumulus_logger import CumulusLogger
+
+CUMULUS_LOGGER = CumulusLogger('edl_token_cache')
+
+DEFAULT_TOKEN_STORE_URL = 'file:///tmp/bignbit_edl_tokens'
+
+
+class TokenStore(Protocol):
+    """
+    Storage of tokens shared by the workers using a TokenCache
+    """
+
+    def read(self, key: str) -> Dict[str, Any] | None:
+        """The token stored under key, or None"""
+
+    def write(self, key: str, token: Dict[str, Any]):
+        """Store token under key"""
+
+    def lock(self, key: str) -> Any:
+        """Context manager trying, without blocking, to take the refresh lock of key. Yields whether it was taken"""
+
+
+def token_key(edl_user: str, cmr_env: str) -> str:
+    """
+    Store key of the token of an EDL user in a CMR/URS environment
+    """
+    return hashlib.sha256(f'{cmr_env.upper()}:{edl_user}'.encode()).hexdigest()
+
+
+_DATE_FIELDS = ('expiration_date', 'refresh_after')
+
+
+def _to_json(token: Dict[str, Any]) -> bytes:
+    return json.dumps({**token, **{field: token[field].isoformat() for field in _DATE_FIELDS if field in token}}).encode()
+
+
+def _from_json(body: bytes) -> Dict[str, Any]:
+    token = json.loads(body)
+    for field in _DATE_FIELDS:
+        if field in token:
+            token[field] = datetime.fromisoformat(token[field])
+    return token
+
+
+class FileTokenStore:
+    """
+    Tokens stored as files in a local directory, readable by the owner only
+    """
+
+    def __init__(self, directory: str | pathlib.Path):
+        self.directory = pathlib.Path(directory)
+
+    def read(self, key: str) -> Dict[str, Any] | None:
+        """The token stored under key, or None"""
+        try:
+            return _from_json(self.directory.joinpath(f'{key}.json').read_bytes())
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def write(self, key: str, token: Dict[str, Any]):
+        """Store token under key"""
+        self.directory.mkdir(mode=0o700, parents=True, exist_ok=True)
+        # Write to a temporary name first so concurrent readers never see a partial file
+        partial = self.directory.joinpath(f'{key}.{uuid.uuid4().hex}.partial')
+        with open(os.open(partial, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600), 'wb') as file:
+            file.write(_to_json(token))
+        partial.replace(self.directory.joinpath(f'{key}.json'))
+
+    @contextmanager
+    def lock(self, key: str) -> Iterator[bool]:
+        """Try, without blocking, to take the refresh lock of key. Yields whether it was taken"""
+        self.directory.mkdir(mode=0o700, parents=True, exist_ok=True)
+        with open(self.directory.joinpath(f'{key}.lock'), 'a', encoding='utf-8') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+_CONDITIONAL_WRITE_HEADERS = {'IfMatch': 'If-Match', 'IfNoneMatch': 'If-None-Match'}
+
+
+def _take_conditional_write_params(params, context, **_):
+    context['conditional_write_headers'] = {
+        header: params.pop(param) for param, header in _CONDITIONAL_WRITE_HEADERS.items() if param in params}
+
+
+def _add_conditional_write_headers(params, context, **_):
+    params['headers'].update(context.get('conditional_write_headers', {}))
+
+
+class S3TokenStore:
+    """
+    Tokens stored as objects under a prefix of a private S3 bucket. The lock is a lease object that only one worker can
+    create, S3 rejecting the others' writes with 412 Precondition Failed; a lease older than lease_seconds is replaced
+    so a crashed worker can not block refreshes.
+    """
+
+    def __init__(self, s3_client, bucket: str, prefix: str = 'edl_tokens', lease_seconds: int = 60):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.prefix = prefix.strip('/')
+        self.lease_seconds = lease_seconds
+        # The botocore pinned through cumulus-process predates the IfMatch/IfNoneMatch parameters of PutObject, so
+        # they are sent as the S3 conditional write headers
+        events = s3_client.meta.events
+        events.register('before-parameter-build.s3.PutObject', _take_conditional_write_params,
+                        unique_id='bignbit-conditional-write-params')
+        events.register('before-call.s3.PutObject', _add_conditional_write_headers,
+                        unique_id='bignbit-conditional-write-headers')
+
+    def read(self, key: str) -> Dict[str, Any] | None:
+        """The token stored under key, or None"""
+        try:
+            body = self.s3_client.get_object(Bucket=self.bucket, Key=f'{self.prefix}/{key}.json')['Body']
+            return _from_json(body.read())
+        except botocore.exceptions.ClientError as e:
+            if e.response['Error']['Code'] not in ('404', 'NoSuchKey', 'NotFound'):
+                raise
+        except (ValueError, KeyError):
+            pass
+        return None
+
+    def write(self, key: str, token: Dict[str, Any]):
+        """Store token under key"""
+        self.s3_client.put_object(Bucket=self.bucket, Key=f'{self.prefix}/{key}.json', Body=_to_json(token),
+                                  ServerSideEncryption='AES256')
+
+    @contextmanager
+    def lock(self, key: str) -> Iterator[bool]:
+        """Try, without blocking, to take the refresh lock of key. Yields whether it was taken"""
+        lock_key = f'{self.prefix}/{key}.lock'
+        current = self._lease(lock_key)
+        if current is None:
+            condition = {'IfNoneMatch': '*'}
+        else:
+            lease, etag = current
+            if time.time() - lease['acquired'] < self.lease_seconds:
+                yield False
+                return
+            # Replace the expired lease unless another worker already did
+            condition = {'IfMatch': etag}
+
+        try:
+            self.s3_client.put_object(Bucket=self.bucket, Key=lock_key,
+                                      Body=json.dumps({'owner': uuid.uuid4().hex, 'acquired': time.time()}).encode(),
+                                      **condition)
+        except botocore.exceptions.ClientError as e:
+            if e.response['Error']['Code'] not in ('412', 'PreconditionFailed', '409', 'ConditionalRequestConflict'):
+                raise
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            self.s3_client.delete_object(Bucket=self.bucket, Key=lock_key)
+
+    def _lease(self, lock_key: str) -> Tuple[Dict[str, Any], str] | None:
+        try:
+            response = self.s3_client.get_object(Bucket=self.bucket, Key=lock_key)
+            return json.loads(response['Body'].read()), response['ETag']
+        except botocore.exceptions.ClientError as e:
+            if e.response['Error']['Code'] not in ('404', 'NoSuchKey', 'NotFound'):
+                raise
+        return None
+
+
+def token_store_from_url(url: str, s3_client=None) -> TokenStore:
+    """
+    TokenStore for a file:///directory or s3://bucket/prefix URL, using s3_client to reach an S3 store
+    """
+    parsed = urlparse(url)
+    if parsed.scheme == 'file':
+        return FileTokenStore(parsed.path)
+    if parsed.scheme == 's3':
+        return S3TokenStore(s3_client, parsed.netloc, parsed.path.lstrip('/') or 'edl_tokens')
+    raise ValueError(f'Unsupported EDL token store {url}, expected file:// or s3://')
+
+
+class TokenCache:  # pylint: disable=too-few-public-methods
+    """
+    Expiry-aware reads of tokens from a TokenStore with single-flight, proactive refresh
+
+    Parameters
+    ----------
+    store
+        Where tokens are shared
+    refresh_margin
+        Tokens expiring within this time are refreshed
+    wait_seconds
+        Longest time a worker without a usable token waits for another worker's refresh before fetching a token itself
+    poll_seconds
+        Interval at which a waiting worker reads the store
+    fetch_seconds
+        Time a waiting worker keeps before the deadline given to get to fetch a token itself
+    """
+
+    def __init__(self, store: TokenStore, refresh_margin: timedelta = timedelta(days=1), wait_seconds: float = 5,
+                 poll_seconds: float = 0.5, fetch_seconds: float = 5):
+        self.store = store
+        self.refresh_margin = refresh_margin
+        self.wait_seconds = wait_seconds
+        self.poll_seconds = poll_seconds
+        self.fetch_seconds = fetch_seconds
+
+    def get(self, key: str, fetch: Callable[[datetime], Dict[str, Any]], deadline: float | None = None) -> Dict[str, Any]:
+        """
+        A token for key, from the store if it holds a fresh one and otherwise from fetch
+
+        Parameters
+        ----------
+        key
+            Store key of the token
+        fetch
+            Called with the time a token must stay valid beyond to be fresh; returns a dict with the 'access_token'
+            and its 'expiration_date' as a datetime
+        deadline
+            time.monotonic() time by which the token is needed, e.g. utils.CMR_DEADLINE; None for no deadline
+
+        Returns
+        -------
+        dict
+            The token
+        """
+        token = self.store.read(key)
+        if self.is_fresh(token):
+            return token
+
+        with self.store.lock(key) as acquired:
+            if acquired:
+                # Another worker may have refreshed the token while this one was waiting for the lock
+                token = self.store.read(key)
+                if self.is_fresh(token):
+                    return token
+                if self._valid(token):
+                    CUMULUS_LOGGER.info('Refreshing EDL token expiring at {}', token['expiration_date'])
+                else:
+                    CUMULUS_LOGGER.info('Requesting an EDL token')
+                token = fetch(datetime.now() + self.refresh_margin)
+                self.store.write(key, token)
+                return token
+
+        if self._valid(token):
+            # Another worker is refreshing a token that can still be used meanwhile
+            return token
+
+        wait_until = time.monotonic() + self.wait_seconds
+        if deadline is not None:
+            wait_until = min(wait_until, deadline - self.fetch_seconds)
+        while time.monotonic() < wait_until:
+            time.sleep(self.poll_seconds)
+            token = self.store.read(key)
+            if self._valid(token):
+                return token
+        CUMULUS_LOGGER.warning('Timed out waiting for another worker to refresh the EDL token')
+        token = fetch(datetime.now() + self.refresh_margin)
+        self.store.write(key, token)
+        return token
+
+    def is_fresh(self, token: Dict[str, Any] | None) -> bool:
+        """
+        Whether token can be used without trying to refresh it: it is valid beyond the refresh margin or, when
+        the token says a refresh is not possible before then, it is before its 'refresh_after' time
+
+        Parameters
+        ----------
+        token
+            The token, or None
+
+        Returns
+        -------
+        bool
+        """
+        if token is None:
+            return False
+        if 'refresh_after' in token:
+            return datetime.now() < min(token['refresh_after'], token['expiration_date'])
+        return datetime.now() + self.refresh_margin < token['expiration_date']
+
+    @staticmethod
+    def _valid(token: Dict[str, Any] | None) -> bool:
+        return token is not None and datetime.now() < token['expiration_date']
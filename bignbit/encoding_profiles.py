@@ -0,0 +1,112 @@
+"""
+Output encoding profiles for the GeoTIFF sub-tiles produced by the OPERA HLS treatment.
+
+A profile names the GDAL driver and compression used to write each sub-tile. The named profiles below can be refined
+with a compression level, predictor and block size from the dataset configuration.
+"""
+import dataclasses
+from dataclasses import dataclass
+from typing import Dict, List
+
+# GTiff creation option setting the compression level of each codec that has one
+GTIFF_LEVEL_OPTIONS = {'DEFLATE': 'ZLEVEL', 'ZSTD': 'ZSTD_LEVEL'}
+
+
+@dataclass(frozen=True)
+class EncodingProfile:
+    """
+    GDAL driver and creation options used to write a sub-tile
+
+    Attributes
+    ----------
+    driver
+        'GTiff' for a tiled GeoTIFF or 'COG' for a Cloud-Optimized GeoTIFF
+    compress
+        Compression codec, e.g. 'LZW', 'DEFLATE' or 'ZSTD'
+    predictor
+        TIFF predictor, 2 for horizontal differencing, 3 for floating point. None to not use a predictor.
+    level
+        Compression level, only for DEFLATE or ZSTD. None for the GDAL default
+    block_size
+        Width and height of the internal tiles in pixels, None for the driver default
+    overviews
+        Write internal overviews. Only supported by the 'COG' driver.
+    """
+    driver: str = 'GTiff'
+    compress: str = 'LZW'
+    predictor: int | None = None
+    level: int | None = None
+    block_size: int | None = None
+    overviews: bool = False
+
+    def __post_init__(self):
+        if self.driver not in ('GTiff', 'COG'):
+            raise ValueError(f"Unsupported output driver '{self.driver}', must be 'GTiff' or 'COG'")
+        if self.overviews and self.driver != 'COG':
+            raise ValueError("Internal overviews are only supported by the 'COG' driver")
+        if self.level is not None and self.compress not in GTIFF_LEVEL_OPTIONS:
+            raise ValueError(f"A compression level is only supported by DEFLATE and ZSTD, not '{self.compress}'")
+
+    def creation_options(self) -> List[str]:
+        """
+        GDAL creation options for the profile's driver
+        """
+        if self.driver == 'COG':
+            options = [f'COMPRESS={self.compress}']
+            if self.level is not None:
+                options.append(f'LEVEL={self.level}')
+            if self.predictor is not None:
+                options.append(f"PREDICTOR={'FLOATING_POINT' if self.predictor == 3 else 'STANDARD'}")
+            if self.block_size is not None:
+                options.append(f'BLOCKSIZE={self.block_size}')
+            options.append(f"OVERVIEWS={'AUTO' if self.overviews else 'NONE'}")
+            return options
+
+        options = [f'COMPRESS={self.compress}', 'TILED=YES']
+        if self.level is not None:
+            options.append(f'{GTIFF_LEVEL_OPTIONS[self.compress]}={self.level}')
+        if self.predictor is not None:
+            options.append(f'PREDICTOR={self.predictor}')
+        if self.block_size is not None:
+            options += [f'BLOCKXSIZE={self.block_size}', f'BLOCKYSIZE={self.block_size}']
+        return options
+
+    @classmethod
+    def from_config(cls, config: str | Dict | None) -> 'EncodingProfile':
+        """
+        Build a profile from the 'outputEncoding' treatment option
+
+        Parameters
+        ----------
+        config
+            Either the name of a profile in PROFILES, or a dict with a 'profile' name and optional 'level', 'predictor'
+            and 'blockSize' overrides. None selects the default profile.
+
+        Returns
+        -------
+        EncodingProfile
+            The configured profile
+        """
+        if config is None:
+            return PROFILES['default']
+        if isinstance(config, str):
+            config = {'profile': config}
+
+        name = config.get('profile', 'default').lower()
+        if name not in PROFILES:
+            raise ValueError(f"Unknown output encoding profile '{name}', must be one of {sorted(PROFILES)}")
+        overrides = {}
+        for key, attribute in (('level', 'level'), ('predictor', 'predictor'), ('blockSize', 'block_size')):
+            if config.get(key) is not None:
+                overrides[attribute] = int(config[key])
+        return dataclasses.replace(PROFILES[name], **overrides)
+
+
+PROFILES = {
+    # The original output of the treatment
+    'default': EncodingProfile(),
+    'deflate': EncodingProfile(compress='DEFLATE', predictor=2),
+    'zstd': EncodingProfile(compress='ZSTD', predictor=2),
+    'cog': EncodingProfile(driver='COG', compress='DEFLATE', predictor=2, overviews=True),
+    'cog-zstd': EncodingProfile(driver='COG', compress='ZSTD', predictor=2, overviews=True)
+}
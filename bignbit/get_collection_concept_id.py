@@ -4,7 +4,6 @@ Get the collection concept id that a granule belongs to
 import logging
 import os
 
-import requests
 from cumulus_logger import CumulusLogger
 from cumulus_process import Process
 
@@ -12,6 +11,9 @@ from bignbit import utils
 
 CUMULUS_LOGGER = CumulusLogger('get_collection_concept_id')
 
+# Read the EDL credentials while the Lambda initializes instead of in the first invocation
+utils.prefetch_edl_creds()
+
 
 class CMA(Process):
     """
@@ -62,20 +64,11 @@ def get_collection_concept_id(collection_shortname: str, collection_version: str
     str
       the collection concept id
     """
-    cmr_search_collections_url = f'https://cmr.{"uat." if cmr_environment == "UAT" else ""}earthdata.nasa.gov/search/collections.umm_json'
-    edl_user, edl_pass = utils.get_edl_creds()
-    token = utils.get_cmr_user_token(edl_user, edl_pass, cmr_environment)
-
-    umm_json_response = requests.get(cmr_search_collections_url,
-                                     headers={'Authorization': f'Bearer {token}'},
-                                     params={
-                                         'provider': cmr_provider,
-                                         'short_name': collection_shortname,
-                                         'version': collection_version
-                                     },
-                                     timeout=10)
-    umm_json_response.raise_for_status()
-    umm_json = umm_json_response.json()
+    umm_json = utils.get_cmr_client(cmr_environment).search_collections(
+        provider=cmr_provider,
+        short_name=collection_shortname,
+        version=collection_version
+    )
 
     return umm_json['items'][0]['meta']['concept-id']
 
@@ -106,6 +99,7 @@ def lambda_handler(event, context):
     logging_level = os.environ.get('LOGGING_LEVEL', 'info')
     CUMULUS_LOGGER.logger.level = levels.get(logging_level, 'info')
     CUMULUS_LOGGER.setMetadata(event, context)
+    utils.set_cmr_deadline(context)
 
     return CMA.cumulus_handler(event, context=context)
 
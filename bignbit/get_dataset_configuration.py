@@ -5,10 +5,11 @@ import json
 import logging
 import os
 
-import boto3
 from cumulus_logger import CumulusLogger
 from cumulus_process import Process
 
+from bignbit import utils
+
 CUMULUS_LOGGER = CumulusLogger('get_dataset_configuration')
 
 
@@ -66,7 +67,7 @@ def get_collection_config(config_bucket_name: str, config_key_name: str) -> dict
     dict
       The configuration json document as a dict
     """
-    s3_client = boto3.client('s3')
+    s3_client = utils.get_aws_client('s3')
 
     try:
         object_result = s3_client.get_object(Bucket=config_bucket_name, Key=config_key_name)
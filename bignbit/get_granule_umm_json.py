@@ -8,10 +8,13 @@ import urllib.parse
 from cumulus_logger import CumulusLogger
 from cumulus_process import Process
 
-from bignbit import utils
+from bignbit import payload_offload, utils
 
 CUMULUS_LOGGER = CumulusLogger('get_granule_umm_json')
 
+# Read the EDL credentials while the Lambda initializes instead of in the first invocation
+utils.prefetch_edl_creds()
+
 
 class CMA(Process):
     """
@@ -38,7 +41,7 @@ class CMA(Process):
             cmr_concept_id = urllib.parse.urlparse(self.input['granules'][0]['cmrLink']).path.rstrip('/').split('/')[-1].split('.')[0]
 
         self.input['granule_umm_json'] = utils.get_umm_json(cmr_concept_id, cmr_environment)
-        return self.input
+        return payload_offload.offload_payload(self.input)
 
 
 def lambda_handler(event, context):
@@ -67,6 +70,7 @@ def lambda_handler(event, context):
     logging_level = os.environ.get('LOGGING_LEVEL', 'info')
     CUMULUS_LOGGER.logger.level = levels.get(logging_level, 'info')
     CUMULUS_LOGGER.setMetadata(event, context)
+    utils.set_cmr_deadline(context)
 
     return CMA.cumulus_handler(event, context=context)
 
@@ -1,16 +1,23 @@
 """Cumulus lambda class to check harmony job status"""
 import logging
 import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+from urllib.parse import urlparse
 
+import botocore.exceptions
 from cumulus_logger import CumulusLogger
 from cumulus_process import Process
 from harmony import LinkType
 
-from bignbit import utils
+from bignbit import payload_offload, utils
 from bignbit.utils import json_dumps_with_datetime
 
 CUMULUS_LOGGER = CumulusLogger('get_harmony_job_status')
 
+# Read the EDL credentials while the Lambda initializes instead of in the first invocation
+utils.prefetch_edl_creds()
+
 
 class HarmonyJobIncompleteError(Exception):
     """Exception raised when a harmony job is not complete"""
@@ -54,23 +61,29 @@ class CMA(Process):
         current_variable = self.config.get("current_variable", "")
         current_crs = self.config.get("current_crs", "")
 
+        result_manifest: list[dict[str, Any]] = []
         job_status = check_harmony_job(
             harmony_job_id,
             cmr_environment,
             current_variable,
-            current_crs
+            current_crs,
+            result_manifest
         )
         harmony_job_info = self.input.get("harmony_job", {})
         harmony_job_info["status"] = job_status
+        # Passed on to handle_big_result so it does not have to ask Harmony for the results again; a large manifest
+        # is offloaded to S3 so that the 'big' lists collecting every job stay small
+        harmony_job_info["result_manifest"] = result_manifest
         self.logger.info(f"Harmony job {harmony_job_id} was {job_status}")
-        return harmony_job_info
+        return payload_offload.offload_payload(harmony_job_info, keys=('result_manifest',))
 
 
 def check_harmony_job(
         harmony_job_id: str,
         cmr_env: str,
         variable: str,
-        crs: str
+        crs: str,
+        result_manifest: list[dict[str, Any]] | None = None
 ) -> str:
     """
     Function to check a harmony job id status and returns the status
@@ -81,6 +94,12 @@ def check_harmony_job(
         The harmony job id to check
     cmr_env: str
         The CMR environment to use, defaults to None which uses the default environment
+    variable: str
+        The variable of the harmony job, used in log messages
+    crs: str
+        The output crs of the harmony job, used in log messages
+    result_manifest: list
+        Optional list that is extended with the result manifest of a successful job (see build_result_manifest)
     Returns
     ----------
     str
@@ -110,6 +129,8 @@ def check_harmony_job(
             )
             CUMULUS_LOGGER.warning(error_msg)
             raise HarmonyJobNoDataError(error_msg)
+        if result_manifest is not None:
+            result_manifest.extend(build_result_manifest(result_urls))
         return job_status.get('status', 'successful')
 
     # If the job is still running or accepted, raise an exception that will be retried by the step function workflow.
@@ -122,6 +143,44 @@ def check_harmony_job(
         f'Harmony job {harmony_job_id} has failed. Status: {json_dumps_with_datetime(job_status)}')
 
 
+def build_result_manifest(result_urls: list[str], max_workers: int = 8) -> list[dict[str, Any]]:
+    """
+    Describe the results of a Harmony job compactly enough to be carried in the workflow payload. Each result is looked
+    up with a HEAD request; the objects are not read.
+
+    Parameters
+    ----------
+    result_urls: list
+        S3 URLs of the job results
+    max_workers: int
+        Number of HEAD requests in flight at once
+
+    Returns
+    ----------
+    list
+        One dict per result with its 'url' and, when they could be looked up, its 'size' in bytes and a trustworthy
+        'checksum' and 'checksumType' (see utils.stored_checksum)
+    """
+    s3_client = utils.get_aws_client('s3')
+
+    def describe(url: str) -> dict[str, Any]:
+        entry: dict[str, Any] = {'url': url}
+        try:
+            head_response = s3_client.head_object(Bucket=urlparse(url).netloc, Key=urlparse(url).path.lstrip('/'),
+                                                  ChecksumMode='ENABLED')
+        except botocore.exceptions.ClientError as e:
+            CUMULUS_LOGGER.warning(f'Could not describe Harmony result {url}: {e}')
+            return entry
+        entry['size'] = head_response['ContentLength']
+        checksum = utils.stored_checksum(head_response)
+        if checksum:
+            entry['checksumType'], entry['checksum'] = checksum
+        return entry
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(describe, result_urls))
+
+
 def lambda_handler(event, context):
     """handler that gets called by aws lambda
     Parameters
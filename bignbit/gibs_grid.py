@@ -0,0 +1,123 @@
+"""
+Analytic computation of the GIBS sub-tiles covering a footprint.
+
+GITC ingests OPERA HLS browse imagery as sub-tiles of a global geographic grid at 2.74658203125e-4 degrees
+(31.25 m) per pixel. Every sub-tile is 4096 x 4096 pixels, i.e. 1.125 x 1.125 degrees, and the grid is anchored at
+(-180, -90), giving 320 columns and 160 rows. A sub-tile is identified by its GID, the 1-based column followed by the
+1-based row, each zero padded to three digits: GID 318143 is column 318 (176.625E to 177.75E), row 143 (69.75N to
+70.875N).
+
+This reproduces the sub-tiles of the MGRS/GIBS intersection table derived from IMPACT's HLS processing without
+needing the table, so that any footprint can be tiled.
+"""
+import math
+from typing import Dict, List, Sequence, Tuple
+
+SUB_TILE_PIXELS = 4096
+RESOLUTION = 2.74658203125e-4
+SUB_TILE_DEGREES = SUB_TILE_PIXELS * RESOLUTION
+COLUMNS = round(360 / SUB_TILE_DEGREES)
+ROWS = round(180 / SUB_TILE_DEGREES)
+
+
+def gid(column: int, row: int) -> str:
+    """
+    GID of the sub-tile at the 1-based column and row
+    """
+    return f'{column:03d}{row:03d}'
+
+
+def sub_tile(column: int, row: int) -> Dict:
+    """
+    Sub-tile dict, in the format of the MGRS/GIBS intersection table, of the sub-tile at the 1-based column and row
+    """
+    if not (1 <= column <= COLUMNS and 1 <= row <= ROWS):
+        raise ValueError(f'Sub-tile column {column}, row {row} is outside of the GIBS grid')
+    return {
+        'GID': gid(column, row),
+        'minlon': -180 + (column - 1) * SUB_TILE_DEGREES,
+        'minlat': -90 + (row - 1) * SUB_TILE_DEGREES,
+        'maxlon': -180 + column * SUB_TILE_DEGREES,
+        'maxlat': -90 + row * SUB_TILE_DEGREES
+    }
+
+
+def sub_tile_for_gid(sub_tile_gid: str) -> Dict:
+    """
+    Sub-tile dict of the sub-tile with the given GID
+    """
+    sub_tile_gid = str(sub_tile_gid)
+    if len(sub_tile_gid) != 6 or not sub_tile_gid.isdigit():
+        raise ValueError(f"Invalid GID '{sub_tile_gid}', expected three digit column and row numbers")
+    return sub_tile(int(sub_tile_gid[:3]), int(sub_tile_gid[3:]))
+
+
+def sub_tiles_intersecting(footprint: Sequence[Tuple[float, float]]) -> List[Dict]:
+    """
+    Find the sub-tiles that intersect a footprint
+
+    Parameters
+    ----------
+    footprint
+        Outline of the footprint as a sequence of (lon, lat) vertices, densified enough that straight lines between the
+        vertices follow the footprint. Footprints crossing the antimeridian are supported.
+
+    Returns
+    -------
+    List[Dict]
+        Sub-tile dicts ordered by GID
+    """
+    lons = [lon for lon, _ in footprint]
+    if max(lons) - min(lons) > 180:
+        # Crosses the antimeridian, work in 0..360 and wrap the columns afterwards
+        footprint = [(lon + 360 if lon < 0 else lon, lat) for lon, lat in footprint]
+        lons = [lon for lon, _ in footprint]
+    lats = [lat for _, lat in footprint]
+
+    first_column = math.floor((min(lons) + 180) / SUB_TILE_DEGREES) + 1
+    last_column = math.ceil((max(lons) + 180) / SUB_TILE_DEGREES)
+    first_row = max(1, math.floor((min(lats) + 90) / SUB_TILE_DEGREES) + 1)
+    last_row = min(ROWS, math.ceil((max(lats) + 90) / SUB_TILE_DEGREES))
+
+    sub_tiles = []
+    for column in range(first_column, last_column + 1):
+        for row in range(first_row, last_row + 1):
+            cell = (-180 + (column - 1) * SUB_TILE_DEGREES, -90 + (row - 1) * SUB_TILE_DEGREES,
+                    -180 + column * SUB_TILE_DEGREES, -90 + row * SUB_TILE_DEGREES)
+            if _polygon_intersects_box(footprint, cell):
+                sub_tiles.append(sub_tile((column - 1) % COLUMNS + 1, row))
+    return sorted(sub_tiles, key=lambda s: s['GID'])
+
+
+def _polygon_intersects_box(polygon: Sequence[Tuple[float, float]], box: Tuple[float, float, float, float]) -> bool:
+    """
+    True if the polygon and the box (minx, miny, maxx, maxy) share more than a boundary
+    """
+    minx, miny, maxx, maxy = box
+    if any(minx < x < maxx and miny < y < maxy for x, y in polygon):
+        return True
+    corners = [(minx, miny), (maxx, miny), (maxx, maxy), (minx, maxy)]
+    if any(_point_in_polygon(corner, polygon) for corner in corners):
+        return True
+    box_edges = list(zip(corners, corners[1:] + corners[:1]))
+    polygon_edges = list(zip(polygon, list(polygon[1:]) + [polygon[0]]))
+    return any(_segments_cross(a, b, c, d) for a, b in polygon_edges for c, d in box_edges)
+
+
+def _point_in_polygon(point: Tuple[float, float], polygon: Sequence[Tuple[float, float]]) -> bool:
+    x, y = point
+    inside = False
+    for (x1, y1), (x2, y2) in zip(polygon, list(polygon[1:]) + [polygon[0]]):
+        if (y1 > y) != (y2 > y) and x < x1 + (y - y1) * (x2 - x1) / (y2 - y1):
+            inside = not inside
+    return inside
+
+
+def _segments_cross(a, b, c, d) -> bool:
+    """
+    True if segment ab properly crosses segment cd
+    """
+    def orientation(p, q, r):
+        return (q[0] - p[0]) * (r[1] - p[1]) - (q[1] - p[1]) * (r[0] - p[0])
+
+    return (orientation(a, b, c) * orientation(a, b, d) < 0) and (orientation(c, d, a) * orientation(c, d, b) < 0)
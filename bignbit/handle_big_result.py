@@ -7,18 +7,20 @@ import hashlib
 import json
 import logging
 import os
+import time
 import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
 from pathlib import Path
 from typing import Any
 from urllib.parse import urlparse
+from xml.sax.saxutils import escape
 
-import boto3
 from cumulus_logger import CumulusLogger
 from cumulus_process import Process
 from harmony import LinkType
 
-from bignbit import utils
+from bignbit import payload_offload, utils
 from bignbit.image_set import build_image_sets, to_cnm_product_dict, ImageSet
 
 CUMULUS_LOGGER = CumulusLogger('handle_big_result')
@@ -39,6 +41,15 @@ class IncompleteImageSetError(Exception):
         super().__init__(message)
 
 
+class ImageSetUploadError(Exception):
+    """
+    Exception thrown if the metadata xml or CNM message of one or more image sets could not be uploaded
+    """
+
+    def __init__(self, message):
+        super().__init__(message)
+
+
 class CMA(Process):
     """
     A cumulus message adapter
@@ -47,6 +58,8 @@ class CMA(Process):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.logger = CUMULUS_LOGGER
+        # Offloaded payload sections are only loaded from S3 when they are read
+        self.input = payload_offload.OffloadedPayload(self.input)
 
     def process(self) -> dict[str, Any]:
         """
@@ -89,6 +102,7 @@ class CMA(Process):
             static_data_day = 1
 
         subdaily = dataset_config.get('subdaily', False)
+        options = dataset_config.get('handleBigResultOptions', {})
         try:
             cmr_concept_id = self.input['granules'][0]['cmrConceptId']
         except KeyError:
@@ -114,13 +128,12 @@ class CMA(Process):
         if result_list and any(isinstance(el, list) for el in result_list):
             # flatten list of lists from Harmony map state (per variable, per output crs)
             harmony_job_refs = [item for sublist in result_list for item in sublist]
-            cma_file_list = []
-            for ref in harmony_job_refs:
-                if ref == {} or ref is None:
-                    # Skip harmony jobs that failed with HarmonyJobNoDataError, the pass state
-                    continue
-                file_sublist = process_harmony_results(ref, cmr_environment)
-                cma_file_list.extend(file_sublist)
+            # Harmony jobs that failed with HarmonyJobNoDataError are empty (the pass state) and are skipped
+            cma_file_list = process_all_harmony_results(
+                harmony_job_refs,
+                cmr_environment,
+                int(options.get('harmonyResultWorkers', 1))
+            )
             # If there is truly no data, return no CNM URLs and finish the workflow.
             if not cma_file_list:
                 return {'pobit': []}
@@ -143,33 +156,24 @@ class CMA(Process):
         # ------------------------------------------------------------------------------------------
         # Generate a metadata XML and upload a CNM message for each image set
         # ------------------------------------------------------------------------------------------
-        pobit_cnm_urls: list[dict[str, str]] = []
-        for image_set in pobit_image_sets:
-            # Generates and uploads metadata XML, then returns the updated image_set
-            # that is, image_set.image_metadata field gets populated with XML
-            updated_image_set = generate_metadata(
-                image_set,
-                begin, mid, end, data_day,
-                subdaily,
-                partial_id
-            )
-            CUMULUS_LOGGER.info(f'Finished generating metadata for {image_set.name}')
-            # Convert image_set into CNM JSON object and upload to S3
-            cnm_key = write_cnm_message(
-                updated_image_set,
-                cmr_provider,
-                collection_name,
-                granule_id,
-                bignbit_audit_bucket,
-                bignbit_audit_path
-            )
-            pobit_cnm_urls.append({
-                'cmr_provider': cmr_provider,
-                'collection_name': collection_name,
-                'cnm_bucket': bignbit_audit_bucket,
-                'cnm_key': cnm_key
-            })
-            CUMULUS_LOGGER.info(f'Finished writing CNM message for {image_set.name}')
+        cnm_keys = write_image_sets(
+            pobit_image_sets,
+            begin, mid, end, data_day,
+            subdaily,
+            partial_id,
+            cmr_provider,
+            collection_name,
+            granule_id,
+            bignbit_audit_bucket,
+            bignbit_audit_path,
+            int(options.get('uploadWorkers', 1))
+        )
+        pobit_cnm_urls: list[dict[str, str]] = [{
+            'cmr_provider': cmr_provider,
+            'collection_name': collection_name,
+            'cnm_bucket': bignbit_audit_bucket,
+            'cnm_key': cnm_key
+        } for cnm_key in cnm_keys]
 
         response_payload = {
             'granules': self.input.get('granules', []),
@@ -179,14 +183,15 @@ class CMA(Process):
         return response_payload
 
 
-def process_harmony_results(harmony_job: dict[str, str], cmr_env: str) -> list[dict[str, Any]]:
+def process_harmony_results(harmony_job: dict[str, Any], cmr_env: str) -> list[dict[str, Any]]:
     """
     Process the results of a Harmony job
 
     Parameters
     ----------
-    harmony_job : Dict[str, str]
-       The result dictionary from a successful Harmony job. Contains job id, variable, and output crs
+    harmony_job : Dict[str, Any]
+       The result dictionary from a successful Harmony job. Contains job id, variable, and output crs, and the result
+       manifest recorded by get_harmony_job_status if there is one
     cmr_env : str
        The CMR environment to use
 
@@ -195,48 +200,122 @@ def process_harmony_results(harmony_job: dict[str, str], cmr_env: str) -> list[d
         List[Dict[str, Any]]
             A list of CMA file dictionaries pointing to the transformed image(s)
     """
-    job_id = harmony_job.get('job', '')
-    if job_id == '':
+    if harmony_job.get('job', '') == '':
         return []
-    variable = harmony_job.get('variable', 'all')
-    current_crs = harmony_job.get('output_crs', 'EPSG:4326')
 
-    s3_client = boto3.client('s3')
-    harmony_client = utils.get_harmony_client(cmr_env)
-    result_urls = list(harmony_client.result_urls(job_id, link_type=LinkType.s3))
+    s3_client = utils.get_aws_client('s3')
+    results = list_harmony_results(harmony_job, cmr_env)
+    return [harmony_result_file_dict(harmony_job, result, s3_client) for result in results]
 
-    CUMULUS_LOGGER.info('Processing {} result files for {}', len(result_urls), variable)
-    CUMULUS_LOGGER.debug('Results: {}', result_urls)
 
-    # Check if Harmony returned no data
-    if not result_urls:
+def process_all_harmony_results(
+        harmony_jobs: list[dict[str, Any] | None],
+        cmr_env: str,
+        max_workers: int = 1
+) -> list[dict[str, Any]]:
+    """
+    Process the results of many Harmony jobs concurrently. The results of all jobs are listed on a thread pool, then
+    the checksums of all result objects are looked up on the same pool.
+
+    Parameters
+    ----------
+    harmony_jobs : List[Dict[str, Any]]
+       The result dictionaries from the Harmony jobs. Empty or missing entries (jobs that returned no data) are ignored
+    cmr_env : str
+       The CMR environment to use
+    max_workers : int
+       Number of threads listing and inspecting results at once
+
+    Returns
+    ----------
+        List[Dict[str, Any]]
+            The CMA file dictionaries of the results, in the same order as processing the jobs one at a time with
+            process_harmony_results
+    """
+    harmony_jobs = [job for job in harmony_jobs if job and job.get('job', '') != '']
+    if not harmony_jobs:
         return []
 
-    file_dicts = []
-    for url in result_urls:
-        bucket, key = urlparse(url).netloc, urlparse(url).path.lstrip('/')
-
-        response = s3_client.get_object(Bucket=bucket, Key=key)
-        md5_hash = hashlib.new('md5')
-        for chunk in response['Body'].iter_chunks(chunk_size=100 * 1024 * 1024):  # 100 MB chunk size
-            md5_hash.update(chunk)
-
-        filename = key.split('/')[-1]
-        file_dict = {
-            'fileName': filename,
-            'bucket': bucket,
-            'key': key,
-            'checksum': md5_hash.hexdigest(),
-            'checksumType': 'md5'
-        }
-        # Weird quirk where if we are working with a collection that doesn't define variables, the Harmony request
-        # should specify 'all' as the variable value but the GIBS message should be sent with the variable set to 'none'
-        if variable.lower() != 'all':
-            file_dict['variable'] = variable
-        file_dict['output_crs'] = current_crs.upper()
-        file_dicts.append(file_dict)
+    s3_client = utils.get_aws_client('s3')
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        job_results = list(executor.map(lambda job: list_harmony_results(job, cmr_env), harmony_jobs))
+        results = [(job, result) for job, job_result in zip(harmony_jobs, job_results) for result in job_result]
+        # executor.map yields in submission order, so the output order does not depend on which request finishes first
+        return list(executor.map(lambda result: harmony_result_file_dict(*result, s3_client), results))
+
+
+def list_harmony_results(harmony_job: dict[str, Any], cmr_env: str) -> list[dict[str, Any]]:
+    """
+    List the outputs of a Harmony job. The result manifest recorded by get_harmony_job_status is used when the job
+    has one, loading it from S3 if it was offloaded; Harmony is only asked for the result URLs of jobs without a
+    manifest.
+
+    Parameters
+    ----------
+    harmony_job : Dict[str, Any]
+       The result dictionary from a successful Harmony job
+    cmr_env : str
+       The CMR environment to use
+
+    Returns
+    ----------
+        List[Dict[str, Any]]
+            Manifest entries of the job outputs, each with at least a 'url'
+    """
+    if 'result_manifest' in harmony_job:
+        results = list(payload_offload.resolve(harmony_job['result_manifest']))
+    else:
+        harmony_client = utils.get_harmony_client(cmr_env)
+        results = [{'url': url} for url in harmony_client.result_urls(harmony_job['job'], link_type=LinkType.s3)]
+
+    CUMULUS_LOGGER.info('Processing {} result files for {}', len(results), harmony_job.get('variable', 'all'))
+    CUMULUS_LOGGER.debug('Results: {}', [result['url'] for result in results])
+    return results
+
+
+def harmony_result_file_dict(harmony_job: dict[str, Any], result: dict[str, Any], s3_client) -> dict[str, Any]:
+    """
+    Build the CMA file dictionary of one Harmony job output
+
+    Parameters
+    ----------
+    harmony_job : Dict[str, Any]
+       The result dictionary from the Harmony job that produced the output
+    result : Dict[str, Any]
+       Manifest entry of the output (see list_harmony_results)
+    s3_client
+       boto3 S3 client used to look up the checksum of the output when the manifest entry has none
 
-    return file_dicts
+    Returns
+    ----------
+        Dict[str, Any]
+            CMA file dictionary pointing to the output
+    """
+    variable = harmony_job.get('variable', 'all')
+    current_crs = harmony_job.get('output_crs', 'EPSG:4326')
+    url = urlparse(result['url'])
+    bucket, key = url.netloc, url.path.lstrip('/')
+
+    if result.get('checksum') and result.get('checksumType'):
+        checksum_type, checksum = result['checksumType'], result['checksum']
+    else:
+        # Prefer checksums S3 or Harmony already stored over downloading the object again
+        checksum_type, checksum = utils.s3_object_checksum(bucket, key, s3_client)
+
+    filename = key.split('/')[-1]
+    file_dict = {
+        'fileName': filename,
+        'bucket': bucket,
+        'key': key,
+        'checksum': checksum,
+        'checksumType': checksum_type
+    }
+    # Weird quirk where if we are working with a collection that doesn't define variables, the Harmony request
+    # should specify 'all' as the variable value but the GIBS message should be sent with the variable set to 'none'
+    if variable.lower() != 'all':
+        file_dict['variable'] = variable
+    file_dict['output_crs'] = current_crs.upper()
+    return file_dict
 
 
 def generate_metadata(
@@ -275,33 +354,58 @@ def generate_metadata(
     ImageSet
       The ImageSet object from the input with the metadata xml field populated
     """
-    # World file is allowed to be excluded as it is not present when performing OPERA HLS Treatment
-    if image_set.image == {}:
-        raise IncompleteImageSetError(f'Missing one or more components of GIBS image set: {image_set.name}')
-    image_mdxml = create_metadata_xml(
-        begin_time,
-        mid_time,
-        end_time,
-        data_day,
-        subdaily,
-        partial_id
-    )
-
-    image_file_meta = image_set.image
-    mdxml_file_meta = get_mdxml_cnm_file_meta(image_mdxml, image_file_meta)
-    image_set.image_metadata = mdxml_file_meta
-    staging_bucket = str(mdxml_file_meta.get('bucket', ''))
-    xml_key = str(mdxml_file_meta.get('key', ''))
+    image_mdxml = build_metadata(image_set, begin_time, mid_time, end_time, data_day, subdaily, partial_id)
     s3_uri = utils.upload_object(
         image_mdxml,
-        staging_bucket,
-        xml_key,
+        str(image_set.image_metadata.get('bucket', '')),
+        str(image_set.image_metadata.get('key', '')),
         'application/xml'
     )
     CUMULUS_LOGGER.info(f'Uploaded file {s3_uri}')
     return image_set
 
 
+def build_metadata(
+        image_set: ImageSet,
+        begin_time: str,
+        mid_time: str,
+        end_time: str,
+        data_day: str,
+        subdaily: bool,
+        partial_id: str | None,
+        template: 'MetadataXmlTemplate | None' = None
+) -> bytes:
+    """
+    Create the ImageMetadata-v1.2 xml of an image set without uploading it, and populate the image_metadata field of
+    the image set with its file metadata. Throw an error if the image set is incomplete at this stage.
+
+    Parameters are the same as generate_metadata. If the MetadataXmlTemplate of the granule is given, the xml is
+    rendered from it instead of being built from the other parameters.
+
+    Returns
+    -------
+    bytes
+      The metadata xml document
+    """
+    # World file is allowed to be excluded as it is not present when performing OPERA HLS Treatment
+    if image_set.image == {}:
+        raise IncompleteImageSetError(f'Missing one or more components of GIBS image set: {image_set.name}')
+    if template:
+        image_mdxml = template.render()
+    else:
+        image_mdxml = create_metadata_xml(
+            begin_time,
+            mid_time,
+            end_time,
+            data_day,
+            subdaily,
+            partial_id
+        )
+
+    image_set.image_metadata = get_mdxml_cnm_file_meta(image_mdxml, image_set.image)
+    return image_mdxml
+
+
 def create_metadata_xml(
         begin_time: str,
         mid_time: str,
@@ -333,10 +437,63 @@ def create_metadata_xml(
     str
       New XML document encoded as a utf-8 string
     """
-    time_now = datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+    return _build_metadata_xml(_production_time(), begin_time, mid_time, end_time, data_day, subdaily, partial_id)
+
+
+class MetadataXmlTemplate:  # pylint: disable=too-few-public-methods
+    """
+    ImageryMetadata-v1.2 document of a granule serialized once, so that only ProviderProductionDateTime has to be
+    filled in for each image set. render() returns the same bytes as create_metadata_xml with the same arguments.
 
+    Parameters are the same as create_metadata_xml.
+    """
+    _PLACEHOLDER = 'ProviderProductionDateTime'
+
+    def __init__(
+            self,
+            begin_time: str,
+            mid_time: str,
+            end_time: str,
+            data_day: str,
+            subdaily: bool,
+            partial_id: str | None
+    ):
+        document = _build_metadata_xml(self._PLACEHOLDER, begin_time, mid_time, end_time, data_day, subdaily,
+                                       partial_id)
+        # The production time is the first text of the document, so it is where the placeholder first occurs after
+        # the opening tag of the same name
+        opening_tag = f'<{self._PLACEHOLDER}>'.encode()
+        head, tail = document.split(opening_tag + self._PLACEHOLDER.encode(), 1)
+        self._head = head + opening_tag
+        self._tail = tail
+
+    def render(self, production_time: str | None = None) -> bytes:
+        """
+        The metadata xml document with the given production time, by default the current time
+
+        Returns
+        -------
+        bytes
+          XML document encoded as utf-8
+        """
+        return self._head + escape(production_time or _production_time()).encode('utf-8') + self._tail
+
+
+def _production_time() -> str:
+    return datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+
+def _build_metadata_xml(
+        production_time: str,
+        begin_time: str,
+        mid_time: str,
+        end_time: str,
+        data_day: str,
+        subdaily: bool,
+        partial_id: str | None,
+) -> bytes:
     imagery_metadata = ET.Element('ImageryMetadata')
-    ET.SubElement(imagery_metadata, 'ProviderProductionDateTime').text = time_now
+    ET.SubElement(imagery_metadata, 'ProviderProductionDateTime').text = production_time
     ET.SubElement(imagery_metadata, 'DataStartDateTime').text = begin_time
     ET.SubElement(imagery_metadata, 'DataMidDateTime').text = mid_time
     ET.SubElement(imagery_metadata, 'DataEndDateTime').text = end_time
@@ -417,11 +574,7 @@ def write_cnm_message(
     s3_key: str
       s3 key pointing to the uploaded CNM message
     """
-    cnm_message = construct_cnm(image_set, cmr_provider, collection_name)
-    cnm_bytes = json.dumps(cnm_message).encode()
-    submission_time = cnm_message.get('submissionTime')
-    collection_fullname = cnm_message.get('collection')
-    cnm_key = f'{bignbit_audit_path}/{collection_fullname}/{granule_id}.{submission_time}.cnm.json'
+    cnm_key, cnm_bytes = build_cnm_message(image_set, cmr_provider, collection_name, granule_id, bignbit_audit_path)
     utils.upload_object(
         cnm_bytes,
         bignbit_audit_bucket,
@@ -431,6 +584,122 @@ def write_cnm_message(
     return cnm_key
 
 
+def build_cnm_message(
+        image_set: ImageSet,
+        cmr_provider: str,
+        collection_name: str,
+        granule_id: str,
+        bignbit_audit_path: str,
+        taken_keys: set[str] | None = None
+) -> tuple[str, bytes]:
+    """
+    Generate the CNM message of an ImageSet and the key it is stored under, without uploading it
+
+    Parameters
+    ----------
+    image_set, cmr_provider, collection_name, granule_id, bignbit_audit_path
+      See write_cnm_message
+    taken_keys: set
+      Keys of the CNM messages already built for this granule. CNM keys include the submission time in milliseconds,
+      so when a key is taken the message is built again once the clock has moved on. The new key is added to the set
+
+    Returns
+    ----------
+    s3_key: str
+      s3 key to store the CNM message under
+    cnm_bytes: bytes
+      The CNM message as JSON
+    """
+    while True:
+        cnm_message = construct_cnm(image_set, cmr_provider, collection_name)
+        submission_time = cnm_message.get('submissionTime')
+        collection_fullname = cnm_message.get('collection')
+        cnm_key = f'{bignbit_audit_path}/{collection_fullname}/{granule_id}.{submission_time}.cnm.json'
+        if taken_keys is None:
+            break
+        if cnm_key not in taken_keys:
+            taken_keys.add(cnm_key)
+            break
+        time.sleep(0.001)
+    return cnm_key, json.dumps(cnm_message).encode()
+
+
+def write_image_sets(
+        image_sets: list[ImageSet],
+        begin_time: str,
+        mid_time: str,
+        end_time: str,
+        data_day: str,
+        subdaily: bool,
+        partial_id: str | None,
+        cmr_provider: str,
+        collection_name: str,
+        granule_id: str,
+        bignbit_audit_bucket: str,
+        bignbit_audit_path: str,
+        max_workers: int = 1
+) -> list[str]:
+    """
+    Generate the metadata xml and CNM message of every image set, then upload them all on a thread pool sharing one
+    S3 client. Equivalent to calling generate_metadata and write_cnm_message for each image set, except that uploads
+    of other image sets continue when one fails.
+
+    Parameters
+    ----------
+    image_sets
+      The image sets to write
+    begin_time, mid_time, end_time, data_day, subdaily, partial_id
+      See generate_metadata
+    cmr_provider, collection_name, granule_id, bignbit_audit_bucket, bignbit_audit_path
+      See write_cnm_message
+    max_workers
+      Number of uploads in flight at once
+
+    Returns
+    ----------
+    list
+      s3 keys of the uploaded CNM messages, in the order of image_sets
+
+    Raises
+    ----------
+    IncompleteImageSetError
+      If an image set is incomplete, before anything is uploaded
+    ImageSetUploadError
+      If any upload failed, naming every image set that failed
+    """
+    uploads = []
+    cnm_keys: set[str] = set()
+    # Only the production time differs between the metadata xml of the image sets of a granule
+    template = MetadataXmlTemplate(begin_time, mid_time, end_time, data_day, subdaily, partial_id)
+    for image_set in image_sets:
+        image_mdxml = build_metadata(image_set, begin_time, mid_time, end_time, data_day, subdaily, partial_id,
+                                     template)
+        cnm_key, cnm_bytes = build_cnm_message(image_set, cmr_provider, collection_name, granule_id,
+                                               bignbit_audit_path, cnm_keys)
+        uploads.append((image_set, cnm_key, [
+            (image_mdxml, str(image_set.image_metadata.get('bucket', '')), str(image_set.image_metadata.get('key', '')),
+             'application/xml'),
+            (cnm_bytes, bignbit_audit_bucket, cnm_key, 'application/json')
+        ]))
+
+    s3_client = utils.get_aws_client('s3')
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [[executor.submit(utils.upload_object, *upload, s3_client) for upload in objects]
+                   for _, _, objects in uploads]
+
+    failures = []
+    for (image_set, _, _), image_set_futures in zip(uploads, futures):
+        errors = [future.exception() for future in image_set_futures if future.exception()]
+        if errors:
+            failures.append(f'{image_set.name}: {errors[0]!r}')
+        else:
+            CUMULUS_LOGGER.info(f'Finished writing metadata and CNM message for {image_set.name}')
+    if failures:
+        raise ImageSetUploadError(f'Failed to upload {len(failures)} of {len(uploads)} image sets: '
+                                  + '; '.join(failures))
+    return [cnm_key for _, cnm_key, _ in uploads]
+
+
 def construct_cnm(
         image_set: ImageSet,
         cmr_provider: str,
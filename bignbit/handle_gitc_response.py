@@ -6,8 +6,11 @@ from json import loads
 
 from bignbit import utils
 
+# Read the EDL credentials while the Lambda initializes instead of in the first invocation
+utils.prefetch_edl_creds(os.environ.get('CMR_ENVIRONMENT'))
 
-def handler(event, _):
+
+def handler(event, context):
     """
     Handler of the function
 
@@ -30,14 +33,19 @@ def handler(event, _):
 
     logger.debug("Processing event %s", json.dumps(event))
 
-    for message in event["Records"]:
-        message_body = loads(message["body"])
+    utils.set_cmr_deadline(context)
+    cmr_env = os.environ['CMR_ENVIRONMENT']
+    message_bodies = [loads(message["body"]) for message in event["Records"]]
+    # Look up every granule of the batch at once; responses for the same granule share one lookup
+    umm_jsons = utils.get_umm_json_bulk([body["identifier"].rpartition('!')[-1] for body in message_bodies], cmr_env)
+
+    for message_body in message_bodies:
         gitc_id = message_body["identifier"]
         collection_name = message_body["collection"]
-        cmr_env = os.environ['CMR_ENVIRONMENT']
 
         granule_concept_id = gitc_id.rpartition('!')[-1]
-        umm_json = utils.get_umm_json(granule_concept_id, cmr_env)
+        # Granules missing from the search are fetched directly, which raises the CMR error
+        umm_json = umm_jsons.get(granule_concept_id) or utils.get_umm_json(granule_concept_id, cmr_env)
         granule_ur = umm_json['GranuleUR']
 
         cnmr_key_name = os.environ['BIGNBIT_AUDIT_PATH_NAME'] + "/" + collection_name + "/" + granule_ur + "." + message_body['submissionTime'] + "." + "cnm-r.json"
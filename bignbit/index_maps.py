@@ -0,0 +1,172 @@
+"""
+Persistent source-pixel index maps for gather-based nearest neighbour resampling.
+
+Every revisit of an MGRS tile is warped from the same UTM source grid to the same GIBS sub-tiles, so the geometry of
+the warp only has to be computed once. An index map holds, for every pixel of a sub-tile, the flat index of the source
+pixel that nearest neighbour resampling copies into it (or -1 where the sub-tile is outside the source). Resampling
+a new image on the same grid is then a single gather over its pixel array.
+
+Index maps are keyed by the MGRS grid code, GID, source grid and output grid and are kept in a local directory, whose
+least recently used maps are deleted once it outgrows its byte budget, and optionally in S3 so that they survive Lambda
+cold starts.
+"""
+import hashlib
+import io
+import json
+import os
+import pathlib
+import threading
+from dataclasses import dataclass
+from typing import Dict, NamedTuple
+
+import botocore.exceptions
+import numpy as np
+
+from bignbit import utils
+
+INDEX_MAP_PREFIX = 'opera_hls_processing/index_maps'
+
+
+class IndexMap(NamedTuple):
+    """
+    Source pixel index of every pixel of a sub-tile together with the sub-tile's grid
+    """
+    indices: np.ndarray
+    geotransform: tuple
+    projection: str
+
+
+def index_map_key(mgrs_grid_code: str, gid: str, source_grid: Dict, output_grid: Dict) -> str:
+    """
+    Name identifying the index map of one sub-tile of a source grid
+
+    Parameters
+    ----------
+    mgrs_grid_code
+        MGRS grid code of the source image
+    gid
+        GID of the sub-tile
+    source_grid
+        JSON serializable description of the source grid (projection, geotransform and size)
+    output_grid
+        JSON serializable description of the output grid (projection, bounds and resolution)
+
+    Returns
+    -------
+    str
+        Key of the index map
+    """
+    grids = json.dumps({'source': source_grid, 'output': output_grid}, sort_keys=True)
+    return f'{mgrs_grid_code}_{gid}_{hashlib.sha256(grids.encode()).hexdigest()[:32]}'
+
+
+def gather(source: np.ndarray, indices: np.ndarray, fill_value) -> np.ndarray:
+    """
+    Resample a source band with an index map
+
+    Parameters
+    ----------
+    source
+        2D array of source pixels
+    indices
+        Flat source pixel index of every output pixel, negative where the output is outside the source
+    fill_value
+        Value of output pixels outside the source
+
+    Returns
+    -------
+    np.ndarray
+        Array with the shape of indices and the dtype of source
+    """
+    outside = indices < 0
+    result = np.take(source.ravel(), np.where(outside, 0, indices))
+    result[outside] = fill_value
+    return result
+
+
+@dataclass(frozen=True)
+class IndexMapStore:
+    """
+    Index maps stored as compressed NumPy archives in a local directory and, if bucket is set, in S3. When max_bytes
+    is set, the least recently used archives are deleted from the directory whenever it grows beyond max_bytes.
+    """
+    directory: str = '/tmp/index_maps'
+    bucket: str | None = None
+    prefix: str = INDEX_MAP_PREFIX
+    max_bytes: int | None = None
+
+    def get(self, key: str) -> IndexMap | None:
+        """
+        The index map stored under key, or None if it has not been stored yet
+        """
+        filepath = self._filepath(key)
+        downloaded = False
+        if not filepath.exists() and self.bucket:
+            try:
+                filepath.parent.mkdir(parents=True, exist_ok=True)
+                utils.get_aws_client('s3').download_file(self.bucket, f'{self.prefix}/{key}.npz', str(filepath))
+                downloaded = True
+            except botocore.exceptions.ClientError as e:
+                if e.response['Error']['Code'] not in ('404', 'NoSuchKey', 'NotFound'):
+                    raise
+        try:
+            with np.load(filepath) as archive:
+                index_map = IndexMap(archive['indices'], tuple(archive['geotransform'].tolist()),
+                                     str(archive['projection']))
+        except FileNotFoundError:
+            # Not stored, or evicted by another worker
+            return None
+        if self.max_bytes is not None:
+            if downloaded:
+                self._evict(filepath)
+            else:
+                self._touch(filepath)
+        return index_map
+
+    def put(self, key: str, index_map: IndexMap):
+        """
+        Store index_map under key
+        """
+        filepath = self._filepath(key)
+        filepath.parent.mkdir(parents=True, exist_ok=True)
+        buffer = io.BytesIO()
+        np.savez_compressed(buffer, indices=index_map.indices, geotransform=np.array(index_map.geotransform),
+                            projection=np.array(index_map.projection))
+        # Write to a temporary name first so concurrent readers never see a partial file
+        partial_filepath = filepath.with_name(f'{filepath.name}.{os.getpid()}.{threading.get_ident()}.partial')
+        partial_filepath.write_bytes(buffer.getvalue())
+        partial_filepath.replace(filepath)
+        if self.bucket:
+            utils.get_aws_client('s3').put_object(Bucket=self.bucket, Key=f'{self.prefix}/{key}.npz', Body=buffer.getvalue())
+        if self.max_bytes is not None:
+            self._evict(filepath)
+
+    def _evict(self, keep: pathlib.Path):
+        """
+        Delete the least recently used archives other than keep until the directory fits in max_bytes
+        """
+        archives = []
+        for filepath in pathlib.Path(self.directory).glob('*.npz'):
+            try:
+                stat = filepath.stat()
+            except FileNotFoundError:
+                continue
+            archives.append((stat.st_mtime, stat.st_size, filepath))
+        total = sum(size for _, size, _ in archives)
+        for _, size, filepath in sorted(archives, key=lambda archive: archive[0]):
+            if total <= self.max_bytes:
+                break
+            if filepath == keep:
+                continue
+            filepath.unlink(missing_ok=True)
+            total -= size
+
+    @staticmethod
+    def _touch(filepath: pathlib.Path):
+        try:
+            os.utime(filepath)
+        except FileNotFoundError:
+            pass
+
+    def _filepath(self, key: str) -> pathlib.Path:
+        return pathlib.Path(self.directory).joinpath(f'{key}.npz')
@@ -0,0 +1,137 @@
+"""
+Compact, lazily loaded lookup of the GIBS sub-tiles intersecting each MGRS tile.
+
+The intersection table is stored as an embedded sqlite database keyed by MGRS grid code. Nothing is read until the
+first lookup, and a lookup only reads the rows for the requested tile instead of deserializing the whole table.
+"""
+import pathlib
+import pickle
+import sqlite3
+import threading
+from typing import Dict, Iterator, List, Mapping
+
+import importlib_resources
+from cumulus_logger import CumulusLogger
+
+CUMULUS_LOGGER = CumulusLogger('mgrs_gibs_index')
+
+INDEX_RESOURCE = 'data/mgrs_gibs_intersection.sqlite'
+PICKLE_RESOURCE = 'data/mgrs_gibs_intersection.json.pickle'
+
+SUB_TILE_FIELDS = ('GID', 'minlon', 'minlat', 'maxlon', 'maxlat')
+
+
+class MgrsGibsIndex(Mapping):
+    """
+    Read-only mapping of MGRS grid code (without the leading 'T') to the list of GIBS sub-tile dicts intersecting it.
+    Each sub-tile dict has the keys 'GID', 'minlon', 'minlat', 'maxlon' and 'maxlat'.
+
+    The backing sqlite file is opened on first access and shared by all threads. If the sqlite index does not exist
+    but the original pickle does, the pickle is loaded instead, also on first access.
+    """
+
+    def __init__(self, index_filepath: pathlib.Path, pickle_filepath: pathlib.Path | None = None):
+        self._index_filepath = pathlib.Path(index_filepath)
+        self._pickle_filepath = pathlib.Path(pickle_filepath) if pickle_filepath else None
+        self._lock = threading.Lock()
+        self._connection: sqlite3.Connection | None = None
+        self._table: Dict[str, List[Dict]] | None = None
+
+    @classmethod
+    def packaged(cls) -> 'MgrsGibsIndex':
+        """
+        The index shipped in bignbit/data
+        """
+        data = importlib_resources.files('bignbit')
+        return cls(pathlib.Path(str(data.joinpath(INDEX_RESOURCE))), pathlib.Path(str(data.joinpath(PICKLE_RESOURCE))))
+
+    @property
+    def loaded(self) -> bool:
+        """
+        True once the backing index has been opened
+        """
+        return self._connection is not None or self._table is not None
+
+    def _load(self):
+        with self._lock:
+            if self.loaded:
+                return
+            if self._index_filepath.exists():
+                self._connection = sqlite3.connect(f'file:{self._index_filepath}?mode=ro&immutable=1', uri=True,
+                                                   check_same_thread=False)
+            elif self._pickle_filepath and self._pickle_filepath.exists():
+                CUMULUS_LOGGER.warning('MGRS/GIBS intersection index {} not found, loading the whole table from {}; '
+                                       'build the index with scripts/build_mgrs_gibs_index.py',
+                                       self._index_filepath, self._pickle_filepath)
+                with open(self._pickle_filepath, 'rb') as fp:
+                    self._table = pickle.load(fp)
+            else:
+                raise FileNotFoundError(f'MGRS/GIBS intersection index not found at {self._index_filepath}')
+
+    def __getitem__(self, mgrs_grid_code: str) -> List[Dict]:
+        self._load()
+        if self._table is not None:
+            return self._table[mgrs_grid_code]
+
+        with self._lock:
+            rows = self._connection.execute(
+                'SELECT gid, minlon, minlat, maxlon, maxlat FROM sub_tiles WHERE mgrs = ? ORDER BY position',
+                (mgrs_grid_code,)).fetchall()
+        if not rows:
+            raise KeyError(mgrs_grid_code)
+        return [dict(zip(SUB_TILE_FIELDS, row)) for row in rows]
+
+    def __iter__(self) -> Iterator[str]:
+        self._load()
+        if self._table is not None:
+            return iter(self._table)
+        with self._lock:
+            rows = self._connection.execute('SELECT DISTINCT mgrs FROM sub_tiles ORDER BY mgrs').fetchall()
+        return iter([row[0] for row in rows])
+
+    def __len__(self) -> int:
+        self._load()
+        if self._table is not None:
+            return len(self._table)
+        with self._lock:
+            return self._connection.execute('SELECT COUNT(DISTINCT mgrs) FROM sub_tiles').fetchone()[0]
+
+    def close(self):
+        """
+        Release the backing index, it will be reopened on the next lookup
+        """
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+            self._connection = None
+            self._table = None
+
+
+def build_index(intersection: Mapping[str, List[Dict]], index_filepath: pathlib.Path):
+    """
+    Write an intersection table (such as the contents of mgrs_gibs_intersection.json.pickle) to a compact sqlite index
+
+    Parameters
+    ----------
+    intersection
+        Mapping of MGRS grid code to list of sub-tile dicts with at least the keys in SUB_TILE_FIELDS
+    index_filepath
+        Path of the sqlite file to create. Any existing file is replaced.
+    """
+    index_filepath = pathlib.Path(index_filepath)
+    index_filepath.unlink(missing_ok=True)
+    connection = sqlite3.connect(index_filepath)
+    try:
+        connection.execute('CREATE TABLE sub_tiles (mgrs TEXT NOT NULL, position INTEGER NOT NULL, gid TEXT NOT NULL, '
+                           'minlon REAL, minlat REAL, maxlon REAL, maxlat REAL, PRIMARY KEY (mgrs, position)) '
+                           'WITHOUT ROWID')
+        connection.executemany(
+            'INSERT INTO sub_tiles VALUES (?, ?, ?, ?, ?, ?, ?)',
+            ((mgrs_grid_code, position, str(sub_tile['GID']), sub_tile['minlon'], sub_tile['minlat'],
+              sub_tile['maxlon'], sub_tile['maxlat'])
+             for mgrs_grid_code, sub_tiles in sorted(intersection.items())
+             for position, sub_tile in enumerate(sub_tiles)))
+        connection.commit()
+        connection.execute('VACUUM')
+    finally:
+        connection.close()
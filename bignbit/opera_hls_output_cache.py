@@ -0,0 +1,133 @@
+"""
+Content-addressed reuse of OPERA HLS sub-tiles already written to the staging bucket.
+
+Sub-tiles produced with output caching enabled are stored under a key prefix derived from the ETag of the source
+image, the MGRS grid code and every parameter that affects the output pixels or encoding. Because the sub-tile file
+names already contain the GIBS GID, the full object key identifies (source ETag, MGRS, GID, parameters). A retried or
+reingested granule whose sub-tiles are all present can therefore reuse them, with the checksum recorded as object
+metadata at upload time, at the cost of one HEAD request per object instead of a download, warp and upload.
+"""
+import hashlib
+import json
+from typing import Dict, List
+
+import botocore.exceptions
+from cumulus_logger import CumulusLogger
+
+from bignbit import utils
+
+CUMULUS_LOGGER = CumulusLogger('opera_hls_output_cache')
+
+KEY_PREFIX = 'opera_hls_processing'
+CHECKSUM_METADATA_KEY = 'sha512'
+EMPTY_MARKER_SUFFIX = '.empty'
+
+
+def cache_key_prefix(source_etag: str, mgrs_grid_code: str, parameters: Dict) -> str:
+    """
+    Key prefix under which the sub-tiles of one source image are stored
+
+    Parameters
+    ----------
+    source_etag
+        ETag of the source image object
+    mgrs_grid_code
+        MGRS grid code of the granule
+    parameters
+        JSON serializable treatment parameters that affect the output files
+
+    Returns
+    -------
+    str
+        Key prefix without a trailing slash
+    """
+    identity = json.dumps({'etag': source_etag.strip('"'), 'mgrs': mgrs_grid_code, 'parameters': parameters},
+                          sort_keys=True)
+    return f'{KEY_PREFIX}/{hashlib.sha256(identity.encode()).hexdigest()}'
+
+
+class OutputCache:
+    """
+    Lookup and bookkeeping of cached sub-tiles in the staging bucket
+    """
+
+    def __init__(self, staging_bucket: str, parameters: Dict, s3_client=None):
+        self.staging_bucket = staging_bucket
+        self.parameters = parameters
+        self._s3_client = s3_client or utils.get_aws_client('s3')
+
+    def prefix_for(self, bucket: str, key: str, mgrs_grid_code: str) -> str:
+        """
+        Key prefix for the sub-tiles of the source image s3://bucket/key
+        """
+        etag = self._s3_client.head_object(Bucket=bucket, Key=key)['ETag']
+        return cache_key_prefix(etag, mgrs_grid_code, self.parameters)
+
+    def lookup(self, prefix: str, sub_tile_filenames: List[str],
+               skipped_sub_tiles: List[Dict] | None = None) -> List[Dict] | None:
+        """
+        Find previously uploaded sub-tiles
+
+        Parameters
+        ----------
+        prefix
+            Key prefix returned by prefix_for
+        sub_tile_filenames
+            File names of every sub-tile the source image can produce
+        skipped_sub_tiles
+            Optional list that the sub-tiles recorded as empty are appended to, as recorded by mark_empty, when every
+            sub-tile is found
+
+        Returns
+        -------
+        List[Dict] | None
+            CMA file metadata dicts of the cached sub-tiles in the order of sub_tile_filenames, leaving out sub-tiles
+            recorded as empty, or None unless every sub-tile is either cached or recorded as empty
+        """
+        file_metadata = []
+        skipped = []
+        for filename in sub_tile_filenames:
+            key = f'{prefix}/{filename}'
+            head = self._head(key)
+            if head is not None and CHECKSUM_METADATA_KEY in head.get('Metadata', {}):
+                file_metadata.append({
+                    "fileName": filename,
+                    "bucket": self.staging_bucket,
+                    "key": key,
+                    "checksum": head['Metadata'][CHECKSUM_METADATA_KEY],
+                    "checksumType": "SHA512"
+                })
+                continue
+            marker = self._head(key + EMPTY_MARKER_SUFFIX)
+            if marker is None:
+                CUMULUS_LOGGER.info(f'Cache miss for s3://{self.staging_bucket}/{key}')
+                return None
+            metadata = marker.get('Metadata', {})
+            skipped.append({'GID': metadata.get('gid'), 'fileName': filename, 'reason': metadata.get('reason', 'empty')})
+        if skipped_sub_tiles is not None:
+            skipped_sub_tiles.extend(skipped)
+        return file_metadata
+
+    def mark_empty(self, prefix: str, skipped_sub_tiles: List[Dict]):
+        """
+        Record that the given sub-tiles were skipped because they contained no data
+
+        Parameters
+        ----------
+        prefix
+            Key prefix returned by prefix_for
+        skipped_sub_tiles
+            The 'GID', 'fileName' and 'reason' of each skipped sub-tile, returned by lookup on later runs
+        """
+        for sub_tile in skipped_sub_tiles:
+            self._s3_client.put_object(Bucket=self.staging_bucket,
+                                       Key=f"{prefix}/{sub_tile['fileName']}{EMPTY_MARKER_SUFFIX}", Body=b'',
+                                       Metadata={'gid': str(sub_tile['GID']), 'reason': sub_tile['reason']})
+
+    def _head(self, key: str) -> Dict | None:
+        try:
+            return self._s3_client.head_object(Bucket=self.staging_bucket, Key=key)
+        except botocore.exceptions.ClientError as e:
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+                return None
+            raise
@@ -0,0 +1,152 @@
+"""
+Offloading of large sections of the CMA payload to S3.
+
+The payload passed between the bignbit tasks carries the granule UMM-G and, for OPERA HLS granules, long file lists.
+Sections larger than a threshold are written to S3 and replaced in the payload by a small reference, so the payload
+stays clear of the Step Functions size limit and tasks that only pass a section along never parse it. Tasks that read
+a section wrap their input in OffloadedPayload, which loads each referenced section when it is first read.
+
+Offloading is configured with the PAYLOAD_OFFLOAD_BUCKET and PAYLOAD_OFFLOAD_THRESHOLD_BYTES environment variables and
+is disabled unless both are set. Only sections read by the bignbit tasks alone are offloaded; sections the state
+machine reads through JSONPath (the granules and the dataset configuration) always stay in the payload. The result
+manifest of a Harmony job is offloaded within the job's entry of the nested 'big' lists, which handle_big_result
+resolves with resolve().
+"""
+import hashlib
+import json
+import os
+from typing import Any, Iterable
+from urllib.parse import urlparse
+
+from cumulus_logger import CumulusLogger
+
+from bignbit import utils
+
+CUMULUS_LOGGER = CumulusLogger('payload_offload')
+
+OFFLOAD_REFERENCE_KEY = 'bignbit_offloaded'
+OFFLOADABLE_KEYS = ('granule_umm_json', 'big', 'opera_hls_skipped_sub_tiles', 'result_manifest')
+PAYLOAD_OFFLOAD_PREFIX = 'bignbit_payloads'
+
+
+def is_reference(value: Any) -> bool:
+    """
+    Whether value is a reference to an offloaded payload section
+    """
+    return isinstance(value, dict) and OFFLOAD_REFERENCE_KEY in value
+
+
+def resolve(value: Any, s3_client=None) -> Any:
+    """
+    The payload section referenced by value, loaded from S3, or value itself if it is not a reference
+
+    Parameters
+    ----------
+    value
+        A payload section or a reference to an offloaded one
+    s3_client
+        optional boto3 S3 client to use
+
+    Returns
+    -------
+    Any
+        The payload section
+    """
+    if not is_reference(value):
+        return value
+    return json.loads(_read(value, s3_client or utils.get_aws_client('s3')))
+
+
+def _read(reference: dict[str, Any], s3_client) -> bytes:
+    url = urlparse(reference[OFFLOAD_REFERENCE_KEY])
+    body = s3_client.get_object(Bucket=url.netloc, Key=url.path.lstrip('/'))['Body'].read()
+    CUMULUS_LOGGER.info('Loaded offloaded payload section ({} bytes) from {}', len(body),
+                        reference[OFFLOAD_REFERENCE_KEY])
+    return body
+
+
+class OffloadedPayload(dict):
+    """
+    CMA payload whose offloaded sections are loaded from S3 when they are first read with [] or get(). Sections that
+    are never read stay references, so they are passed on to the next task without being downloaded.
+    """
+
+    def __init__(self, payload: dict[str, Any], s3_client=None):
+        super().__init__(payload)
+        self.s3_client = s3_client
+        self.loaded_references: dict[str, dict[str, Any]] = {}
+
+    def __getitem__(self, key):
+        value = super().__getitem__(key)
+        if is_reference(value):
+            value = self._load(key, value)
+        return value
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def _load(self, key: str, reference: dict[str, Any]) -> Any:
+        self.s3_client = self.s3_client or utils.get_aws_client('s3')
+        CUMULUS_LOGGER.debug('Loading offloaded payload section {}', key)
+        value = json.loads(_read(reference, self.s3_client))
+        super().__setitem__(key, value)
+        self.loaded_references[key] = reference
+        return value
+
+
+def offload_payload(
+        payload: dict[str, Any],
+        bucket: str | None = None,
+        threshold_bytes: int | None = None,
+        keys: Iterable[str] = OFFLOADABLE_KEYS,
+        s3_client=None
+) -> dict[str, Any]:
+    """
+    Replace the sections of payload whose JSON is larger than threshold_bytes by references to copies in S3. Sections
+    are stored under a content-addressed key, so an unchanged section is stored only once.
+
+    Parameters
+    ----------
+    payload
+        CMA payload returned by a task
+    bucket
+        Bucket holding offloaded sections, defaults to the PAYLOAD_OFFLOAD_BUCKET environment variable
+    threshold_bytes
+        Size of the JSON of a section from which it is offloaded, defaults to the PAYLOAD_OFFLOAD_THRESHOLD_BYTES
+        environment variable. Offloading is disabled when this is not positive or bucket is empty
+    keys
+        Payload keys that may be offloaded
+    s3_client
+        optional boto3 S3 client to use
+
+    Returns
+    -------
+    dict
+        A copy of payload with the large sections replaced by references, or payload itself if offloading is disabled
+    """
+    bucket = os.environ.get('PAYLOAD_OFFLOAD_BUCKET', '') if bucket is None else bucket
+    if threshold_bytes is None:
+        threshold_bytes = int(os.environ.get('PAYLOAD_OFFLOAD_THRESHOLD_BYTES') or 0)
+    if not bucket or threshold_bytes <= 0:
+        return payload
+
+    # dict() copies the stored values, so sections that were never loaded stay references
+    offloaded = dict(payload)
+    loaded_references = payload.loaded_references if isinstance(payload, OffloadedPayload) else {}
+    for key in keys:
+        if key not in offloaded or is_reference(offloaded[key]):
+            continue
+        body = json.dumps(offloaded[key], separators=(',', ':')).encode()
+        if len(body) < threshold_bytes:
+            CUMULUS_LOGGER.debug('Keeping payload section {} ({} bytes) inline', key, len(body))
+            continue
+
+        url = f's3://{bucket}/{PAYLOAD_OFFLOAD_PREFIX}/{hashlib.sha256(body).hexdigest()}.json'
+        if loaded_references.get(key, {}).get(OFFLOAD_REFERENCE_KEY) != url:
+            s3_client = s3_client or utils.get_aws_client('s3')
+            s3_client.put_object(Bucket=bucket, Key=urlparse(url).path.lstrip('/'), Body=body,
+                                 ContentType='application/json')
+        offloaded[key] = {OFFLOAD_REFERENCE_KEY: url, 'bytes': len(body)}
+        CUMULUS_LOGGER.info('Offloaded payload section {} ({} bytes, threshold {}) to {}', key, len(body),
+                            threshold_bytes, url)
+    return offloaded
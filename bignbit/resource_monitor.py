@@ -0,0 +1,86 @@
+"""
+Sampling of the memory and ephemeral storage used while processing, to right-size Lambda functions.
+"""
+import os
+import resource
+import threading
+from typing import Callable, Dict
+
+
+class ResourceMonitor:
+    """
+    Context manager recording the peak resident memory of this process, the peak bytes used on the filesystem holding
+    tmp_dir and the peak of any additional probes while the context is active. The values are sampled every
+    interval seconds on a background thread, and once more on exit.
+
+    Example
+    -------
+    with ResourceMonitor(probes={'gdal_cache_bytes': gdal.GetCacheUsed}) as monitor:
+        ...
+    CUMULUS_LOGGER.info(monitor.usage())
+    """
+
+    def __init__(self, tmp_dir: str = '/tmp', interval: float = 0.1, probes: Dict[str, Callable[[], int]] | None = None):
+        self.tmp_dir = tmp_dir
+        self.interval = interval
+        self.probes = probes or {}
+        self.peaks: Dict[str, int] = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def __enter__(self):
+        self._sample()
+        self._thread.start()
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+
+    def usage(self) -> Dict[str, int | None]:
+        """
+        Peak values recorded so far together with the limits they should be compared with
+
+        Returns
+        -------
+        Dict
+            peak_rss_bytes, peak_tmp_bytes and peak_<probe> for every probe, plus tmp_capacity_bytes and, when running
+            in AWS Lambda, memory_limit_bytes
+        """
+        memory_limit_mb = os.environ.get('AWS_LAMBDA_FUNCTION_MEMORY_SIZE')
+        tmp = os.statvfs(self.tmp_dir)
+        return {
+            **{f'peak_{name}': value for name, value in self.peaks.items()},
+            'tmp_capacity_bytes': tmp.f_blocks * tmp.f_frsize,
+            'memory_limit_bytes': int(memory_limit_mb) * 1024 * 1024 if memory_limit_mb else None
+        }
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def _sample(self):
+        values = {'rss_bytes': current_rss_bytes(), 'tmp_bytes': used_bytes(self.tmp_dir)}
+        values.update({name: probe() for name, probe in self.probes.items()})
+        for name, value in values.items():
+            self.peaks[name] = max(value, self.peaks.get(name, value))
+
+
+def current_rss_bytes() -> int:
+    """
+    Resident memory of this process in bytes. Falls back to the peak resident memory where /proc is not available.
+    """
+    try:
+        with open('/proc/self/statm', encoding='ascii') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def used_bytes(path: str) -> int:
+    """
+    Bytes in use on the filesystem holding path
+    """
+    stat = os.statvfs(path)
+    return (stat.f_blocks - stat.f_bfree) * stat.f_frsize
@@ -5,10 +5,11 @@ import logging
 import os
 from typing import Any
 
-import boto3
 from cumulus_logger import CumulusLogger
 from cumulus_process import Process
 
+from bignbit import utils
+
 CUMULUS_LOGGER = CumulusLogger('send_to_gitc')
 
 GIBS_REGION_ENV_NAME = "GIBS_REGION"
@@ -71,7 +72,7 @@ def read_cnm(cnm_bucket: str, cnm_key: str) -> str:
     cnm_key: str
       Key within the bucket pointing to CNM JSON
     """
-    s3_client = boto3.client('s3')
+    s3_client = utils.get_aws_client('s3')
     response = s3_client.get_object(Bucket=cnm_bucket, Key=cnm_key)
     return response['Body'].read().decode('utf-8')
 
@@ -109,7 +110,7 @@ def notify_gitc(cnm_payload: str) -> dict[str, Any]:
     }
     CUMULUS_LOGGER.debug(f'CNM message for GIBS: {sqs_message_params}')
 
-    sqs = boto3.client('sqs', region_name=gibs_region)
+    sqs = utils.get_aws_client('sqs', gibs_region)
     response = sqs.send_message(**sqs_message_params)
 
     CUMULUS_LOGGER.debug(f'SQS send_message output: {response}')
@@ -12,6 +12,9 @@ from bignbit import utils
 
 CUMULUS_LOGGER = CumulusLogger('submit_harmony_job')
 
+# Read the EDL credentials while the Lambda initializes instead of in the first invocation
+utils.prefetch_edl_creds()
+
 
 class CMA(Process):
     """Cumulus class to submit a harmony job"""
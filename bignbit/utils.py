@@ -1,54 +1,180 @@
 """Module for functions used by more than one lambda"""
+import base64
+import binascii
+import copy
 import hashlib
 import json
 import os
 import pathlib
+import random
 import re
+import threading
+import time
+from collections import OrderedDict
 from datetime import datetime, timedelta
 
-from typing import Any
+from typing import Any, BinaryIO, Iterable
 import boto3
+import botocore.config
+import botocore.exceptions
 import requests
+from cumulus_logger import CumulusLogger
 from dateutil import parser
 from harmony import Environment, Client
 
-ED_USER = ED_PASS = None
-EDL_USER_TOKEN: dict[str, str] = {}
+from bignbit import edl_token_cache
+
+CUMULUS_LOGGER = CumulusLogger('utils')
+
+EDL_CREDS: dict[tuple[str, str], tuple[tuple[str, str], float]] = {}
+EDL_CREDS_LOCK = threading.Lock()
+EDL_USER_TOKEN: dict[str, Any] = {}
+EDL_TOKEN_CACHE: edl_token_cache.TokenCache | None = None
 HARMONY_CLIENT: Client | None = None
+HARMONY_CLIENT_AUTH: tuple[str, str] | None = None
+AWS_CLIENTS: dict[tuple[str, str | None], Any] = {}
+AWS_CLIENTS_LOCK = threading.Lock()
+CMR_CLIENTS: dict[str, 'CMRClient'] = {}
+CMR_CLIENTS_LOCK = threading.Lock()
+CMR_DEADLINE: float | None = None
 
 HARMONY_SHOULD_VALIDATE_AUTH = os.environ.get('HARMONY_SHOULD_VALIDATE_AUTH', default='False').upper() == 'TRUE'
 
 
-def get_edl_creds() -> tuple[str, str]:
+def aws_client_config() -> botocore.config.Config:
+    """
+    Configuration of the AWS clients returned by get_aws_client, read from the environment:
+
+    - AWS_MAX_POOL_CONNECTIONS (default 32): connections kept open per client, at least the number of threads sharing a
+      client
+    - AWS_RETRY_MODE (default standard) and AWS_MAX_ATTEMPTS (default 3): botocore retry mode and total attempts per call
+    - AWS_CONNECT_TIMEOUT and AWS_READ_TIMEOUT (default 60): socket timeouts in seconds
+
+    Returns
+    -------
+    botocore.config.Config
+    """
+    return botocore.config.Config(
+        max_pool_connections=int(os.environ.get('AWS_MAX_POOL_CONNECTIONS', 32)),
+        retries={
+            'mode': os.environ.get('AWS_RETRY_MODE', 'standard'),
+            'total_max_attempts': int(os.environ.get('AWS_MAX_ATTEMPTS', 3))
+        },
+        connect_timeout=float(os.environ.get('AWS_CONNECT_TIMEOUT', 60)),
+        read_timeout=float(os.environ.get('AWS_READ_TIMEOUT', 60))
+    )
+
+
+def get_aws_client(service_name: str, region_name: str | None = None):
+    """
+    Get a boto3 client for an AWS service. Clients are created once per service and region and then kept for the
+    life of the process, so warm Lambda invocations reuse their endpoint resolution, credentials and open connections.
+    boto3 clients are thread-safe, so a client can be shared by worker threads.
+
+    Parameters
+    ----------
+    service_name: str
+      Name of the AWS service, e.g. 's3'
+    region_name: str
+      Region of the service, defaults to the region of the environment
+
+    Returns
+    -------
+    botocore.client.BaseClient
+      Client configured with aws_client_config
+    """
+    key = (service_name, region_name)
+    client = AWS_CLIENTS.get(key)
+    if client is None:
+        with AWS_CLIENTS_LOCK:
+            client = AWS_CLIENTS.get(key)
+            if client is None:
+                client = boto3.client(service_name, region_name=region_name, config=aws_client_config())
+                AWS_CLIENTS[key] = client
+    return client
+
+
+def clear_aws_clients():
+    """
+    Forget the clients created by get_aws_client, e.g. after changing credentials or the client configuration
+    """
+    with AWS_CLIENTS_LOCK:
+        AWS_CLIENTS.clear()
+
+
+def edl_creds_parameter_names(cmr_env: str | None = None) -> tuple[str, str]:
     """
-    Get EDL username and password from SSM.
+    Names of the SSM parameters holding the EDL username and password for a CMR environment: EDL_USER_SSM_<ENV> and
+    EDL_PASS_SSM_<ENV> when set (e.g. EDL_USER_SSM_UAT), otherwise EDL_USER_SSM and EDL_PASS_SSM.
+
+    Parameters
+    ----------
+    cmr_env
+      CMR environment the credentials are used in, None for the default credentials
 
     Returns
     -------
     (str, str)
-        EDL username and EDL password
+        SSM parameter names of the EDL username and EDL password
     """
+    suffix = f'_{cmr_env.upper()}' if cmr_env else ''
+    return (os.environ.get(f'EDL_USER_SSM{suffix}') or os.environ.get('EDL_USER_SSM'),
+            os.environ.get(f'EDL_PASS_SSM{suffix}') or os.environ.get('EDL_PASS_SSM'))
 
-    global ED_USER  # pylint: disable=W0603
-    global ED_PASS  # pylint: disable=W0603
 
-    ssm = boto3.client('ssm', region_name='us-west-2')
+def get_edl_creds(cmr_env: str | None = None) -> tuple[str, str]:
+    """
+    Get EDL username and password from SSM. Both parameters are read with one GetParameters call and kept for
+    EDL_CREDS_TTL_SECONDS (default 900) so rotated credentials are picked up by warm Lambdas.
 
-    if not ED_USER:
-        edl_user_ssm_name = os.environ.get('EDL_USER_SSM')
-        ssm_edl_user = ssm.get_parameter(
-            Name=edl_user_ssm_name, WithDecryption=True
-        )['Parameter']['Value']
-        ED_USER = ssm_edl_user
+    Parameters
+    ----------
+    cmr_env
+      CMR environment the credentials are used in, see edl_creds_parameter_names
 
-    if not ED_PASS:
-        edl_pass_ssm_name = os.environ.get('EDL_PASS_SSM')
-        ssm_edl_pass = ssm.get_parameter(
-            Name=edl_pass_ssm_name, WithDecryption=True
-        )['Parameter']['Value']
-        ED_PASS = ssm_edl_pass
+    Returns
+    -------
+    (str, str)
+        EDL username and EDL password
+    """
+    names = edl_creds_parameter_names(cmr_env)
+    ttl = float(os.environ.get('EDL_CREDS_TTL_SECONDS', 900))
+    cached = EDL_CREDS.get(names)
+    if cached and time.monotonic() - cached[1] < ttl:
+        return cached[0]
+
+    with EDL_CREDS_LOCK:
+        cached = EDL_CREDS.get(names)
+        if cached and time.monotonic() - cached[1] < ttl:
+            return cached[0]
+
+        response = get_aws_client('ssm', 'us-west-2').get_parameters(Names=list(dict.fromkeys(names)),
+                                                                     WithDecryption=True)
+        if response['InvalidParameters']:
+            raise ValueError(f"EDL credential SSM parameters not found: {', '.join(response['InvalidParameters'])}")
+        values = {parameter['Name']: parameter['Value'] for parameter in response['Parameters']}
+        creds = (values[names[0]], values[names[1]])
+        EDL_CREDS[names] = (creds, time.monotonic())
+    return creds
+
+
+def prefetch_edl_creds(cmr_env: str | None = None):
+    """
+    Load the EDL credentials into the get_edl_creds cache, to be called while a Lambda initializes so cold starts do
+    not pay for SSM in the request path. Does nothing when the SSM parameters are not configured, and logs instead of
+    raising on errors, which get_edl_creds then raises when the credentials are needed.
 
-    return ED_USER, ED_PASS
+    Parameters
+    ----------
+    cmr_env
+      CMR environment the credentials are used in, see edl_creds_parameter_names
+    """
+    if not all(edl_creds_parameter_names(cmr_env)):
+        return
+    try:
+        get_edl_creds(cmr_env)
+    except (botocore.exceptions.BotoCoreError, botocore.exceptions.ClientError, ValueError) as e:
+        CUMULUS_LOGGER.warning('Could not prefetch EDL credentials: {}', e)
 
 
 def format_iso_expiration_date(value: str | datetime) -> str:
@@ -78,9 +204,32 @@ def format_iso_expiration_date(value: str | datetime) -> str:
     return new_stamp.strftime("%m/%d/%Y")
 
 
+def get_edl_token_cache() -> edl_token_cache.TokenCache:
+    """
+    The cache of EDL user tokens shared with other workers, configured by the EDL_TOKEN_STORE environment variable
+    (file:///directory or s3://bucket/prefix, default file:///tmp/bignbit_edl_tokens), EDL_TOKEN_REFRESH_HOURS
+    (default 24), the time before expiration at which tokens are replaced, and EDL_TOKEN_WAIT_SECONDS (default 5), the
+    longest time a worker waits for another worker's refresh, also cut short by the CMR deadline of the invocation.
+
+    Returns
+    -------
+    edl_token_cache.TokenCache
+    """
+    global EDL_TOKEN_CACHE  # pylint: disable=W0603
+    if EDL_TOKEN_CACHE is None:
+        EDL_TOKEN_CACHE = edl_token_cache.TokenCache(
+            edl_token_cache.token_store_from_url(
+                os.environ.get('EDL_TOKEN_STORE') or edl_token_cache.DEFAULT_TOKEN_STORE_URL, get_aws_client('s3')),
+            refresh_margin=timedelta(hours=float(os.environ.get('EDL_TOKEN_REFRESH_HOURS', 24))),
+            wait_seconds=float(os.environ.get('EDL_TOKEN_WAIT_SECONDS', 5))
+        )
+    return EDL_TOKEN_CACHE
+
+
 def get_cmr_user_token(edl_user: str, edl_pass: str, cmr_env: str) -> str:
     """
-    Get a valid user token for the given user
+    Get a valid user token for the given user. The token is kept in memory and in the shared EDL token store (see
+    get_edl_token_cache), so URS is only asked for a token when no worker holds one that is far enough from expiring.
 
     Parameters
     ----------
@@ -97,9 +246,41 @@ def get_cmr_user_token(edl_user: str, edl_pass: str, cmr_env: str) -> str:
       The token that can be used to query CMR
     """
     global EDL_USER_TOKEN  # pylint: disable=W0603
-    if EDL_USER_TOKEN and datetime.now() < EDL_USER_TOKEN['expiration_date']:
+    token_cache = get_edl_token_cache()
+    if EDL_USER_TOKEN and token_cache.is_fresh(EDL_USER_TOKEN):
         return EDL_USER_TOKEN['access_token']
 
+    EDL_USER_TOKEN = token_cache.get(
+        edl_token_cache.token_key(edl_user, cmr_env),
+        lambda fresh_until: request_urs_token(edl_user, edl_pass, cmr_env, fresh_until),
+        deadline=CMR_DEADLINE
+    )
+    return EDL_USER_TOKEN['access_token']
+
+
+def request_urs_token(edl_user: str, edl_pass: str, cmr_env: str, fresh_until: datetime | None = None) -> dict:
+    """
+    Get a user token from URS, reusing an existing token of the user if it is still valid at fresh_until and
+    otherwise creating one (revoking an expired token first if the user already has the maximum of two tokens)
+
+    Parameters
+    ----------
+    edl_user
+      EDL username
+    edl_pass
+      EDL password for user
+    cmr_env
+      CMR/URS environment to generate token in
+    fresh_until
+      time until which an existing token must be valid to be reused, defaults to now
+
+    Returns
+    -------
+    dict
+      The 'access_token' and its 'expiration_date' as a datetime, plus a 'refresh_after' datetime before which
+      no new token can be created when the user already has two valid tokens that are not valid at fresh_until
+    """
+    fresh_until = fresh_until or datetime.now()
     urs_get_tokens_url = f'https://{"uat." if cmr_env == "UAT" else ""}urs.earthdata.nasa.gov/api/users/tokens'
     urs_revoke_token_url = f'https://{"uat." if cmr_env == "UAT" else ""}urs.earthdata.nasa.gov/api/users/revoke_token'
     urs_create_token_url = f'https://{"uat." if cmr_env == "UAT" else ""}urs.earthdata.nasa.gov/api/users/token'
@@ -113,38 +294,320 @@ def get_cmr_user_token(edl_user: str, edl_pass: str, cmr_env: str) -> str:
         get_tokens_response.raise_for_status()
         tokens = get_tokens_response.json()
 
-        # Filter expired tokens
-        tokens = [{
+        # Filter expired tokens, latest expiration first
+        tokens = sorted([{
             "access_token": t["access_token"],
             "expiration_date": datetime.strptime(format_iso_expiration_date(t['expiration_date']), '%m/%d/%Y')
-        } for t in tokens]
+        } for t in tokens], key=lambda t: t['expiration_date'], reverse=True)
         valid_tokens = list(filter(lambda t: datetime.now() < t['expiration_date'], tokens))
         expired_tokens = list(filter(lambda t: datetime.now() >= t['expiration_date'], tokens))
 
-        # If there are no valid tokens and two expired tokens, need to revoke one of the expired tokens
-        if len(valid_tokens) == 0 and len(expired_tokens) == 2:
+        if valid_tokens and fresh_until < valid_tokens[0]['expiration_date']:
+            return valid_tokens[0]
+
+        # If the user has two tokens, one of the expired tokens needs to be revoked before creating a new one
+        if len(tokens) >= 2 and expired_tokens:
             revoke_token_request = session.request('post', urs_revoke_token_url,
                                                    params={'token': next(iter(expired_tokens))['access_token']},
                                                    timeout=10)
             revoke_token_response = session.post(revoke_token_request.url)
             revoke_token_response.raise_for_status()
+        elif len(tokens) >= 2:
+            # Two valid tokens expiring soon; a new one can only be created once the older one has expired, so
+            # keep using the newer one until then instead of asking URS again on every call
+            return {**valid_tokens[0], 'refresh_after': valid_tokens[-1]['expiration_date']}
 
-        # If there are no valid tokens, need to create one
-        if len(valid_tokens) == 0:
-            create_token_request = session.request('post', urs_create_token_url, timeout=10)
-            create_token_response = session.post(create_token_request.url)
-            create_token_response.raise_for_status()
-            new_token = create_token_response.json()
-            new_token["expiration_date"] = datetime.strptime(new_token['expiration_date'], '%m/%d/%Y')
-            valid_tokens.insert(0, new_token)
+        create_token_request = session.request('post', urs_create_token_url, timeout=10)
+        create_token_response = session.post(create_token_request.url)
+        create_token_response.raise_for_status()
+        new_token = create_token_response.json()
+        new_token["expiration_date"] = datetime.strptime(new_token['expiration_date'], '%m/%d/%Y')
 
-    EDL_USER_TOKEN = next(iter(valid_tokens))
-    return EDL_USER_TOKEN['access_token']
+    return new_token
+
+
+class CMRClient:  # pylint: disable=too-many-instance-attributes
+    """
+    Client for CMR search that keeps its connections open between calls, retries failed calls with jittered
+    exponential backoff instead of failing the Lambda, and keeps the documents it fetched in an LRU cache whose entries
+    expire after a time to live. Settings default to the CMR_MAX_ATTEMPTS (4), CMR_BACKOFF_SECONDS (0.5),
+    CMR_TIMEOUT_SECONDS (10), CMR_CACHE_SIZE (256) and CMR_CACHE_TTL_SECONDS (300) environment variables.
+
+    Parameters
+    ----------
+    cmr_environment
+      CMR environment to query, also used to get the user token
+    max_attempts
+      attempts per call, retrying connection errors, timeouts, 429 and 5xx responses
+    backoff_seconds
+      base of the exponential backoff; the n-th retry waits a random time up to backoff_seconds * 2 ** (n - 1), or
+      the Retry-After of the response (up to 30 seconds)
+    timeout
+      connect and read timeout of a request in seconds
+
+    Retries stop, and the last error is raised, when the next attempt could not finish before the deadline of the
+    Lambda invocation set by set_cmr_deadline, so the invocation fails with the CMR error the state machine retries
+    instead of being killed by its timeout. Attempt timeouts are shortened to fit the deadline as well.
+    cache_size
+      documents kept in the cache, 0 disables the cache
+    cache_ttl_seconds
+      time a cached document is used for
+    """
+    RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+    MIN_ATTEMPT_SECONDS = 1.0
+
+    def __init__(
+            self,
+            cmr_environment: str,
+            max_attempts: int | None = None,
+            backoff_seconds: float | None = None,
+            timeout: float | None = None,
+            cache_size: int | None = None,
+            cache_ttl_seconds: float | None = None
+    ):
+        self.cmr_environment = cmr_environment
+        self.search_url = f'https://cmr.{"uat." if cmr_environment == "UAT" else ""}earthdata.nasa.gov/search'
+        self.max_attempts = max_attempts or int(os.environ.get('CMR_MAX_ATTEMPTS', 4))
+        self.backoff_seconds = float(os.environ.get('CMR_BACKOFF_SECONDS', 0.5)) if backoff_seconds is None else backoff_seconds
+        self.timeout = timeout or float(os.environ.get('CMR_TIMEOUT_SECONDS', 10))
+        self.cache_size = int(os.environ.get('CMR_CACHE_SIZE', 256)) if cache_size is None else cache_size
+        self.cache_ttl_seconds = float(os.environ.get('CMR_CACHE_TTL_SECONDS', 300)) if cache_ttl_seconds is None else cache_ttl_seconds
+        self.session = requests.Session()
+        self.cache: OrderedDict[tuple, tuple[float, Any]] = OrderedDict()
+        self.cache_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_granule_umm_json(self, granule_concept_id: str) -> dict[str, Any]:
+        """
+        Get the UMM-G document of a granule
+
+        Parameters
+        ----------
+        granule_concept_id
+          the concept ID of the granule
+
+        Returns
+        -------
+        dict
+          The umm-json document
+        """
+        return self.get_json(f'concepts/{granule_concept_id}.umm_json')
+
+    def search_collections(self, **params) -> dict[str, Any]:
+        """
+        Search collections, e.g. search_collections(provider=..., short_name=..., version=...)
+
+        Returns
+        -------
+        dict
+          The collections.umm_json search response
+        """
+        return self.get_json('collections.umm_json', params)
+
+    def get_json(self, path: str, params: dict[str, Any] | None = None) -> Any:
+        """
+        GET a JSON document from CMR search, from the cache when it was fetched less than cache_ttl_seconds ago
+
+        Parameters
+        ----------
+        path
+          path relative to the CMR search url
+        params
+          query parameters
+
+        Returns
+        -------
+        Any
+          A copy of the decoded document, which callers may modify
+        """
+        key = (path, tuple(sorted((params or {}).items())))
+        document = self._cached(key)
+        if document is None:
+            document = self._request(path, params).json()
+            self._cache(key, document)
+        return copy.deepcopy(document)
+
+    def get_granules_umm_json(self, granule_concept_ids: Iterable[str], batch_size: int | None = None) -> dict[str, dict[str, Any]]:
+        """
+        Get the UMM-G documents of many granules. Repeated ids are fetched once, cached documents are not fetched again
+        and the others are searched for batch_size ids at a time with concept_id[] in a form-encoded POST body,
+        following CMR-Search-After across pages.
+
+        Parameters
+        ----------
+        granule_concept_ids
+          the concept IDs of the granules
+        batch_size
+          concept IDs per search, defaults to the CMR_BULK_BATCH_SIZE environment variable (100)
+
+        Returns
+        -------
+        dict
+          The umm-json document of each concept ID found in CMR, by concept ID; granules that are not found are left out
+        """
+        batch_size = batch_size or int(os.environ.get('CMR_BULK_BATCH_SIZE', 100))
+        documents = {}
+        missing = []
+        concept_ids = list(dict.fromkeys(granule_concept_ids))
+        for concept_id in concept_ids:
+            document = self._cached(self._granule_key(concept_id))
+            if document is None:
+                missing.append(concept_id)
+            else:
+                documents[concept_id] = copy.deepcopy(document)
+
+        for start in range(0, len(missing), batch_size):
+            batch = missing[start:start + batch_size]
+            search_after = None
+            found = 0
+            while True:
+                response = self._request('granules.umm_json', None,
+                                         {'CMR-Search-After': search_after} if search_after else None,
+                                         data={'concept_id[]': batch, 'page_size': len(batch)})
+                items = response.json().get('items', [])
+                for item in items:
+                    concept_id = item['meta']['concept-id']
+                    self._cache(self._granule_key(concept_id), item['umm'])
+                    documents[concept_id] = copy.deepcopy(item['umm'])
+                found += len(items)
+                # CMR caps the page size, so a batch may span pages, but a page with every hit is the last one
+                search_after = response.headers.get('CMR-Search-After')
+                if not items or not search_after or found >= int(response.headers.get('CMR-Hits', found)):
+                    break
+        CUMULUS_LOGGER.debug('Found {} of {} granules, {} of them cached', len(documents), len(concept_ids),
+                             len(concept_ids) - len(missing))
+        return documents
+
+    def cache_stats(self) -> dict[str, int]:
+        """
+        Cache hits, misses and size
+        """
+        with self.cache_lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self.cache)}
+
+    @staticmethod
+    def _granule_key(granule_concept_id: str) -> tuple[str, tuple]:
+        # The get_json cache key of get_granule_umm_json
+        return f'concepts/{granule_concept_id}.umm_json', ()
+
+    def _cached(self, key: tuple) -> Any:
+        with self.cache_lock:
+            cached = self.cache.get(key)
+            if cached and time.monotonic() - cached[0] < self.cache_ttl_seconds:
+                self.cache.move_to_end(key)
+                self.hits += 1
+                return cached[1]
+            self.misses += 1
+        return None
+
+    def _cache(self, key: tuple, document: Any):
+        if self.cache_size > 0:
+            with self.cache_lock:
+                self.cache[key] = (time.monotonic(), document)
+                self.cache.move_to_end(key)
+                while len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+
+    def _request(self, path: str, params: dict[str, Any] | None, headers: dict[str, str] | None = None,
+                 data: dict[str, Any] | None = None) -> requests.Response:
+        # Searches with form-encoded data are POSTed, so long parameter lists do not hit URL length limits
+        edl_user, edl_pass = get_edl_creds(self.cmr_environment)
+        token = get_cmr_user_token(edl_user, edl_pass, self.cmr_environment)
+        headers = {**(headers or {}), 'Authorization': f'Bearer {token}'}
+        deadline = CMR_DEADLINE
+        attempt = 1
+        while True:
+            response = None
+            error = None
+            timeout = self.timeout
+            if deadline is not None:
+                timeout = min(timeout, max(deadline - time.monotonic(), self.MIN_ATTEMPT_SECONDS))
+            try:
+                if data is None:
+                    response = self.session.get(f'{self.search_url}/{path}', params=params, headers=headers,
+                                                timeout=timeout)
+                else:
+                    response = self.session.post(f'{self.search_url}/{path}', params=params, data=data,
+                                                 headers=headers, timeout=timeout)
+                if response.status_code not in self.RETRY_STATUS_CODES:
+                    response.raise_for_status()
+                    return response
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+
+            delay = random.uniform(0, self.backoff_seconds * 2 ** (attempt - 1))
+            retry_after = response.headers.get('Retry-After') if response is not None else None
+            if retry_after and retry_after.isdigit():
+                delay = min(float(retry_after), 30.0)
+            out_of_time = deadline is not None and time.monotonic() + delay + self.MIN_ATTEMPT_SECONDS > deadline
+            if attempt == self.max_attempts or out_of_time:
+                if out_of_time:
+                    CUMULUS_LOGGER.warning('No time left to retry CMR request {} before the Lambda times out', path)
+                if error is not None:
+                    raise error
+                response.raise_for_status()
+
+            CUMULUS_LOGGER.warning('CMR request {} failed with {} (attempt {} of {}), retrying in {:.2f}s', path,
+                                   repr(error) if error is not None else f'HTTP {response.status_code}', attempt,
+                                   self.max_attempts, delay)
+            time.sleep(delay)
+            attempt += 1
+
+
+def set_cmr_deadline(context):
+    """
+    Make CMR requests of this Lambda invocation give up retrying in time to fail with the CMR error before the
+    invocation times out, leaving CMR_DEADLINE_MARGIN_SECONDS (default 2) to report the error
+
+    Parameters
+    ----------
+    context
+      Lambda context of the invocation, None (e.g. when run locally) for no deadline
+    """
+    global CMR_DEADLINE  # pylint: disable=W0603
+    if context is None or not hasattr(context, 'get_remaining_time_in_millis'):
+        CMR_DEADLINE = None
+        return
+    margin = float(os.environ.get('CMR_DEADLINE_MARGIN_SECONDS', 2))
+    CMR_DEADLINE = time.monotonic() + context.get_remaining_time_in_millis() / 1000 - margin
+
+
+def get_cmr_client(cmr_environment: str) -> CMRClient:
+    """
+    Get the CMRClient of a CMR environment, created once per environment and kept for the life of the process so warm
+    Lambda invocations reuse its connections and cache
+
+    Parameters
+    ----------
+    cmr_environment
+      CMR environment to query
+
+    Returns
+    -------
+    CMRClient
+    """
+    client = CMR_CLIENTS.get(cmr_environment)
+    if client is None:
+        with CMR_CLIENTS_LOCK:
+            client = CMR_CLIENTS.get(cmr_environment)
+            if client is None:
+                client = CMRClient(cmr_environment)
+                CMR_CLIENTS[cmr_environment] = client
+    return client
+
+
+def clear_cmr_clients():
+    """
+    Forget the clients created by get_cmr_client, along with their caches
+    """
+    with CMR_CLIENTS_LOCK:
+        CMR_CLIENTS.clear()
 
 
 def get_umm_json(granule_concept_id: str, cmr_environment: str) -> dict[str, Any]:
     """
-    Get the granuleUR for the given concept ID
+    Get the UMM-G document of the given concept ID
 
     Parameters
     ----------
@@ -159,16 +622,27 @@ def get_umm_json(granule_concept_id: str, cmr_environment: str) -> dict[str, Any
     dict
       The umm-json document
     """
+    return get_cmr_client(cmr_environment).get_granule_umm_json(granule_concept_id)
+
+
+def get_umm_json_bulk(granule_concept_ids: Iterable[str], cmr_environment: str) -> dict[str, dict[str, Any]]:
+    """
+    Get the UMM-G documents of many concept IDs with batched CMR searches, see CMRClient.get_granules_umm_json
 
-    edl_user, edl_pass = get_edl_creds()
-    token = get_cmr_user_token(edl_user, edl_pass, cmr_environment)
+    Parameters
+    ----------
+    granule_concept_ids
+      the concept IDs of the granules to find, may repeat
 
-    cmr_link = f'https://cmr.{"uat." if cmr_environment == "UAT" else ""}earthdata.nasa.gov/search/concepts/{granule_concept_id}.umm_json'
-    umm_json_response = requests.get(cmr_link, headers={'Authorization': f'Bearer {token}'}, timeout=10)
-    umm_json_response.raise_for_status()
-    umm_json = umm_json_response.json()
+    cmr_environment: str
+      CMR environment used to retrieve user token
 
-    return umm_json
+    Returns
+    -------
+    dict
+      The umm-json document of each concept ID found in CMR, by concept ID
+    """
+    return get_cmr_client(cmr_environment).get_granules_umm_json(granule_concept_ids)
 
 
 def sha512sum(filepath: pathlib.Path):
@@ -183,12 +657,27 @@ def sha512sum(filepath: pathlib.Path):
     -------
       SHA512 hash of file contents
     """
+    with open(filepath, 'rb', buffering=0) as file:
+        return sha512sum_fileobj(file)
+
+
+def sha512sum_fileobj(file: BinaryIO):
+    """
+    Generate a SHA512 hash for the contents of a binary file-like object that supports readinto
+
+    Parameters
+    ----------
+    file
+      file-like object positioned at the start of the content to hash
+    Returns
+    -------
+      SHA512 hash of file contents
+    """
     hash512 = hashlib.sha512()
     barray = bytearray(128 * 1024)
     mem_view = memoryview(barray)
-    with open(filepath, 'rb', buffering=0) as file:
-        for each in iter(lambda: file.readinto(mem_view), 0):
-            hash512.update(mem_view[:each])
+    for each in iter(lambda: file.readinto(mem_view), 0):
+        hash512.update(mem_view[:each])
     return hash512.hexdigest()
 
 
@@ -211,7 +700,7 @@ def upload_string_as_object(bucket_name: str, key_name: str, object_content: str
     -------
     S3 URI of new object
     """
-    s3_client = boto3.client('s3')
+    s3_client = get_aws_client('s3')
     s3_client.put_object(
         Body=object_content.encode(),
         Bucket=bucket_name,
@@ -225,11 +714,12 @@ def upload_object(
         bucket: str,
         key: str,
         content_type: str,
+        s3_client=None
 ) -> str:
     """
-    Uploads a bytestring to S3, returns S3 URI
+    Uploads a bytestring to S3, returns S3 URI. A boto3 S3 client may be passed to share it between uploads.
     """
-    s3_client = boto3.client('s3')
+    s3_client = s3_client or get_aws_client('s3')
     s3_client.put_object(
         Bucket=bucket,
         Key=key,
@@ -239,7 +729,8 @@ def upload_object(
     return f's3://{bucket}/{key}'
 
 
-def upload_to_s3(filepath: pathlib.Path, bucket_name: str, object_key: str):
+def upload_to_s3(filepath: pathlib.Path, bucket_name: str, object_key: str,
+                 metadata: dict[str, str] | None = None):
     """
     Uploads a file to S3
 
@@ -251,14 +742,45 @@ def upload_to_s3(filepath: pathlib.Path, bucket_name: str, object_key: str):
       destination bucket name
     object_key
       object key name in bucket
+    metadata
+      optional user-defined metadata to store with the object
+
+    Returns
+    -------
+    str
+      s3 uri of new object
+    """
+    s3_client = get_aws_client('s3')
+    s3_client.upload_file(str(filepath), bucket_name, object_key,
+                          ExtraArgs={'Metadata': metadata} if metadata else None)
+
+    return f's3://{bucket_name}/{object_key}'
+
+
+def upload_fileobj_to_s3(file: BinaryIO, bucket_name: str, object_key: str,
+                         metadata: dict[str, str] | None = None) -> str:
+    """
+    Uploads the contents of a binary file-like object to S3 without first writing it to disk
+
+    Parameters
+    ----------
+    file
+      readable binary file-like object
+    bucket_name
+      destination bucket name
+    object_key
+      object key name in bucket
+    metadata
+      optional user-defined metadata to store with the object
 
     Returns
     -------
     str
       s3 uri of new object
     """
-    s3_client = boto3.client('s3')
-    s3_client.upload_file(str(filepath), bucket_name, object_key)
+    s3_client = get_aws_client('s3')
+    s3_client.upload_fileobj(file, bucket_name, object_key,
+                             ExtraArgs={'Metadata': metadata} if metadata else None)
 
     return f's3://{bucket_name}/{object_key}'
 
@@ -293,6 +815,87 @@ def checksum_and_upload(filepath: pathlib.Path, bucket_name: str, object_key: st
     return checksum_type, checksum, s3_uri
 
 
+# User-defined metadata keys holding a hex digest written by the producer of an object, in order of preference
+METADATA_CHECKSUM_KEYS = ('sha512', 'sha256', 'md5')
+# S3 additional checksums usable in a CNM, in order of preference
+S3_ADDITIONAL_CHECKSUMS = (('ChecksumSHA256', 'sha256'), ('ChecksumSHA1', 'sha1'))
+
+
+def stored_checksum(head_response: dict[str, Any]) -> tuple[str, str] | None:
+    """
+    Find a trustworthy checksum of the full content of an S3 object in the response of a HeadObject request (made with
+    ChecksumMode='ENABLED'), without reading the object.
+
+    The checksums considered, in order, are a hex digest stored in the user-defined metadata by the producer of the
+    object, a full-object S3 additional checksum (SHA256 or SHA1), and the ETag. The ETag is only the MD5 of the
+    content for objects uploaded in a single part without SSE-KMS or SSE-C encryption.
+
+    Parameters
+    ----------
+    head_response
+      response of s3_client.head_object
+
+    Returns
+    -------
+    (str, str) or None
+      checksum type (md5, sha1, sha256 or sha512) and hex digest, or None if no trustworthy checksum is stored
+    """
+    metadata = {name.lower(): value for name, value in head_response.get('Metadata', {}).items()}
+    for checksum_type in METADATA_CHECKSUM_KEYS:
+        value = metadata.get(checksum_type, '').lower()
+        if re.fullmatch(r'[0-9a-f]+', value) and len(value) == hashlib.new(checksum_type).digest_size * 2:
+            return checksum_type, value
+
+    for field, checksum_type in S3_ADDITIONAL_CHECKSUMS:
+        value = head_response.get(field, '')
+        # Checksums of multipart uploads are checksums of the part checksums, suffixed with the number of parts
+        if value and '-' not in value and head_response.get('ChecksumType', 'FULL_OBJECT') == 'FULL_OBJECT':
+            try:
+                return checksum_type, base64.b64decode(value, validate=True).hex()
+            except binascii.Error:
+                pass
+
+    etag = head_response.get('ETag', '').strip('"')
+    if (re.fullmatch(r'[0-9a-f]{32}', etag) and head_response.get('ServerSideEncryption') in (None, 'AES256')
+            and 'SSECustomerAlgorithm' not in head_response):
+        return 'md5', etag
+
+    return None
+
+
+def s3_object_checksum(bucket_name: str, object_key: str, s3_client=None) -> tuple[str, str]:
+    """
+    Get a checksum of an S3 object, from its stored checksums when a trustworthy one exists (see stored_checksum) and
+    otherwise by streaming the object through MD5
+
+    Parameters
+    ----------
+    bucket_name: str
+      S3 bucket name
+    object_key: str
+      S3 object key
+    s3_client
+      optional boto3 S3 client to use
+
+    Returns
+    -------
+    checksum_type: str
+      The name of the checksum algorithm used (md5, sha1, sha256 or sha512)
+    checksum: str
+      The checksum value as a hex digest
+    """
+    s3_client = s3_client or get_aws_client('s3')
+    checksum = stored_checksum(s3_client.head_object(Bucket=bucket_name, Key=object_key, ChecksumMode='ENABLED'))
+    if checksum:
+        return checksum
+
+    response = s3_client.get_object(Bucket=bucket_name, Key=object_key)
+    md5_hash = hashlib.new('md5')
+    for chunk in response['Body'].iter_chunks(chunk_size=100 * 1024 * 1024):  # 100 MB chunk size
+        md5_hash.update(chunk)
+    return 'md5', md5_hash.hexdigest()
+
+
 def get_harmony_client(environment_str: str) -> Client:
     """
     Return a harmony client configured for the given environment.
@@ -320,16 +923,21 @@ def get_harmony_client(environment_str: str) -> Client:
 
     global HARMONY_CLIENT  # pylint: disable=W0603
 
-    # If we already have a client, but it's for a different environment, replace it with one configured for new environment.
-    if HARMONY_CLIENT and HARMONY_CLIENT.config.environment != harmony_environ:
+    global HARMONY_CLIENT_AUTH  # pylint: disable=W0603
+    auth = get_edl_creds(environment_str)
+
+    # If we already have a client, but it's for a different environment or the credentials were rotated, replace it
+    # with one configured for the new environment and credentials.
+    if HARMONY_CLIENT and (HARMONY_CLIENT.config.environment != harmony_environ or HARMONY_CLIENT_AUTH != auth):
         HARMONY_CLIENT = None
 
     if not HARMONY_CLIENT:
         HARMONY_CLIENT = Client(
             env=harmony_environ,
-            auth=get_edl_creds(),
+            auth=auth,
             should_validate_auth=HARMONY_SHOULD_VALIDATE_AUTH
         )
+        HARMONY_CLIENT_AUTH = auth
 
     return HARMONY_CLIENT
 
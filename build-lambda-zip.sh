@@ -8,6 +8,10 @@ mkdir -p dist/lambda-package
 #cp -r $(poetry env list --full-path | awk '{print $1}')/lib/python*/site-packages/* dist/lambda-package/
 cp -r ./bignbit dist/lambda-package/
 touch dist/lambda-package/bignbit/__init__.py
+# Build the sqlite MGRS/GIBS intersection index read by apply_opera_hls_treatment from the packaged pickle
+if [ -f bignbit/data/mgrs_gibs_intersection.json.pickle ]; then
+  PYTHONPATH=. python scripts/build_mgrs_gibs_index.py --output dist/lambda-package/bignbit/data/mgrs_gibs_intersection.sqlite
+fi
 # zip does not exist on the Jenkins build container so comment this out and use the zipFile jenkins step directly
 #pushd dist/lambda-package
 #zip -r ../pobit-lambda.zip .
@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+"""
+Convert the IMPACT derived mgrs_gibs_intersection.json.pickle (or the original mgrs_gibs_intersection.json) into the
+compact sqlite index read by bignbit.mgrs_gibs_index.
+
+Usage:
+    python build_mgrs_gibs_index.py [--source PATH] [--output PATH]
+"""
+import argparse
+import json
+import pathlib
+import pickle
+
+from bignbit.mgrs_gibs_index import build_index
+
+DATA_DIR = pathlib.Path(__file__).resolve().parent.parent.joinpath('bignbit', 'data')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the MGRS/GIBS intersection sqlite index.")
+    parser.add_argument('--source', type=pathlib.Path, default=DATA_DIR.joinpath('mgrs_gibs_intersection.json.pickle'),
+                        help="Intersection table as a .pickle or .json file")
+    parser.add_argument('--output', type=pathlib.Path, default=DATA_DIR.joinpath('mgrs_gibs_intersection.sqlite'),
+                        help="sqlite index to create")
+    args = parser.parse_args()
+
+    if args.source.suffix == '.json':
+        with open(args.source, encoding='utf-8') as fp:
+            intersection = json.load(fp)
+    else:
+        with open(args.source, 'rb') as fp:
+            intersection = pickle.load(fp)
+
+    build_index(intersection, args.output)
+    print(f'Wrote {len(intersection)} MGRS tiles to {args.output} ({args.output.stat().st_size} bytes)')
+
+
+if __name__ == '__main__':
+    main()
@@ -15,8 +15,12 @@ locals {
   handle_big_result_function_name = substr("${local.aws_resources_name}-handle_big_result", 0, 64)
   get_harmony_job_status_function_name = substr("${local.aws_resources_name}-get_harmony_job_status", 0, 64)
   apply_opera_hls_treatment_function_name = substr("${local.aws_resources_name}-apply_opera_hls_treatment", 0, 64)
+  apply_opera_hls_treatment_batch_function_name = substr("${local.aws_resources_name}-apply_opera_hls_treatment_batch", 0, 64)
   send_to_gitc_function_name = substr("${local.aws_resources_name}-send_to_gitc", 0, 64)
   handle_gitc_response_function_name = substr("${local.aws_resources_name}-handle_gitc_response", 0, 64)
+
+  # EDL user tokens shared by the lambdas that query CMR, see bignbit/edl_token_cache.py
+  edl_token_store = "s3://${local.staging_bucket_name}/bignbit_edl_tokens"
 }
 
 
@@ -119,11 +123,14 @@ resource "aws_lambda_function" "get_granule_umm_json" {
 
   environment {
     variables = {
-      STACK_NAME                  = var.prefix
-      EDL_USER_SSM                = var.edl_user_ssm
-      EDL_PASS_SSM                = var.edl_pass_ssm
-      CUMULUS_MESSAGE_ADAPTER_DIR = "/opt/"
-      REGION                      = data.aws_region.current.name
+      STACK_NAME                      = var.prefix
+      EDL_USER_SSM                    = var.edl_user_ssm
+      EDL_PASS_SSM                    = var.edl_pass_ssm
+      CUMULUS_MESSAGE_ADAPTER_DIR     = "/opt/"
+      EDL_TOKEN_STORE                 = local.edl_token_store
+      PAYLOAD_OFFLOAD_BUCKET          = local.staging_bucket_name
+      PAYLOAD_OFFLOAD_THRESHOLD_BYTES = var.payload_offload_threshold_bytes
+      REGION                          = data.aws_region.current.name
     }
   }
 
@@ -155,6 +162,7 @@ resource "aws_lambda_function" "get_collection_concept_id" {
       STACK_NAME                  = var.prefix
       EDL_USER_SSM                = var.edl_user_ssm
       EDL_PASS_SSM                = var.edl_pass_ssm
+      EDL_TOKEN_STORE             = local.edl_token_store
       CUMULUS_MESSAGE_ADAPTER_DIR = "/opt/"
       REGION                      = data.aws_region.current.name
     }
@@ -249,11 +257,13 @@ resource "aws_lambda_function" "handle_big_result" {
 
   environment {
     variables = {
-      STACK_NAME                  = var.prefix
-      CUMULUS_MESSAGE_ADAPTER_DIR = "/opt/"
-      REGION                      = data.aws_region.current.name
-      EDL_USER_SSM                = var.edl_user_ssm
-      EDL_PASS_SSM                = var.edl_pass_ssm
+      STACK_NAME                      = var.prefix
+      CUMULUS_MESSAGE_ADAPTER_DIR     = "/opt/"
+      PAYLOAD_OFFLOAD_BUCKET          = local.staging_bucket_name
+      PAYLOAD_OFFLOAD_THRESHOLD_BYTES = var.payload_offload_threshold_bytes
+      REGION                          = data.aws_region.current.name
+      EDL_USER_SSM                    = var.edl_user_ssm
+      EDL_PASS_SSM                    = var.edl_pass_ssm
     }
   }
 
@@ -282,11 +292,13 @@ resource "aws_lambda_function" "get_harmony_job_status" {
 
   environment {
     variables = {
-      STACK_NAME                  = var.prefix
-      CUMULUS_MESSAGE_ADAPTER_DIR = "/opt/"
-      REGION                      = data.aws_region.current.name
-      EDL_USER_SSM                = var.edl_user_ssm
-      EDL_PASS_SSM                = var.edl_pass_ssm
+      STACK_NAME                      = var.prefix
+      CUMULUS_MESSAGE_ADAPTER_DIR     = "/opt/"
+      REGION                          = data.aws_region.current.name
+      EDL_USER_SSM                    = var.edl_user_ssm
+      EDL_PASS_SSM                    = var.edl_pass_ssm
+      PAYLOAD_OFFLOAD_BUCKET          = local.staging_bucket_name
+      PAYLOAD_OFFLOAD_THRESHOLD_BYTES = var.payload_offload_threshold_bytes
     }
   }
 
@@ -313,6 +325,41 @@ resource "aws_lambda_function" "apply_opera_hls_treatment" {
   timeout       = 30
   memory_size   = 512
 
+  environment {
+    variables = {
+      STACK_NAME                      = var.prefix
+      CUMULUS_MESSAGE_ADAPTER_DIR     = "/opt/"
+      PAYLOAD_OFFLOAD_BUCKET          = local.staging_bucket_name
+      PAYLOAD_OFFLOAD_THRESHOLD_BYTES = var.payload_offload_threshold_bytes
+      REGION                          = data.aws_region.current.name
+      EDL_USER_SSM                    = var.edl_user_ssm
+      EDL_PASS_SSM                    = var.edl_pass_ssm
+    }
+  }
+
+  vpc_config {
+    subnet_ids         = var.subnet_ids
+    security_group_ids = var.security_group_ids
+  }
+
+}
+
+
+resource "aws_lambda_function" "apply_opera_hls_treatment_batch" {
+  depends_on = [
+    null_resource.upload_ecr_image
+  ]
+
+  package_type = "Image"
+  image_uri    = "${aws_ecr_repository.lambda-image-repo.repository_url}:${local.ecr_image_tag}"
+  image_config {
+    command = ["bignbit.apply_opera_hls_treatment.batch_lambda_handler"]
+  }
+  function_name = local.apply_opera_hls_treatment_batch_function_name
+  role          = aws_iam_role.bignbit_lambda_role.arn
+  timeout       = 900
+  memory_size   = 2048
+
   environment {
     variables = {
       STACK_NAME                  = var.prefix
@@ -390,6 +437,7 @@ resource "aws_lambda_function" "handle_gitc_response" {
       CMR_ENVIRONMENT             = local.cmr_environment
       EDL_USER_SSM                = var.edl_user_ssm
       EDL_PASS_SSM                = var.edl_pass_ssm
+      EDL_TOKEN_STORE             = local.edl_token_store
     }
   }
 
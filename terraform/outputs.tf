@@ -62,6 +62,10 @@ output "apply_opera_hls_treatment_arn"{
   value = aws_lambda_function.apply_opera_hls_treatment.arn
 }
 
+output "apply_opera_hls_treatment_batch_arn"{
+  value = aws_lambda_function.apply_opera_hls_treatment_batch.arn
+}
+
 output "pobit_send_to_gitc_arn" {
   value = aws_lambda_function.send_to_gitc.arn
 }
@@ -62,6 +62,17 @@ resource "aws_s3_bucket_lifecycle_configuration" "expire_objects_30_days" {
       prefix = "opera_hls_processing/"
     }
   }
+
+  rule {
+    id     = "ExpireOffloadedPayloadsAfter30Days"
+    status = "Enabled"
+    expiration {
+      days = 30
+    }
+    filter {
+      prefix = "bignbit_payloads/"
+    }
+  }
 }
 
 resource "aws_s3_bucket_policy" "bignbit_staging_bucket_policy" {
@@ -135,3 +135,9 @@ variable "harmony_job_status_max_delay_seconds" {
     description = "Maximum delay in seconds for Harmony job status checks"
     default = 20
 }
+
+variable "payload_offload_threshold_bytes" {
+    type = number
+    description = "Size in bytes from which large sections of the workflow payload (granule UMM-G, OPERA HLS file lists) are stored in the staging bucket under bignbit_payloads/ and replaced by a reference. 0 disables offloading"
+    default = 0
+}
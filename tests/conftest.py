@@ -1,5 +1,7 @@
 import pytest
 
+import bignbit.utils
+
 
 @pytest.fixture(scope="session")
 def vcr_config():
@@ -7,4 +9,14 @@ def vcr_config():
         "filter_headers": ["authorization"],
         "decode_compressed_response": True,
         "record_mode": "once"
-    }
\ No newline at end of file
+    }
+
+
+@pytest.fixture(autouse=True)
+def clear_aws_clients():
+    """Do not let AWS and CMR clients cached by bignbit.utils outlive the mocks of a test"""
+    bignbit.utils.clear_aws_clients()
+    bignbit.utils.clear_cmr_clients()
+    yield
+    bignbit.utils.clear_aws_clients()
+    bignbit.utils.clear_cmr_clients()
@@ -0,0 +1,90 @@
+import hashlib
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Tuple
+
+
+class S3StandIn:
+    """
+    Minimal path-style S3 endpoint served over plain HTTP so that non-boto3 clients (e.g. GDAL /vsis3/) can be tested
+    locally. Supports GET (including Range requests), HEAD and PUT of whole objects; request signatures are ignored.
+    """
+
+    def __init__(self):
+        self.objects: Dict[str, bytes] = {}
+        self.requests: List[Tuple[str, str]] = []
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def endpoint(self) -> str:
+        host, port = self._server.server_address
+        return f'{host}:{port}'
+
+    def put(self, bucket: str, key: str, body: bytes):
+        self.objects[f'/{bucket}/{key}'] = body
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _handler(self):
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):  # pylint: disable=arguments-differ
+                pass
+
+            def _object(self):
+                path = self.path.split('?')[0]
+                stand_in.requests.append((self.command, path))
+                return path, stand_in.objects.get(path)
+
+            def _send_headers(self, status, body, length):
+                self.send_response(status)
+                self.send_header('Content-Length', str(length))
+                self.send_header('ETag', f'"{hashlib.md5(body).hexdigest()}"')
+                self.send_header('Accept-Ranges', 'bytes')
+                self.end_headers()
+
+            def do_HEAD(self):  # pylint: disable=invalid-name
+                _, body = self._object()
+                if body is None:
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                self._send_headers(200, body, len(body))
+
+            def do_GET(self):  # pylint: disable=invalid-name
+                _, body = self._object()
+                if body is None:
+                    self.send_response(404)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                byte_range = re.match(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+                if byte_range:
+                    start = int(byte_range.group(1))
+                    end = int(byte_range.group(2)) if byte_range.group(2) else len(body) - 1
+                    chunk = body[start:end + 1]
+                    self.send_response(206)
+                    self.send_header('Content-Range', f'bytes {start}-{start + len(chunk) - 1}/{len(body)}')
+                    self.send_header('Content-Length', str(len(chunk)))
+                    self.send_header('ETag', f'"{hashlib.md5(body).hexdigest()}"')
+                    self.end_headers()
+                    self.wfile.write(chunk)
+                    return
+                self._send_headers(200, body, len(body))
+                self.wfile.write(body)
+
+            def do_PUT(self):  # pylint: disable=invalid-name
+                path, _ = self._object()
+                stand_in.objects[path] = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                self._send_headers(200, stand_in.objects[path], 0)
+
+        return Handler
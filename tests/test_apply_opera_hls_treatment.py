@@ -1,11 +1,29 @@
 import json
 import pathlib
+import threading
 import urllib.request
 from os.path import dirname, realpath
+from unittest.mock import patch
 
+import boto3
 import pytest
+from moto import mock_s3
+from osgeo import gdal
 
-from bignbit.apply_opera_hls_treatment import the_opera_hls_treatment
+from mock_s3_server import S3StandIn
+
+from bignbit.apply_opera_hls_treatment import (
+    _find_sub_tiles,
+    _run_sub_tile_jobs,
+    create_file_metadata,
+    gdal_config_options,
+    get_source_image,
+    process_granules,
+    the_opera_hls_treatment,
+    transform_images,
+    TreatmentOptions,
+    upload_transformed_images
+)
 
 
 @pytest.fixture()
@@ -22,3 +40,448 @@ def test_the_opera_hls_treatment(tmp_path):
     result = the_opera_hls_treatment(test_data_input, tmp_path, 'T48SUE')
 
     assert result
+
+
+@pytest.mark.parametrize('executor', ['thread', 'process'])
+def test_the_opera_hls_treatment_parallel_matches_serial(tmp_path, executor):
+    test_data_input = pathlib.Path(dirname(realpath(__file__))).joinpath('data').joinpath(
+        'OPERA_L3_DSWx-HLS_T48SUE_20190302T034350Z_20230131T222341Z_L8_30_v0.0_BROWSE.tiff')
+    options = TreatmentOptions(max_workers=4, executor=executor, gdal_cachemax_mb=64, gdal_num_threads=2)
+
+    serial = the_opera_hls_treatment(test_data_input, tmp_path.joinpath('serial'), 'T48SUE')
+    parallel = the_opera_hls_treatment(test_data_input, tmp_path.joinpath('parallel'), 'T48SUE', options)
+
+    assert [p.relative_to(tmp_path.joinpath('parallel')) for p in parallel] == \
+           [s.relative_to(tmp_path.joinpath('serial')) for s in serial]
+    for serial_image, parallel_image in zip(serial, parallel):
+        assert (gdal.Open(str(serial_image)).ReadAsArray() == gdal.Open(str(parallel_image)).ReadAsArray()).all()
+
+
+def test_treatment_options_from_dataset_config():
+    options = TreatmentOptions.from_dataset_config({
+        'operaHLSTreatment': True,
+        'operaHLSTreatmentOptions': {'maxWorkers': 6, 'gdalCacheMaxMB': '128', 'gdalNumThreads': 'ALL_CPUS'}
+    })
+
+    assert options == TreatmentOptions(max_workers=6, executor='thread', gdal_cachemax_mb=128,
+                                       gdal_num_threads='ALL_CPUS')
+    assert TreatmentOptions.from_dataset_config({}) == TreatmentOptions()
+    assert not TreatmentOptions().record_resource_usage
+    assert TreatmentOptions.from_dataset_config({
+        'operaHLSTreatmentOptions': {'recordResourceUsage': True}}).record_resource_usage
+    with pytest.raises(ValueError):
+        TreatmentOptions.from_dataset_config({'operaHLSTreatmentOptions': {'executor': 'fork'}})
+
+
+@pytest.mark.parametrize('max_workers', [1, 3])
+def test_the_opera_hls_treatment_shared_warped_vrt(tmp_path, max_workers):
+    test_data_input = pathlib.Path(dirname(realpath(__file__))).joinpath('data').joinpath(
+        'OPERA_L3_DSWx-HLS_T48SUE_20190302T034350Z_20230131T222341Z_L8_30_v0.0_BROWSE.tiff')
+    options = TreatmentOptions(max_workers=max_workers, shared_warped_vrt=True)
+
+    warped = the_opera_hls_treatment(test_data_input, tmp_path.joinpath('warp'), 'T48SUE')
+    cut = the_opera_hls_treatment(test_data_input, tmp_path.joinpath('vrt'), 'T48SUE', options)
+
+    assert [c.name for c in cut] == [w.name for w in warped]
+    for warped_image, cut_image in zip(warped, cut):
+        warped_ds, cut_ds = gdal.Open(str(warped_image)), gdal.Open(str(cut_image))
+        assert cut_ds.GetGeoTransform() == pytest.approx(warped_ds.GetGeoTransform())
+        assert (warped_ds.ReadAsArray() == cut_ds.ReadAsArray()).all()
+
+
+@pytest.fixture()
+def s3_server(monkeypatch):
+    """Local S3 stand-in that GDAL can reach over HTTP"""
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+    with S3StandIn() as server:
+        with gdal_config_options({'AWS_S3_ENDPOINT': server.endpoint, 'AWS_HTTPS': 'NO',
+                                  'AWS_VIRTUAL_HOSTING': 'FALSE'}):
+            yield server
+
+
+def test_get_source_image_streams_from_s3(tmp_path, s3_server):
+    test_data_input = pathlib.Path(dirname(realpath(__file__))).joinpath('data').joinpath(
+        'OPERA_L3_DSWx-HLS_T48SUE_20190302T034350Z_20230131T222341Z_L8_30_v0.0_BROWSE.tiff')
+    s3_server.put('opera-source', f'granule/{test_data_input.name}', test_data_input.read_bytes())
+    options = TreatmentOptions(stream_source=True)
+
+    source = get_source_image('opera-source', f'granule/{test_data_input.name}',
+                              tmp_path.joinpath('granule', test_data_input.name), options)
+
+    assert str(source) == f'/vsis3/opera-source/granule/{test_data_input.name}'
+    assert not tmp_path.joinpath('granule', test_data_input.name).exists()
+    assert ('GET', f'/opera-source/granule/{test_data_input.name}') in s3_server.requests
+    with gdal_config_options(options.vsi_config_options()):
+        streamed = the_opera_hls_treatment(source, tmp_path.joinpath('streamed'), 'T48SUE', options)
+    local = the_opera_hls_treatment(test_data_input, tmp_path.joinpath('local'), 'T48SUE')
+    assert [s.name for s in streamed] == [loc.name for loc in local]
+    for streamed_image, local_image in zip(streamed, local):
+        assert (gdal.Open(str(streamed_image)).ReadAsArray() == gdal.Open(str(local_image)).ReadAsArray()).all()
+
+
+@mock_s3
+def test_get_source_image_falls_back_to_download(tmp_path):
+    test_data_input = pathlib.Path(dirname(realpath(__file__))).joinpath('data').joinpath(
+        'OPERA_L3_DSWx-HLS_T48SUE_20190302T034350Z_20230131T222341Z_L8_30_v0.0_BROWSE.tiff')
+    s3_client = boto3.client('s3', region_name='us-east-1')
+    s3_client.create_bucket(Bucket='opera-source')
+    s3_client.upload_file(str(test_data_input), 'opera-source', test_data_input.name)
+
+    # Nothing is listening on this endpoint so GDAL cannot stream the object
+    with gdal_config_options({'AWS_S3_ENDPOINT': '127.0.0.1:9', 'AWS_HTTPS': 'NO', 'AWS_VIRTUAL_HOSTING': 'FALSE',
+                              'GDAL_HTTP_MAX_RETRY': '0'}):
+        source = get_source_image('opera-source', test_data_input.name, tmp_path.joinpath(test_data_input.name),
+                                  TreatmentOptions(stream_source=True))
+
+    assert source == tmp_path.joinpath(test_data_input.name)
+    assert source.read_bytes() == test_data_input.read_bytes()
+
+
+@mock_s3
+def test_in_memory_output(tmp_path):
+    test_data_input = pathlib.Path(dirname(realpath(__file__))).joinpath('data').joinpath(
+        'OPERA_L3_DSWx-HLS_T48SUE_20190302T034350Z_20230131T222341Z_L8_30_v0.0_BROWSE.tiff')
+    s3_client = boto3.client('s3', region_name='us-east-1')
+    s3_client.create_bucket(Bucket='staging')
+
+    on_disk = the_opera_hls_treatment(test_data_input, tmp_path.joinpath('disk'), 'T48SUE')
+    in_memory = the_opera_hls_treatment(test_data_input, tmp_path.joinpath('memory'), 'T48SUE',
+                                        TreatmentOptions(in_memory_output=True))
+
+    assert all(str(image).startswith('/vsimem/') for image in in_memory)
+    assert not tmp_path.joinpath('memory').exists()
+    assert [m.name for m in in_memory] == [d.name for d in on_disk]
+
+    disk_metadata = create_file_metadata(on_disk, 'staging')
+    memory_metadata = create_file_metadata(in_memory, 'staging')
+    assert [m['checksum'] for m in memory_metadata] == [d['checksum'] for d in disk_metadata]
+
+    upload_transformed_images(memory_metadata)
+    for disk_image, file_metadata in zip(on_disk, memory_metadata):
+        uploaded = s3_client.get_object(Bucket='staging', Key=file_metadata['key'])['Body'].read()
+        assert uploaded == disk_image.read_bytes()
+        assert gdal.VSIStatL(file_metadata['local_filepath']) is None
+
+
+def test_failed_upload_releases_in_memory_images(tmp_path):
+    in_memory_dirpath = f'/vsimem{tmp_path.resolve()}/memory'
+    file_metadatas = []
+    for number in range(3):
+        local_filepath = f'{in_memory_dirpath}/{number}/sub_tile_{number}.tif'
+        gdal.FileFromMemBuffer(local_filepath, b'sub-tile')
+        file_metadatas.append({'local_filepath': local_filepath, 'bucket': 'staging', 'key': f'sub_tile_{number}.tif',
+                               'checksum': 'abc'})
+
+    with patch('bignbit.utils.upload_fileobj_to_s3', side_effect=['s3://staging/sub_tile_0.tif', OSError('failed')]), \
+            pytest.raises(OSError):
+        upload_transformed_images(file_metadatas)
+
+    assert not gdal.ReadDirRecursive(in_memory_dirpath)
+
+
+def test_process_granules_releases_in_memory_images_of_failed_granules(tmp_path):
+    def failing_transform_images(cma_file_list, temp_dir, *args, **kwargs):
+        gdal.FileFromMemBuffer(f'/vsimem{temp_dir.resolve()}/image/000001/sub_tile.tif', b'sub-tile')
+        raise OSError('failed')
+
+    with patch('bignbit.apply_opera_hls_treatment.transform_images', side_effect=failing_transform_images):
+        results = process_granules([{'granuleId': 'granule', 'mgrs_grid_code': 'T48SUE', 'big': []}], tmp_path,
+                                   'staging', TreatmentOptions(in_memory_output=True))
+
+    assert [f['granuleId'] for f in results['failures']] == ['granule']
+    assert not gdal.ReadDirRecursive(f'/vsimem{tmp_path.resolve()}')
+
+
+def test_in_memory_output_rejects_process_executor():
+    with pytest.raises(ValueError):
+        TreatmentOptions(in_memory_output=True, executor='process')
+
+
+@mock_s3
+@pytest.mark.parametrize('in_memory_output', [False, True])
+def test_transform_images_pipelined_matches_serial(tmp_path, in_memory_output):
+    test_data_input = pathlib.Path(dirname(realpath(__file__))).joinpath('data').joinpath(
+        'OPERA_L3_DSWx-HLS_T48SUE_20190302T034350Z_20230131T222341Z_L8_30_v0.0_BROWSE.tiff')
+    s3_client = boto3.client('s3', region_name='us-east-1')
+    s3_client.create_bucket(Bucket='source')
+    s3_client.create_bucket(Bucket='staging')
+    cma_file_list = []
+    for version in ('v0.0', 'v0.1', 'v0.2'):
+        key = f'granule/{test_data_input.name.replace("v0.0", version)}'
+        s3_client.upload_file(str(test_data_input), 'source', key)
+        cma_file_list.append({'fileName': key.split('/')[-1], 'bucket': 'source', 'key': key})
+
+    serial = transform_images(cma_file_list, tmp_path.joinpath('serial'), 'T48SUE', 'staging')
+    pipelined = transform_images(cma_file_list, tmp_path.joinpath('pipelined'), 'T48SUE', 'staging',
+                                 TreatmentOptions(pipeline=True, pipeline_queue_size=2, pipeline_upload_workers=3,
+                                                  max_workers=2, in_memory_output=in_memory_output))
+
+    assert [p['fileName'] for p in pipelined] == [s['fileName'] for s in serial]
+    assert [p['key'] for p in pipelined] == [s['key'] for s in serial]
+    assert [p['checksum'] for p in pipelined] == [s['checksum'] for s in serial]
+    for file_metadata in pipelined:
+        s3_client.head_object(Bucket='staging', Key=file_metadata['key'])
+
+
+@pytest.mark.parametrize('shared_warped_vrt', [False, True])
+def test_skip_empty_sub_tiles(tmp_path, shared_warped_vrt):
+    test_data_input = pathlib.Path(dirname(realpath(__file__))).joinpath('data').joinpath(
+        'OPERA_L3_DSWx-HLS_T48SUE_20190302T034350Z_20230131T222341Z_L8_30_v0.0_BROWSE.tiff')
+    skipped = []
+
+    everything = the_opera_hls_treatment(test_data_input, tmp_path.joinpath('all'), 'T48SUE')
+    kept = the_opera_hls_treatment(test_data_input, tmp_path.joinpath('kept'), 'T48SUE',
+                                   TreatmentOptions(skip_empty_sub_tiles=True, shared_warped_vrt=shared_warped_vrt),
+                                   skipped_sub_tiles=skipped)
+
+    assert sorted([k.name for k in kept] + [s['fileName'] for s in skipped]) == sorted(e.name for e in everything)
+    kept_names = {k.name for k in kept}
+    for image in everything:
+        has_data = gdal.Open(str(image)).GetRasterBand(1).GetMaskBand().ReadAsArray().any()
+        assert has_data == (image.name in kept_names)
+
+
+@mock_s3
+def test_transform_images_reuses_outputs(tmp_path, monkeypatch):
+    test_data_input = pathlib.Path(dirname(realpath(__file__))).joinpath('data').joinpath(
+        'OPERA_L3_DSWx-HLS_T48SUE_20190302T034350Z_20230131T222341Z_L8_30_v0.0_BROWSE.tiff')
+    s3_client = boto3.client('s3', region_name='us-east-1')
+    s3_client.create_bucket(Bucket='source')
+    s3_client.create_bucket(Bucket='staging')
+    key = f'granule/{test_data_input.name}'
+    s3_client.upload_file(str(test_data_input), 'source', key)
+    cma_file_list = [{'fileName': test_data_input.name, 'bucket': 'source', 'key': key}]
+    options = TreatmentOptions(reuse_outputs=True, skip_empty_sub_tiles=True)
+
+    first_skipped = []
+    first = transform_images(cma_file_list, tmp_path.joinpath('first'), 'T48SUE', 'staging', options, first_skipped)
+
+    def fail(*args, **kwargs):
+        raise AssertionError('source image should not be processed again')
+
+    monkeypatch.setattr('bignbit.apply_opera_hls_treatment.get_source_image', fail)
+    second_skipped = []
+    second = transform_images(cma_file_list, tmp_path.joinpath('second'), 'T48SUE', 'staging', options, second_skipped)
+
+    assert [{k: v for k, v in f.items() if k != 'local_filepath'} for f in first] == second
+    assert first_skipped
+    assert first_skipped == second_skipped
+
+    # Without skipping, the sub-tiles recorded as empty have to be produced, so nothing is reused
+    monkeypatch.undo()
+    everything = transform_images(cma_file_list, tmp_path.joinpath('third'), 'T48SUE', 'staging',
+                                  TreatmentOptions(reuse_outputs=True))
+    assert len(everything) == len(first) + len(first_skipped)
+
+
+def test_output_parameters_separate_skipping_runs():
+    assert TreatmentOptions().output_parameters() != TreatmentOptions(skip_empty_sub_tiles=True).output_parameters()
+    assert (TreatmentOptions(skip_empty_sub_tiles=True).output_parameters()
+            != TreatmentOptions(skip_empty_sub_tiles=True, footprint_size=256).output_parameters())
+    assert TreatmentOptions().output_parameters() == TreatmentOptions(footprint_size=256).output_parameters()
+
+
+@pytest.mark.parametrize('profile', ['zstd', 'cog'])
+def test_the_opera_hls_treatment_encoding_profile(tmp_path, profile):
+    test_data_input = pathlib.Path(dirname(realpath(__file__))).joinpath('data').joinpath(
+        'OPERA_L3_DSWx-HLS_T48SUE_20190302T034350Z_20230131T222341Z_L8_30_v0.0_BROWSE.tiff')
+    options = TreatmentOptions.from_dataset_config({'operaHLSTreatmentOptions': {'outputEncoding': profile}})
+
+    default = the_opera_hls_treatment(test_data_input, tmp_path.joinpath('default'), 'T48SUE')
+    encoded = the_opera_hls_treatment(test_data_input, tmp_path.joinpath(profile), 'T48SUE', options)
+
+    assert [e.name for e in encoded] == [d.name for d in default]
+    for default_image, encoded_image in zip(default, encoded):
+        encoded_dataset = gdal.Open(str(encoded_image))
+        assert (gdal.Open(str(default_image)).ReadAsArray() == encoded_dataset.ReadAsArray()).all()
+        assert encoded_dataset.GetMetadataItem('COMPRESSION', 'IMAGE_STRUCTURE') in ('ZSTD', 'DEFLATE')
+
+
+def test_computed_sub_tiles_match_intersection_table():
+    test_data_input = pathlib.Path(dirname(realpath(__file__))).joinpath('data').joinpath(
+        'OPERA_L3_DSWx-HLS_T48SUE_20190302T034350Z_20230131T222341Z_L8_30_v0.0_BROWSE.tiff')
+
+    computed = _find_sub_tiles('T48SUE', test_data_input, 'computed')
+    from_table = _find_sub_tiles('T48SUE', test_data_input, 'table')
+
+    assert sorted(s['GID'] for s in computed) == sorted(s['GID'] for s in from_table)
+    for sub_tile in from_table:
+        computed_sub_tile = next(s for s in computed if s['GID'] == sub_tile['GID'])
+        assert computed_sub_tile == pytest.approx(sub_tile)
+
+
+def test_index_map_engine_matches_gdal_warp(tmp_path):
+    test_data_input = pathlib.Path(dirname(realpath(__file__))).joinpath('data').joinpath(
+        'OPERA_L3_DSWx-HLS_T48SUE_20190302T034350Z_20230131T222341Z_L8_30_v0.0_BROWSE.tiff')
+    options = TreatmentOptions(resampling_engine='index_map', index_map_dir=str(tmp_path.joinpath('index_maps')))
+
+    warped = the_opera_hls_treatment(test_data_input, tmp_path.joinpath('warped'), 'T48SUE')
+    first = the_opera_hls_treatment(test_data_input, tmp_path.joinpath('first'), 'T48SUE', options)
+    index_maps = sorted(tmp_path.joinpath('index_maps').iterdir())
+    second = the_opera_hls_treatment(test_data_input, tmp_path.joinpath('second'), 'T48SUE', options)
+
+    assert len(index_maps) == len(warped)
+    assert sorted(tmp_path.joinpath('index_maps').iterdir()) == index_maps
+    for warped_image, first_image, second_image in zip(warped, first, second):
+        expected = gdal.Open(str(warped_image))
+        for gathered in (gdal.Open(str(first_image)), gdal.Open(str(second_image))):
+            assert gathered.GetGeoTransform() == expected.GetGeoTransform()
+            assert (gathered.ReadAsArray() == expected.ReadAsArray()).all()
+            assert gathered.GetRasterBand(1).GetNoDataValue() == expected.GetRasterBand(1).GetNoDataValue()
+
+
+@pytest.mark.parametrize('warp_options', [{'warpMemoryMB': 32}, {'warpOptimizeSize': True}])
+def test_index_map_engine_rejects_warp_chunking_options(warp_options):
+    with pytest.raises(ValueError):
+        TreatmentOptions.from_dataset_config({'operaHLSTreatmentOptions': {'resamplingEngine': 'index_map',
+                                                                           **warp_options}})
+
+
+def test_warp_kwargs():
+    options = TreatmentOptions.from_dataset_config({'operaHLSTreatmentOptions': {
+        'gdalNumThreads': 2, 'warpMemoryMB': '32', 'warpOptimizeSize': True}})
+
+    assert TreatmentOptions().warp_kwargs() == {}
+    assert options.warp_kwargs() == {'multithread': True, 'warpOptions': ['NUM_THREADS=2', 'OPTIMIZE_SIZE=TRUE'],
+                                     'warpMemoryLimit': 32 * 1024 * 1024}
+
+
+@mock_s3
+def test_transform_images_reports_resource_usage(tmp_path):
+    test_data_input = pathlib.Path(dirname(realpath(__file__))).joinpath('data').joinpath(
+        'OPERA_L3_DSWx-HLS_T48SUE_20190302T034350Z_20230131T222341Z_L8_30_v0.0_BROWSE.tiff')
+    s3_client = boto3.client('s3', region_name='us-east-1')
+    s3_client.create_bucket(Bucket='source')
+    s3_client.create_bucket(Bucket='staging')
+    key = f'granule/{test_data_input.name}'
+    s3_client.upload_file(str(test_data_input), 'source', key)
+    resource_usage = {}
+
+    with patch('bignbit.apply_opera_hls_treatment.ResourceMonitor', side_effect=AssertionError) as monitor:
+        assert transform_images([{'fileName': test_data_input.name, 'bucket': 'source', 'key': key}],
+                                tmp_path.joinpath('default'), 'T48SUE', 'staging', TreatmentOptions(),
+                                resource_usage=resource_usage)
+    monitor.assert_not_called()
+    assert not resource_usage
+
+    bounded = transform_images([{'fileName': test_data_input.name, 'bucket': 'source', 'key': key}],
+                               tmp_path.joinpath('bounded'), 'T48SUE', 'staging',
+                               TreatmentOptions(warp_memory_mb=4, warp_optimize_size=True, gdal_cachemax_mb=8,
+                                                record_resource_usage=True),
+                               resource_usage=resource_usage)
+
+    assert bounded
+    assert resource_usage['peak_rss_bytes'] > 0
+    assert resource_usage['peak_tmp_bytes'] > 0
+    assert resource_usage['peak_gdal_cache_bytes'] <= resource_usage['gdal_cache_max_bytes']
+
+
+@mock_s3
+def test_process_granules_reports_failures_per_granule(tmp_path):
+    test_data_input = pathlib.Path(dirname(realpath(__file__))).joinpath('data').joinpath(
+        'OPERA_L3_DSWx-HLS_T48SUE_20190302T034350Z_20230131T222341Z_L8_30_v0.0_BROWSE.tiff')
+    s3_client = boto3.client('s3', region_name='us-east-1')
+    s3_client.create_bucket(Bucket='source')
+    s3_client.create_bucket(Bucket='staging')
+    granules = []
+    for version in ('v0.0', 'v0.1', 'v0.2'):
+        key = f'granule/{test_data_input.name.replace("v0.0", version)}'
+        if version != 'v0.1':
+            s3_client.upload_file(str(test_data_input), 'source', key)
+        granules.append({'granuleId': version, 'mgrs_grid_code': 'T48SUE',
+                         'big': [{'fileName': key.split('/')[-1], 'bucket': 'source', 'key': key}]})
+
+    results = process_granules(granules, tmp_path, 'staging', granule_workers=2)
+
+    assert [g['granuleId'] for g in results['granules']] == ['v0.0', 'v0.2']
+    assert all(g['big'] for g in results['granules'])
+    assert [f['granuleId'] for f in results['failures']] == ['v0.1']
+    assert results['failures'][0]['errorType']
+    assert not list(tmp_path.iterdir())
+
+
+@pytest.mark.parametrize('max_workers', [1, 3])
+def test_transform_images_sets_gdal_cache_for_the_whole_treatment(tmp_path, max_workers):
+    """gdalCacheMaxMB sizes the block cache, also below the process default and when sub-tiles are warped serially"""
+    cachemax_before = gdal.GetCacheMax()
+    gdal.SetCacheMax(64 * 1024 * 1024)
+    observed = []
+
+    def fake_transform_image(cma_file_meta, *args):
+        observed.append(gdal.GetCacheMax())
+        return [cma_file_meta]
+
+    try:
+        with patch('bignbit.apply_opera_hls_treatment._transform_image', side_effect=fake_transform_image):
+            transform_images([{'fileName': 'a.tif'}, {'fileName': 'b.tif'}], tmp_path, 'T48SUE', 'staging',
+                             TreatmentOptions(max_workers=max_workers, gdal_cachemax_mb=8))
+
+        assert observed == [8 * 1024 * 1024 * max_workers] * 2
+        assert gdal.GetCacheMax() == 64 * 1024 * 1024
+    finally:
+        gdal.SetCacheMax(cachemax_before)
+
+
+@pytest.mark.parametrize('executor, cachemax_mb', [('thread', 4 * 4 * 2), ('process', 4 * 2)])
+def test_process_granules_sets_gdal_cache_for_the_batch(tmp_path, executor, cachemax_mb):
+    """The batch sets the block cache once for either executor, also below the process default"""
+    cachemax_before = gdal.GetCacheMax()
+    gdal.SetCacheMax(64 * 1024 * 1024)
+    observed = []
+
+    def fake_transform_images(cma_file_list, *args, set_gdal_cache):
+        observed.append((set_gdal_cache, gdal.GetCacheMax()))
+        return cma_file_list
+
+    granules = [{'granuleId': str(number), 'mgrs_grid_code': 'T48SUE', 'big': []} for number in range(3)]
+    try:
+        with patch('bignbit.apply_opera_hls_treatment.transform_images', side_effect=fake_transform_images):
+            process_granules(granules, tmp_path, 'staging',
+                             TreatmentOptions(max_workers=4, executor=executor, gdal_cachemax_mb=4), granule_workers=2)
+
+        assert observed == [(False, cachemax_mb * 1024 * 1024)] * 3
+        assert gdal.GetCacheMax() == 64 * 1024 * 1024
+    finally:
+        gdal.SetCacheMax(cachemax_before)
+
+
+def test_process_granules_keeps_gdal_settings_while_granules_overlap(tmp_path):
+    """A granule finishing must not reset the GDAL settings of a granule still being treated"""
+    options = TreatmentOptions(max_workers=4, gdal_cachemax_mb=16, stream_source=True, vsi_cache_size_mb=32)
+    short_granule_done = threading.Event()
+    observed = []
+    cachemax_before = gdal.GetCacheMax()
+    gdal.SetCacheMax(8 * 1024 * 1024)
+    vsi_cache_size_before = gdal.GetConfigOption('VSI_CACHE_SIZE')
+
+    def fake_transform_images(cma_file_list, temp_dir, mgrs_grid_code, staging_bucket, options, skipped_sub_tiles,
+                              resource_usage, set_gdal_cache):
+        # The batch sized the block cache, so the granules must leave it alone
+        assert not set_gdal_cache
+
+        def warp(sub_tile):
+            if len(cma_file_list) > 2:
+                assert short_granule_done.wait(timeout=10)
+                observed.append((gdal.GetConfigOption('VSI_CACHE_SIZE'), gdal.GetCacheMax()))
+            return sub_tile
+
+        with gdal_config_options(options.vsi_config_options()):
+            _run_sub_tile_jobs(warp, [(f['fileName'],) for f in cma_file_list], options)
+        if len(cma_file_list) == 2:
+            short_granule_done.set()
+        return cma_file_list
+
+    granules = [{'granuleId': granule_id, 'mgrs_grid_code': 'T48SUE',
+                 'big': [{'fileName': f'{granule_id}_{number}.tif'} for number in range(files)]}
+                for granule_id, files in (('long', 4), ('short', 2))]
+    try:
+        with patch('bignbit.apply_opera_hls_treatment.transform_images', side_effect=fake_transform_images):
+            results = process_granules(granules, tmp_path, 'staging', options, granule_workers=2)
+
+        assert not results['failures']
+        assert observed == [(str(32 * 1024 * 1024), 16 * 1024 * 1024 * 4 * 2)] * 4
+        assert gdal.GetCacheMax() == 8 * 1024 * 1024
+        assert gdal.GetConfigOption('VSI_CACHE_SIZE') == vsi_cache_size_before
+    finally:
+        gdal.SetCacheMax(cachemax_before)
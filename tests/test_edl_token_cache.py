@@ -0,0 +1,248 @@
+"""Unit tests for edl_token_cache module"""
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from unittest.mock import MagicMock, patch
+
+import boto3
+import botocore.exceptions
+import pytest
+from moto import mock_s3
+
+import bignbit.utils
+from bignbit.edl_token_cache import FileTokenStore, S3TokenStore, TokenCache, token_key, token_store_from_url
+
+
+class CountingFetch:
+    """Token fetch that counts its calls and returns tokens expiring after expires_in"""
+
+    def __init__(self, expires_in=timedelta(days=30), delay=0.0):
+        self.expires_in = expires_in
+        self.delay = delay
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, fresh_until):
+        with self.lock:
+            self.calls += 1
+            number = self.calls
+        time.sleep(self.delay)
+        return {'access_token': f'token-{number}', 'expiration_date': datetime.now() + self.expires_in}
+
+
+def test_file_token_store_round_trip(tmp_path):
+    """Test tokens written to a FileTokenStore are read back with their expiration date"""
+    store = FileTokenStore(tmp_path / 'tokens')
+    token = {'access_token': 'abc', 'expiration_date': datetime(2030, 1, 2)}
+
+    assert store.read('key') is None
+    store.write('key', token)
+
+    assert store.read('key') == token
+    assert (tmp_path / 'tokens' / 'key.json').stat().st_mode & 0o777 == 0o600
+    assert not list((tmp_path / 'tokens').glob('*.partial'))
+
+
+def test_file_token_store_lock_is_exclusive(tmp_path):
+    """Test only one holder at a time takes the refresh lock of a key"""
+    store = FileTokenStore(tmp_path)
+    with store.lock('key') as first:
+        with store.lock('key') as second, store.lock('other') as other:
+            assert first and not second and other
+    with store.lock('key') as again:
+        assert again
+
+
+def test_token_cache_fetches_once_for_concurrent_workers(tmp_path):
+    """Test workers without a stored token wait for a single fetch instead of all calling URS"""
+    cache = TokenCache(FileTokenStore(tmp_path), poll_seconds=0.01)
+    fetch = CountingFetch(delay=0.2)
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        tokens = list(executor.map(lambda _: cache.get('key', fetch), range(8)))
+
+    assert fetch.calls == 1
+    assert {token['access_token'] for token in tokens} == {'token-1'}
+
+
+def test_token_cache_returns_fresh_stored_token(tmp_path):
+    """Test a stored token far from expiring is used without fetching"""
+    store = FileTokenStore(tmp_path)
+    store.write('key', {'access_token': 'stored', 'expiration_date': datetime.now() + timedelta(days=10)})
+    fetch = CountingFetch()
+
+    assert TokenCache(store).get('key', fetch)['access_token'] == 'stored'
+    assert fetch.calls == 0
+
+
+def test_token_cache_refreshes_token_within_margin(tmp_path):
+    """Test a token about to expire is replaced before it expires, asking for one valid beyond the margin"""
+    store = FileTokenStore(tmp_path)
+    store.write('key', {'access_token': 'stored', 'expiration_date': datetime.now() + timedelta(hours=2)})
+    fresh_untils = []
+
+    def fetch(fresh_until):
+        fresh_untils.append(fresh_until)
+        return {'access_token': 'refreshed', 'expiration_date': datetime.now() + timedelta(days=30)}
+
+    token = TokenCache(store, refresh_margin=timedelta(days=1)).get('key', fetch)
+
+    assert token['access_token'] == 'refreshed'
+    assert store.read('key')['access_token'] == 'refreshed'
+    assert fresh_untils[0] > datetime.now() + timedelta(hours=23)
+
+
+def test_token_cache_uses_valid_token_while_another_worker_refreshes(tmp_path):
+    """Test workers that do not get the refresh lock keep using a token that has not expired yet"""
+    store = FileTokenStore(tmp_path)
+    store.write('key', {'access_token': 'stored', 'expiration_date': datetime.now() + timedelta(hours=2)})
+    fetch = CountingFetch()
+
+    with store.lock('key'):
+        token = TokenCache(store).get('key', fetch)
+
+    assert token['access_token'] == 'stored'
+    assert fetch.calls == 0
+
+
+def test_token_cache_fetches_after_waiting_for_a_stuck_worker(tmp_path):
+    """Test a worker fetches a token itself when the lock holder does not store one in time"""
+    store = FileTokenStore(tmp_path)
+    fetch = CountingFetch()
+
+    with store.lock('key'):
+        token = TokenCache(store, wait_seconds=0.05, poll_seconds=0.01).get('key', fetch)
+
+    assert token['access_token'] == 'token-1'
+    assert store.read('key')['access_token'] == 'token-1'
+
+
+def test_token_cache_wait_ends_before_deadline(tmp_path):
+    """Test a waiting worker keeps time to fetch a token itself before the deadline of the invocation"""
+    store = FileTokenStore(tmp_path)
+    fetch = CountingFetch()
+
+    with store.lock('key'):
+        started = time.monotonic()
+        token = TokenCache(store, wait_seconds=30, poll_seconds=0.01, fetch_seconds=5).get(
+            'key', fetch, deadline=time.monotonic() + 5.1)
+
+    assert token['access_token'] == 'token-1'
+    assert time.monotonic() - started < 1
+
+
+@mock_s3
+def test_s3_token_store():
+    """Test tokens and lease locks stored in S3"""
+    s3_client = boto3.client('s3', region_name='us-east-1')
+    s3_client.create_bucket(Bucket='token-bucket')
+    store = token_store_from_url('s3://token-bucket/cache/tokens', s3_client)
+    token = {'access_token': 'abc', 'expiration_date': datetime(2030, 1, 2)}
+
+    assert isinstance(store, S3TokenStore)
+    assert store.read('key') is None
+    store.write('key', token)
+    assert store.read('key') == token
+    assert s3_client.head_object(Bucket='token-bucket', Key='cache/tokens/key.json')['ServerSideEncryption'] == 'AES256'
+
+    conditions = []
+    s3_client.meta.events.register('before-send.s3.PutObject', lambda request, **_: conditions.append(
+        (request.headers.get('If-None-Match'), request.headers.get('If-Match'))))
+    with store.lock('key') as first:
+        with store.lock('key') as second:
+            assert first and not second
+    with store.lock('key') as again:
+        assert again
+    assert conditions == [(b'*', None), (b'*', None)]
+
+    s3_client.put_object(Bucket='token-bucket', Key='cache/tokens/key.lock',
+                         Body=json.dumps({'owner': 'crashed', 'acquired': time.time() - 120}).encode())
+    etag = s3_client.head_object(Bucket='token-bucket', Key='cache/tokens/key.lock')['ETag']
+    with store.lock('key') as expired:
+        assert expired
+    assert conditions[-1] == (None, etag.encode())
+
+
+@mock_s3
+def test_s3_token_store_lock_taken_by_another_worker():
+    """Test a lease another worker created first is reported as not acquired"""
+    s3_client = boto3.client('s3', region_name='us-east-1')
+    s3_client.create_bucket(Bucket='token-bucket')
+    store = S3TokenStore(s3_client, 'token-bucket')
+    precondition_failed = botocore.exceptions.ClientError(
+        {'Error': {'Code': 'PreconditionFailed'}, 'ResponseMetadata': {'HTTPStatusCode': 412}}, 'PutObject')
+
+    with patch.object(s3_client, 'put_object', side_effect=precondition_failed), store.lock('key') as acquired:
+        assert not acquired
+    with patch.object(s3_client, 'put_object', side_effect=botocore.exceptions.ClientError(
+            {'Error': {'Code': 'AccessDenied'}}, 'PutObject')), pytest.raises(botocore.exceptions.ClientError):
+        with store.lock('key'):
+            pass
+
+
+def test_token_store_from_url(tmp_path):
+    """Test the store of an EDL_TOKEN_STORE url"""
+    assert token_store_from_url(f'file://{tmp_path}').directory == tmp_path
+    with pytest.raises(ValueError):
+        token_store_from_url('redis://host/0')
+
+
+def test_token_key_separates_users_and_environments():
+    """Test tokens of different users and environments are stored under different keys"""
+    assert token_key('user', 'UAT') == token_key('user', 'uat')
+    assert len({token_key('user', 'UAT'), token_key('user', 'OPS'), token_key('other', 'UAT')}) == 3
+
+
+def test_get_cmr_user_token_uses_shared_store(monkeypatch, tmp_path):
+    """Test get_cmr_user_token reuses a token stored by another Lambda container"""
+    monkeypatch.setenv('EDL_TOKEN_STORE', f'file://{tmp_path}')
+    monkeypatch.setattr(bignbit.utils, 'EDL_TOKEN_CACHE', None)
+    monkeypatch.setattr(bignbit.utils, 'EDL_USER_TOKEN', {})
+    FileTokenStore(tmp_path).write(token_key('user', 'UAT'), {
+        'access_token': 'shared', 'expiration_date': datetime.now() + timedelta(days=10)})
+    monkeypatch.setattr(bignbit.utils, 'request_urs_token', pytest.fail)
+
+    assert bignbit.utils.get_cmr_user_token('user', 'pass', 'UAT') == 'shared'
+    assert bignbit.utils.get_cmr_user_token('user', 'pass', 'UAT') == 'shared'
+
+
+def test_token_cache_keeps_token_until_refresh_after(tmp_path):
+    """Test a token that cannot be refreshed yet is used without the refresh lock until its refresh_after time"""
+    store = FileTokenStore(tmp_path)
+    store.write('key', {'access_token': 'stored', 'expiration_date': datetime.now() + timedelta(hours=2),
+                        'refresh_after': datetime.now() + timedelta(hours=1)})
+    store.lock = pytest.fail
+
+    assert TokenCache(store).get('key', pytest.fail)['access_token'] == 'stored'
+    assert store.read('key')['refresh_after'] < store.read('key')['expiration_date']
+
+
+def test_get_cmr_user_token_with_two_tokens_close_to_expiry(monkeypatch, tmp_path):
+    """Test a user whose two URS tokens both expire within the refresh margin keeps using the newer one until the
+    older one expires, instead of asking URS for a token on every call"""
+    monkeypatch.setenv('EDL_TOKEN_STORE', f'file://{tmp_path}')
+    monkeypatch.setenv('EDL_TOKEN_REFRESH_HOURS', '72')
+    monkeypatch.setattr(bignbit.utils, 'EDL_TOKEN_CACHE', None)
+    monkeypatch.setattr(bignbit.utils, 'EDL_USER_TOKEN', {})
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    session = MagicMock()
+    session.get.return_value.json.return_value = [
+        {'access_token': 'older', 'expiration_date': (today + timedelta(days=2)).strftime('%m/%d/%Y')},
+        {'access_token': 'newer', 'expiration_date': (today + timedelta(days=3)).strftime('%m/%d/%Y')}
+    ]
+    monkeypatch.setattr(bignbit.utils.requests, 'Session', MagicMock(return_value=MagicMock(
+        __enter__=MagicMock(return_value=session))))
+
+    assert bignbit.utils.get_cmr_user_token('user', 'pass', 'UAT') == 'newer'
+    assert bignbit.utils.get_cmr_user_token('user', 'pass', 'UAT') == 'newer'
+    assert session.get.call_count == 1
+    session.post.assert_not_called()
+
+    # Another container reads the token from the store without taking the refresh lock or calling URS
+    monkeypatch.setattr(bignbit.utils, 'EDL_USER_TOKEN', {})
+    monkeypatch.setattr(bignbit.utils.get_edl_token_cache().store, 'lock', pytest.fail)
+    assert bignbit.utils.get_cmr_user_token('user', 'pass', 'UAT') == 'newer'
+    assert session.get.call_count == 1
+    assert FileTokenStore(tmp_path).read(token_key('user', 'UAT'))['refresh_after'] == today + timedelta(days=2)
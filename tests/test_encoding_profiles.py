@@ -0,0 +1,49 @@
+import pytest
+
+from bignbit.encoding_profiles import EncodingProfile, PROFILES
+
+
+def test_default_profile_matches_original_output():
+    assert EncodingProfile.from_config(None) == EncodingProfile()
+    assert EncodingProfile().driver == 'GTiff'
+    assert EncodingProfile().creation_options() == ['COMPRESS=LZW', 'TILED=YES']
+
+
+def test_gtiff_creation_options():
+    profile = EncodingProfile.from_config({'profile': 'zstd', 'level': 9, 'blockSize': 512})
+
+    assert profile.creation_options() == ['COMPRESS=ZSTD', 'TILED=YES', 'ZSTD_LEVEL=9', 'PREDICTOR=2',
+                                          'BLOCKXSIZE=512', 'BLOCKYSIZE=512']
+    assert EncodingProfile.from_config({'profile': 'deflate', 'level': 6}).creation_options() == \
+           ['COMPRESS=DEFLATE', 'TILED=YES', 'ZLEVEL=6', 'PREDICTOR=2']
+
+
+def test_cog_creation_options():
+    profile = EncodingProfile.from_config('COG')
+
+    assert profile.driver == 'COG'
+    assert profile.creation_options() == ['COMPRESS=DEFLATE', 'PREDICTOR=STANDARD', 'OVERVIEWS=AUTO']
+    assert EncodingProfile.from_config({'profile': 'cog-zstd', 'level': 15, 'blockSize': 256}).creation_options() == \
+           ['COMPRESS=ZSTD', 'LEVEL=15', 'PREDICTOR=STANDARD', 'BLOCKSIZE=256', 'OVERVIEWS=AUTO']
+
+
+def test_invalid_profiles():
+    with pytest.raises(ValueError):
+        EncodingProfile.from_config('jpeg')
+    with pytest.raises(ValueError):
+        EncodingProfile(driver='PNG')
+    with pytest.raises(ValueError):
+        EncodingProfile(overviews=True)
+
+
+def test_level_only_for_deflate_and_zstd():
+    with pytest.raises(ValueError):
+        EncodingProfile.from_config({'profile': 'default', 'level': 6})
+    with pytest.raises(ValueError):
+        EncodingProfile(driver='COG', compress='LZW', level=6)
+    assert 'ZLEVEL=6' not in EncodingProfile(compress='ZSTD', level=6).creation_options()
+
+
+def test_profiles_are_valid():
+    for profile in PROFILES.values():
+        assert profile.creation_options()
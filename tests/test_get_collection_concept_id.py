@@ -8,7 +8,7 @@ from bignbit.get_collection_concept_id import get_collection_concept_id
 ], ids=["PREFIRE_SAT2_2B-FLX_COG", "MUR-JPL-L4-GLOB-v4.1"])
 def test_get_collection_concept_id(collection_shortname, collection_version, collection_provider, expected_concept_id, monkeypatch):
 
-    monkeypatch.setattr('bignbit.utils.get_edl_creds', lambda: (None, None))
+    monkeypatch.setattr('bignbit.utils.get_edl_creds', lambda *args: (None, None))
     monkeypatch.setattr('bignbit.utils.get_cmr_user_token', lambda *args: None)
 
     concept_id = get_collection_concept_id(collection_shortname, collection_version, collection_provider, "UAT")
@@ -1,17 +1,19 @@
 """Unit tests for get_harmony_job_status module"""
+import hashlib
+from unittest.mock import MagicMock, patch
+
+import boto3
 import pytest
 from moto import mock_s3
 
-import bignbit.utils
-from bignbit.get_harmony_job_status import check_harmony_job, HarmonyJobNoDataError
+from bignbit.get_harmony_job_status import build_result_manifest, check_harmony_job, HarmonyJobNoDataError
 
 
 @pytest.mark.vcr
 @mock_s3
-def test_process_results_no_data():
+def test_process_results_no_data(monkeypatch):
     """Test that HarmonyJobNoDataError is raised when Harmony returns no data"""
-    bignbit.utils.ED_USER = 'test'
-    bignbit.utils.ED_PASS = 'test'
+    monkeypatch.setattr('bignbit.utils.get_edl_creds', lambda *args: ('test', 'test'))
 
     # Note: This test uses VCR to record the Harmony API response
     # The cassette should show a successful job with no result URLs
@@ -21,4 +23,39 @@ def test_process_results_no_data():
 
     assert 'no data' in str(exc_info.value).lower()
     assert 'test_variable' in str(exc_info.value)
-    assert 'EPSG:4326' in str(exc_info.value)
\ No newline at end of file
+    assert 'EPSG:4326' in str(exc_info.value)
+
+
+@mock_s3
+def test_check_harmony_job_records_result_manifest():
+    """Test a successful job records the URLs, sizes and checksums of its results."""
+    s3_client = boto3.client('s3', region_name='us-east-1')
+    s3_client.create_bucket(Bucket='harmony-staging')
+    urls = []
+    for key, body in (('public/job/granule.png', b'image'), ('public/job/granule.pgw', b'world file')):
+        s3_client.put_object(Bucket='harmony-staging', Key=key, Body=body)
+        urls.append(f's3://harmony-staging/{key}')
+    harmony_client = MagicMock()
+    harmony_client.status.return_value = {'status': 'successful'}
+    harmony_client.result_urls.return_value = iter(urls)
+
+    result_manifest = []
+    with patch('bignbit.utils.get_harmony_client', return_value=harmony_client):
+        status = check_harmony_job('job', 'UAT', 'var', 'EPSG:4326', result_manifest)
+
+    assert status == 'successful'
+    assert result_manifest == [
+        {'url': urls[0], 'size': 5, 'checksumType': 'md5', 'checksum': hashlib.md5(b'image').hexdigest()},
+        {'url': urls[1], 'size': 10, 'checksumType': 'md5', 'checksum': hashlib.md5(b'world file').hexdigest()}
+    ]
+
+
+@mock_s3
+def test_build_result_manifest_without_object_details():
+    """Test results that can not be looked up are recorded with their URL only."""
+    s3_client = boto3.client('s3', region_name='us-east-1')
+    s3_client.create_bucket(Bucket='harmony-staging')
+
+    assert build_result_manifest(['s3://harmony-staging/public/job/missing.png']) == [
+        {'url': 's3://harmony-staging/public/job/missing.png'}
+    ]
@@ -0,0 +1,59 @@
+import pathlib
+import pickle
+
+import pytest
+
+from bignbit import gibs_grid
+
+INTERSECTION_PICKLE = pathlib.Path(__file__).resolve().parent.parent.joinpath(
+    'bignbit', 'data', 'mgrs_gibs_intersection.json.pickle')
+
+
+def test_sub_tile_for_gid():
+    assert gibs_grid.sub_tile_for_gid('318143') == {
+        'GID': '318143', 'minlon': 176.625, 'minlat': 69.75, 'maxlon': 177.75, 'maxlat': 70.875}
+    assert gibs_grid.sub_tile(1, 1)['GID'] == '001001'
+    assert gibs_grid.sub_tile(320, 160)['maxlon'] == 180
+    with pytest.raises(ValueError):
+        gibs_grid.sub_tile_for_gid('321001')
+    with pytest.raises(ValueError):
+        gibs_grid.sub_tile_for_gid('12345')
+
+
+def test_sub_tiles_intersecting():
+    footprint = [(7.2, 56.5), (9.8, 56.4), (9.9, 57.5), (7.3, 57.6)]
+
+    gids = [sub_tile['GID'] for sub_tile in gibs_grid.sub_tiles_intersecting(footprint)]
+
+    assert gids == ['167131', '167132', '168131', '168132', '169131', '169132']
+
+
+def test_sub_tiles_intersecting_skips_cells_outside_a_rotated_footprint():
+    # A diamond touching the centers of the edges of a 2 x 2 block of sub-tiles does not reach the outer corner cells
+    center_lon, center_lat = 9.0, 57.375
+    footprint = [(center_lon - 1.0, center_lat), (center_lon, center_lat - 1.0),
+                 (center_lon + 1.0, center_lat), (center_lon, center_lat + 1.0)]
+
+    gids = [sub_tile['GID'] for sub_tile in gibs_grid.sub_tiles_intersecting(footprint)]
+
+    assert gids == ['168131', '168132', '169131', '169132']
+
+
+def test_sub_tiles_intersecting_antimeridian():
+    footprint = [(177.0, 70.0), (-179.5, 70.0), (-179.5, 70.5), (177.0, 70.5)]
+
+    gids = [sub_tile['GID'] for sub_tile in gibs_grid.sub_tiles_intersecting(footprint)]
+
+    assert gids == ['001143', '318143', '319143', '320143']
+
+
+@pytest.mark.skipif(not INTERSECTION_PICKLE.exists(), reason="MGRS/GIBS intersection table is not available")
+def test_matches_intersection_table():
+    with open(INTERSECTION_PICKLE, 'rb') as fp:
+        intersection = pickle.load(fp)
+
+    for sub_tiles in intersection.values():
+        for sub_tile in sub_tiles:
+            computed = gibs_grid.sub_tile_for_gid(sub_tile['GID'])
+            for bound in ('minlon', 'minlat', 'maxlon', 'maxlat'):
+                assert computed[bound] == pytest.approx(sub_tile[bound], abs=1e-6)
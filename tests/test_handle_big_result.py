@@ -2,27 +2,33 @@
 import hashlib
 import json
 import xml.etree.ElementTree as ET
+from unittest.mock import MagicMock, patch
+from urllib.parse import urlparse
+
 import boto3
 import pytest
 from moto import mock_s3
 
-import bignbit.utils
 from bignbit.handle_big_result import (
     construct_cnm,
     create_metadata_xml,
     generate_metadata,
     get_mdxml_cnm_file_meta,
+    ImageSetUploadError,
+    MetadataXmlTemplate,
+    process_all_harmony_results,
     process_harmony_results,
-    write_cnm_message
+    write_cnm_message,
+    write_image_sets
 )
 from bignbit.image_set import ImageSet
+from bignbit.payload_offload import is_reference, offload_payload
 
 @pytest.mark.vcr
 @mock_s3
-def test_process_harmony_results():
+def test_process_harmony_results(monkeypatch):
     """Test pulling results of a harmony job from s3."""
-    bignbit.utils.ED_USER = 'test'
-    bignbit.utils.ED_PASS = 'test'
+    monkeypatch.setattr('bignbit.utils.get_edl_creds', lambda *args: ('test', 'test'))
     job_id = '3d276f84-56e2-4f0a-acb2-35b9fcaaa317'
 
     # Create mock S3 bucket and populate with test data
@@ -63,16 +69,99 @@ def test_process_harmony_results():
         assert file['variable'] == 'flx'
 
 @pytest.mark.vcr
-def test_process_harmony_results_no_data():
+def test_process_harmony_results_no_data(monkeypatch):
     """Test case where a harmony job returned no data and was passed empty."""
-    bignbit.utils.ED_USER = 'test'
-    bignbit.utils.ED_PASS = 'test'
+    monkeypatch.setattr('bignbit.utils.get_edl_creds', lambda *args: ('test', 'test'))
 
     harmony_job = {}
     cmr_environment = 'UAT'
     file_dicts = process_harmony_results(harmony_job, cmr_environment)
     assert file_dicts == []
 
+@mock_s3
+def test_process_all_harmony_results_keeps_job_order():
+    """Test results of many Harmony jobs processed concurrently come back in job and result order."""
+    s3_client = boto3.client('s3', region_name='us-east-1')
+    s3_client.create_bucket(Bucket='harmony-staging')
+    harmony_jobs = []
+    job_urls = {}
+    for variable in ('var_a', 'var_b', 'var_c'):
+        for crs in ('EPSG:4326', 'EPSG:3413', 'EPSG:3031'):
+            job_id = f'{variable}-{crs}'
+            harmony_jobs.append({'job': job_id, 'variable': variable, 'output_crs': crs})
+            job_urls[job_id] = []
+            for extension in ('png', 'pgw', 'png.aux.xml'):
+                key = f'public/{job_id}/granule.{extension}'
+                s3_client.put_object(Bucket='harmony-staging', Key=key, Body=key.encode())
+                job_urls[job_id].append(f's3://harmony-staging/{key}')
+    harmony_client = MagicMock()
+    harmony_client.result_urls.side_effect = lambda job_id, link_type: iter(job_urls[job_id])
+
+    with patch('bignbit.utils.get_harmony_client', return_value=harmony_client):
+        file_dicts = process_all_harmony_results([None, *harmony_jobs, {}], 'UAT', max_workers=8)
+
+    expected_keys = [urlparse(url).path.lstrip('/') for job in harmony_jobs for url in job_urls[job['job']]]
+    assert [file['key'] for file in file_dicts] == expected_keys
+    for file in file_dicts:
+        assert file['checksum'] == hashlib.md5(file['key'].encode()).hexdigest()
+        assert file['key'].startswith(f"public/{file['variable']}-{file['output_crs']}/")
+
+
+def test_process_all_harmony_results_no_jobs():
+    """Test no Harmony requests are made when every job returned no data."""
+    with patch('bignbit.utils.get_harmony_client') as get_harmony_client:
+        assert not process_all_harmony_results([None, {}], 'UAT', max_workers=4)
+    get_harmony_client.assert_not_called()
+
+
+
+@mock_s3
+def test_process_harmony_results_uses_result_manifest():
+    """Test the result manifest from the status check replaces the Harmony and S3 lookups."""
+    s3_client = boto3.client('s3', region_name='us-east-1')
+    s3_client.create_bucket(Bucket='harmony-staging')
+    s3_client.put_object(Bucket='harmony-staging', Key='public/job/granule.pgw', Body=b'world file')
+    harmony_job = {
+        'job': 'job',
+        'variable': 'flx',
+        'output_crs': 'EPSG:4326',
+        'status': 'successful',
+        'result_manifest': [
+            {'url': 's3://harmony-staging/public/job/granule.png', 'size': 5, 'checksumType': 'sha256',
+             'checksum': 'abc123'},
+            {'url': 's3://harmony-staging/public/job/granule.pgw'}
+        ]
+    }
+
+    with patch('bignbit.utils.get_harmony_client') as get_harmony_client:
+        file_dicts = process_harmony_results(harmony_job, 'UAT')
+
+    get_harmony_client.assert_not_called()
+    assert [(file['key'], file['checksumType'], file['checksum']) for file in file_dicts] == [
+        ('public/job/granule.png', 'sha256', 'abc123'),
+        ('public/job/granule.pgw', 'md5', hashlib.md5(b'world file').hexdigest())
+    ]
+
+
+@mock_s3
+def test_process_harmony_results_loads_offloaded_result_manifest():
+    """Test a result manifest offloaded by get_harmony_job_status is loaded from S3 instead of asking Harmony."""
+    s3_client = boto3.client('s3', region_name='us-east-1')
+    s3_client.create_bucket(Bucket='offload-bucket')
+    result_manifest = [{'url': f's3://harmony-staging/public/job/granule_{n}.png', 'size': 5, 'checksumType': 'md5',
+                        'checksum': f'{n:032x}'} for n in range(20)]
+    harmony_job = offload_payload({'job': 'job', 'variable': 'flx', 'status': 'successful',
+                                   'result_manifest': result_manifest},
+                                  'offload-bucket', threshold_bytes=1024, keys=('result_manifest',))
+
+    with patch('bignbit.utils.get_harmony_client') as get_harmony_client:
+        file_dicts = process_harmony_results(harmony_job, 'UAT')
+
+    get_harmony_client.assert_not_called()
+    assert is_reference(harmony_job['result_manifest'])
+    assert [file['key'] for file in file_dicts] == [f'public/job/granule_{n}.png' for n in range(20)]
+
+
 @mock_s3
 def test_generate_metadata():
     """Test generating image metadata xml end-to-end for a single image set."""
@@ -410,3 +499,79 @@ def test_construct_cnm_crs_suffixes():
         assert cnm['collection'] == f'COLLECTION_var_{expected_suffix}'
 
 
+
+
+def _sub_tile_image_sets(bucket_name, count):
+    """Image sets of OPERA HLS sub-tiles, which share a variable and collection"""
+    return [ImageSet(
+        name=f'OPERA_L3_DSWx-HLS_T48SUE_{gid}_2019061!G1234567890-TESTPROV',
+        image={
+            'fileName': f'OPERA_L3_DSWx-HLS_T48SUE_{gid}.tif',
+            'bucket': bucket_name,
+            'key': f'opera_hls_processing/20190302/OPERA_L3_DSWx-HLS_T48SUE_{gid}.tif',
+            'variable': 'none',
+            'dataday': '2019061'
+        },
+        world_file={}
+    ) for gid in (f'{i:06d}' for i in range(count))]
+
+
+@mock_s3
+def test_write_image_sets():
+    """Test writing the metadata and CNM messages of many image sets concurrently."""
+    s3_client = boto3.client('s3', region_name='us-east-1')
+    s3_client.create_bucket(Bucket='staging-bucket')
+    s3_client.create_bucket(Bucket='audit-bucket')
+    image_sets = _sub_tile_image_sets('staging-bucket', 24)
+
+    cnm_keys = write_image_sets(
+        image_sets, '2019-03-02T03:43:50Z', '2019-03-02T03:43:50Z', '2019-03-02T03:43:50Z', '2019061', False,
+        'T48SUE', 'TESTPROV', 'OPERA_L3_DSWX-HLS_V1', 'OPERA_L3_DSWx-HLS_T48SUE', 'audit-bucket', 'bignbit-cnm-output',
+        max_workers=8)
+
+    assert len(set(cnm_keys)) == len(image_sets)
+    for image_set, cnm_key in zip(image_sets, cnm_keys):
+        cnm = json.loads(s3_client.get_object(Bucket='audit-bucket', Key=cnm_key)['Body'].read())
+        assert cnm['identifier'] == image_set.name
+        xml = s3_client.get_object(Bucket='staging-bucket', Key=image_set.image_metadata['key'])['Body'].read()
+        assert ET.fromstring(xml).find('PartialId').text == 'T48SUE'
+
+
+@mock_s3
+def test_write_image_sets_reports_every_failure():
+    """Test upload failures of several image sets are reported together and do not stop other uploads."""
+    s3_client = boto3.client('s3', region_name='us-east-1')
+    s3_client.create_bucket(Bucket='staging-bucket')
+    s3_client.create_bucket(Bucket='audit-bucket')
+    image_sets = _sub_tile_image_sets('staging-bucket', 4)
+    for failing in (image_sets[1], image_sets[3]):
+        failing.image['bucket'] = 'missing-bucket'
+
+    with pytest.raises(ImageSetUploadError) as error:
+        write_image_sets(
+            image_sets, '2019-03-02T03:43:50Z', '2019-03-02T03:43:50Z', '2019-03-02T03:43:50Z', '2019061', False,
+            'T48SUE', 'TESTPROV', 'OPERA_L3_DSWX-HLS_V1', 'OPERA_L3_DSWx-HLS_T48SUE', 'audit-bucket',
+            'bignbit-cnm-output', max_workers=4)
+
+    assert 'Failed to upload 2 of 4 image sets' in str(error.value)
+    assert image_sets[1].name in str(error.value) and image_sets[3].name in str(error.value)
+    for image_set in (image_sets[0], image_sets[2]):
+        s3_client.head_object(Bucket='staging-bucket', Key=image_set.image_metadata['key'])
+
+
+
+@pytest.mark.parametrize('subdaily, partial_id, begin', [
+    (True, None, '2021-07-21T01:34:13.165Z'),
+    (False, None, '2021-07-21T01:34:13.165Z'),
+    (False, 'T48SUE', '2021-07-21T01:34:13.165Z'),
+    (True, 'ProviderProductionDateTime', 'ProviderProductionDateTime & <odd> values'),
+])
+def test_metadata_xml_template_matches_create_metadata_xml(subdaily, partial_id, begin):
+    """Test documents rendered from a template are byte identical to create_metadata_xml."""
+    mid, end, data_day = '2021-07-21T02:21:51.985Z', '2021-07-21T03:09:30.805Z', '2021202'
+    template = MetadataXmlTemplate(begin, mid, end, data_day, subdaily, partial_id)
+
+    for production_time in ('2025-01-01T00:00:00.000000Z', '2025-01-01T00:00:00.123456Z'):
+        with patch('bignbit.handle_big_result._production_time', return_value=production_time):
+            expected = create_metadata_xml(begin, mid, end, data_day, subdaily, partial_id)
+        assert template.render(production_time) == expected
@@ -0,0 +1,30 @@
+"""Unit tests for handle_gitc_response module"""
+import json
+from unittest.mock import patch
+
+import boto3
+from moto import mock_s3
+
+from bignbit.handle_gitc_response import handler
+
+
+@mock_s3
+def test_handler_looks_up_each_granule_once(monkeypatch):
+    """Test a batch of responses for the same granule makes a single CMR lookup and stores every CNM-R."""
+    monkeypatch.setenv('CMR_ENVIRONMENT', 'UAT')
+    monkeypatch.setenv('BIGNBIT_AUDIT_BUCKET_NAME', 'audit-bucket')
+    monkeypatch.setenv('BIGNBIT_AUDIT_PATH_NAME', 'audit')
+    s3_client = boto3.client('s3', region_name='us-east-1')
+    s3_client.create_bucket(Bucket='audit-bucket')
+    records = [{'body': json.dumps({'identifier': f'image_set_{number}!G1234-POCLOUD', 'collection': 'MUR',
+                                    'submissionTime': f'2025-01-01T00:00:0{number}Z'})} for number in range(10)]
+
+    with patch('bignbit.utils.get_umm_json_bulk', return_value={'G1234-POCLOUD': {'GranuleUR': 'granule'}}) as bulk, \
+            patch('bignbit.utils.get_umm_json') as get_umm_json:
+        assert handler({'Records': records}, None)['statusCode'] == 200
+
+    bulk.assert_called_once_with(['G1234-POCLOUD'] * 10, 'UAT')
+    get_umm_json.assert_not_called()
+    keys = [obj['Key'] for obj in s3_client.list_objects_v2(Bucket='audit-bucket')['Contents']]
+    assert len(keys) == 10
+    assert all(key.startswith('audit/MUR/granule.2025-01-01T00:00:0') for key in keys)
@@ -0,0 +1,74 @@
+import os
+
+import boto3
+import numpy as np
+from moto import mock_s3
+
+from bignbit.index_maps import gather, index_map_key, IndexMap, IndexMapStore
+
+SOURCE_GRID = {'projection': 'EPSG:32648', 'geotransform': [199980.0, 30.0, 0.0, 3700020.0, 0.0, -30.0],
+               'size': [3660, 3660]}
+OUTPUT_GRID = {'srs': 'EPSG:4326', 'bounds': [101.25, 32.625, 102.375, 33.75], 'resolution': 2.74658203125e-4}
+
+
+def test_gather():
+    source = np.arange(12, dtype=np.uint8).reshape(3, 4)
+    indices = np.array([[0, 5, -1], [11, -1, 4]], dtype=np.int32)
+
+    result = gather(source, indices, 255)
+
+    assert result.dtype == np.uint8
+    assert result.tolist() == [[0, 5, 255], [11, 255, 4]]
+
+
+def test_index_map_key():
+    key = index_map_key('T48SUE', '253111', SOURCE_GRID, OUTPUT_GRID)
+
+    assert key.startswith('T48SUE_253111_')
+    assert key == index_map_key('T48SUE', '253111', dict(reversed(SOURCE_GRID.items())), OUTPUT_GRID)
+    assert key != index_map_key('T48SUE', '253111', {**SOURCE_GRID, 'size': [3661, 3660]}, OUTPUT_GRID)
+    assert key != index_map_key('T48SUE', '253112', SOURCE_GRID, OUTPUT_GRID)
+
+
+def test_store_round_trip(tmp_path):
+    store = IndexMapStore(str(tmp_path))
+    index_map = IndexMap(np.array([[1, -1], [2, 3]], dtype=np.int32), (101.25, 0.5, 0.0, 33.75, 0.0, -0.5), 'WKT')
+
+    assert store.get('key') is None
+    store.put('key', index_map)
+    stored = store.get('key')
+
+    assert stored.indices.tolist() == index_map.indices.tolist()
+    assert stored.geotransform == index_map.geotransform
+    assert stored.projection == 'WKT'
+    assert [p.name for p in tmp_path.iterdir()] == ['key.npz']
+
+
+@mock_s3
+def test_store_shares_index_maps_through_s3(tmp_path):
+    boto3.client('s3', region_name='us-east-1').create_bucket(Bucket='staging')
+    index_map = IndexMap(np.array([[1, -1]], dtype=np.int32), (0.0, 1.0, 0.0, 0.0, 0.0, -1.0), 'WKT')
+
+    IndexMapStore(str(tmp_path.joinpath('first')), 'staging').put('key', index_map)
+    stored = IndexMapStore(str(tmp_path.joinpath('second')), 'staging').get('key')
+
+    assert stored.indices.tolist() == [[1, -1]]
+    assert IndexMapStore(str(tmp_path.joinpath('third')), 'staging').get('other') is None
+
+
+def test_store_evicts_least_recently_used_index_maps(tmp_path):
+    index_map = IndexMap(np.arange(4096, dtype=np.int32).reshape(64, 64), (0.0, 1.0, 0.0, 0.0, 0.0, -1.0), 'WKT')
+    IndexMapStore(str(tmp_path)).put('size', index_map)
+    size = tmp_path.joinpath('size.npz').stat().st_size
+    tmp_path.joinpath('size.npz').unlink()
+    store = IndexMapStore(str(tmp_path), max_bytes=2 * size)
+
+    store.put('first', index_map)
+    store.put('second', index_map)
+    os.utime(tmp_path.joinpath('first.npz'), (1, 1))
+    os.utime(tmp_path.joinpath('second.npz'), (2, 2))
+    assert store.get('first') is not None
+    store.put('third', index_map)
+
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['first.npz', 'third.npz']
+    assert store.get('second') is None
@@ -0,0 +1,89 @@
+"""Unit tests for mgrs_gibs_index module"""
+import pickle
+import threading
+from unittest.mock import patch
+
+import pytest
+
+from bignbit.mgrs_gibs_index import MgrsGibsIndex, build_index
+
+INTERSECTION = {
+    '48SUE': [
+        {'GID': '261133', 'minlon': 112.5, 'minlat': 59.625, 'maxlon': 113.625, 'maxlat': 60.75},
+        {'GID': '261132', 'minlon': 112.5, 'minlat': 58.5, 'maxlon': 113.625, 'maxlat': 59.625},
+    ],
+    '32VMJ': [
+        {'GID': '168131', 'minlon': 7.875, 'minlat': 56.25, 'maxlon': 9.0, 'maxlat': 57.375},
+    ]
+}
+
+
+@pytest.fixture()
+def index_filepath(tmp_path):
+    index_filepath = tmp_path.joinpath('mgrs_gibs_intersection.sqlite')
+    build_index(INTERSECTION, index_filepath)
+    return index_filepath
+
+
+def test_lookup_matches_source_table(index_filepath):
+    index = MgrsGibsIndex(index_filepath)
+
+    assert index['48SUE'] == INTERSECTION['48SUE']
+    assert index['32VMJ'] == INTERSECTION['32VMJ']
+    assert sorted(index) == sorted(INTERSECTION)
+    assert len(index) == 2
+
+
+def test_index_is_loaded_lazily(index_filepath):
+    index = MgrsGibsIndex(index_filepath)
+    assert not index.loaded
+
+    index['32VMJ']  # pylint: disable=pointless-statement
+
+    assert index.loaded
+
+
+def test_missing_grid_code_raises_key_error(index_filepath):
+    index = MgrsGibsIndex(index_filepath)
+
+    with pytest.raises(KeyError):
+        index['01ABC']  # pylint: disable=pointless-statement
+    assert '01ABC' not in index
+    assert '48SUE' in index
+
+
+def test_missing_index_raises_file_not_found(tmp_path):
+    index = MgrsGibsIndex(tmp_path.joinpath('missing.sqlite'))
+
+    with pytest.raises(FileNotFoundError):
+        index['48SUE']  # pylint: disable=pointless-statement
+
+
+def test_falls_back_to_pickle(tmp_path):
+    pickle_filepath = tmp_path.joinpath('mgrs_gibs_intersection.json.pickle')
+    with open(pickle_filepath, 'wb') as fp:
+        pickle.dump(INTERSECTION, fp)
+
+    index = MgrsGibsIndex(tmp_path.joinpath('missing.sqlite'), pickle_filepath)
+
+    with patch('bignbit.mgrs_gibs_index.CUMULUS_LOGGER') as logger:
+        assert index['48SUE'] == INTERSECTION['48SUE']
+        assert index['32VMJ'] == INTERSECTION['32VMJ']
+    logger.warning.assert_called_once()
+
+
+def test_concurrent_lookups(index_filepath):
+    index = MgrsGibsIndex(index_filepath)
+    results = []
+
+    def lookup():
+        for _ in range(50):
+            results.append(index['48SUE'] == INTERSECTION['48SUE'])
+
+    threads = [threading.Thread(target=lookup) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(results) == 200 and all(results)
@@ -0,0 +1,69 @@
+import boto3
+import pytest
+from moto import mock_s3
+
+from bignbit.opera_hls_output_cache import cache_key_prefix, CHECKSUM_METADATA_KEY, OutputCache
+
+PARAMETERS = {'resolution': 2.74658203125e-4, 'creationOptions': ['COMPRESS=LZW', 'TILED=YES']}
+SUB_TILES = ['image_T48SUE_001.tiff', 'image_T48SUE_002.tiff']
+
+
+def test_cache_key_prefix_identifies_inputs():
+    prefix = cache_key_prefix('"abc"', 'T48SUE', PARAMETERS)
+
+    assert prefix.startswith('opera_hls_processing/')
+    assert prefix == cache_key_prefix('abc', 'T48SUE', dict(reversed(PARAMETERS.items())))
+    assert prefix != cache_key_prefix('abd', 'T48SUE', PARAMETERS)
+    assert prefix != cache_key_prefix('abc', 'T48SUF', PARAMETERS)
+    assert prefix != cache_key_prefix('abc', 'T48SUE', {**PARAMETERS, 'creationOptions': ['COMPRESS=DEFLATE']})
+
+
+@pytest.fixture()
+def s3_client():
+    with mock_s3():
+        s3_client = boto3.client('s3', region_name='us-east-1')
+        s3_client.create_bucket(Bucket='source')
+        s3_client.create_bucket(Bucket='staging')
+        s3_client.put_object(Bucket='source', Key='granule/image_T48SUE.tiff', Body=b'source image')
+        yield s3_client
+
+
+def test_prefix_follows_source_etag(s3_client):
+    cache = OutputCache('staging', PARAMETERS, s3_client)
+
+    prefix = cache.prefix_for('source', 'granule/image_T48SUE.tiff', 'T48SUE')
+    assert prefix == cache.prefix_for('source', 'granule/image_T48SUE.tiff', 'T48SUE')
+
+    s3_client.put_object(Bucket='source', Key='granule/image_T48SUE.tiff', Body=b'reprocessed source image')
+    assert prefix != cache.prefix_for('source', 'granule/image_T48SUE.tiff', 'T48SUE')
+
+
+def test_lookup(s3_client):
+    cache = OutputCache('staging', PARAMETERS, s3_client)
+    prefix = cache.prefix_for('source', 'granule/image_T48SUE.tiff', 'T48SUE')
+
+    assert cache.lookup(prefix, SUB_TILES) is None
+
+    s3_client.put_object(Bucket='staging', Key=f'{prefix}/{SUB_TILES[0]}', Body=b'sub-tile',
+                         Metadata={CHECKSUM_METADATA_KEY: 'checksum'})
+    assert cache.lookup(prefix, SUB_TILES) is None
+
+    cache.mark_empty(prefix, [{'GID': '002', 'fileName': SUB_TILES[1], 'reason': 'no valid pixels'}])
+    skipped_sub_tiles = []
+    assert cache.lookup(prefix, SUB_TILES, skipped_sub_tiles) == [{
+        'fileName': SUB_TILES[0],
+        'bucket': 'staging',
+        'key': f'{prefix}/{SUB_TILES[0]}',
+        'checksum': 'checksum',
+        'checksumType': 'SHA512'
+    }]
+    assert skipped_sub_tiles == [{'GID': '002', 'fileName': SUB_TILES[1], 'reason': 'no valid pixels'}]
+
+
+def test_lookup_ignores_objects_without_checksum(s3_client):
+    cache = OutputCache('staging', PARAMETERS, s3_client)
+    prefix = cache.prefix_for('source', 'granule/image_T48SUE.tiff', 'T48SUE')
+    for sub_tile in SUB_TILES:
+        s3_client.put_object(Bucket='staging', Key=f'{prefix}/{sub_tile}', Body=b'sub-tile')
+
+    assert cache.lookup(prefix, SUB_TILES) is None
@@ -0,0 +1,90 @@
+"""Unit tests for payload_offload module"""
+import json
+
+import boto3
+from moto import mock_s3
+
+from bignbit.payload_offload import is_reference, offload_payload, OffloadedPayload, resolve
+
+PAYLOAD = {
+    'granules': [{'granuleId': 'granule'}],
+    'datasetConfigurationForBIG': {'config': {'operaHLSTreatment': True}},
+    'granule_umm_json': {'GranuleUR': 'granule', 'AdditionalAttributes': [{'Name': 'MGRS_TILE_ID', 'Values': ['48SUE']}]},
+    'big': [{'fileName': f'granule_{gid:06d}.tif', 'bucket': 'staging', 'key': f'opera/granule_{gid:06d}.tif'}
+            for gid in range(50)]
+}
+
+
+@mock_s3
+def test_offload_payload_round_trip():
+    """Test large sections are replaced by references that resolve to the original sections."""
+    s3_client = boto3.client('s3', region_name='us-east-1')
+    s3_client.create_bucket(Bucket='offload-bucket')
+
+    offloaded = offload_payload(PAYLOAD, 'offload-bucket', threshold_bytes=1024)
+
+    assert is_reference(offloaded['big'])
+    assert offloaded['big']['bytes'] == len(json.dumps(PAYLOAD['big'], separators=(',', ':')))
+    assert offloaded['granule_umm_json'] == PAYLOAD['granule_umm_json']
+    assert offloaded['granules'] == PAYLOAD['granules']
+    assert len(json.dumps(offloaded)) < 1024
+
+    resolved = OffloadedPayload(json.loads(json.dumps(offloaded)))
+    assert resolved['big'] == PAYLOAD['big']
+    assert resolved.get('granule_umm_json') == PAYLOAD['granule_umm_json']
+    assert resolved.get('missing', 'default') == 'default'
+
+
+@mock_s3
+def test_resolve_nested_reference():
+    """Test a section offloaded from a nested dict is loaded by resolve, and other values are returned as they are."""
+    s3_client = boto3.client('s3', region_name='us-east-1')
+    s3_client.create_bucket(Bucket='offload-bucket')
+    harmony_job = {'job': 'job', 'result_manifest': [{'url': f's3://harmony/{n}.png'} for n in range(50)]}
+
+    offloaded = offload_payload(harmony_job, 'offload-bucket', threshold_bytes=1024, keys=('result_manifest',))
+
+    assert offloaded['job'] == 'job'
+    assert is_reference(offloaded['result_manifest'])
+    assert resolve(offloaded['result_manifest']) == harmony_job['result_manifest']
+    assert resolve(harmony_job['result_manifest']) is harmony_job['result_manifest']
+
+
+@mock_s3
+def test_unread_sections_are_passed_on_as_references():
+    """Test sections a task does not read are neither downloaded nor stored again."""
+    s3_client = boto3.client('s3', region_name='us-east-1')
+    s3_client.create_bucket(Bucket='offload-bucket')
+    offloaded = offload_payload(PAYLOAD, 'offload-bucket', threshold_bytes=1024)
+    s3_client.delete_object(Bucket='offload-bucket', Key=offloaded['big']['bignbit_offloaded'].split('/', 3)[3])
+
+    payload = OffloadedPayload(offloaded)
+    payload['pobit'] = []
+
+    assert offload_payload(payload, 'offload-bucket', threshold_bytes=1024)['big'] == offloaded['big']
+
+
+@mock_s3
+def test_offload_payload_stores_modified_sections():
+    """Test a section changed by a task is stored under a new key."""
+    s3_client = boto3.client('s3', region_name='us-east-1')
+    s3_client.create_bucket(Bucket='offload-bucket')
+    offloaded = offload_payload(PAYLOAD, 'offload-bucket', threshold_bytes=1024)
+
+    payload = OffloadedPayload(offloaded)
+    payload['big'] = payload['big'][:40]
+    reoffloaded = offload_payload(payload, 'offload-bucket', threshold_bytes=1024)
+
+    assert reoffloaded['big'] != offloaded['big']
+    assert OffloadedPayload(reoffloaded)['big'] == PAYLOAD['big'][:40]
+
+
+def test_offload_payload_disabled(monkeypatch):
+    """Test the payload is returned untouched unless a bucket and a threshold are configured."""
+    monkeypatch.delenv('PAYLOAD_OFFLOAD_BUCKET', raising=False)
+    monkeypatch.setenv('PAYLOAD_OFFLOAD_THRESHOLD_BYTES', '1024')
+    assert offload_payload(PAYLOAD) is PAYLOAD
+
+    monkeypatch.setenv('PAYLOAD_OFFLOAD_BUCKET', 'offload-bucket')
+    monkeypatch.setenv('PAYLOAD_OFFLOAD_THRESHOLD_BYTES', '0')
+    assert offload_payload(PAYLOAD) is PAYLOAD
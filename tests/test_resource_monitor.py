@@ -0,0 +1,33 @@
+import time
+
+from bignbit.resource_monitor import current_rss_bytes, ResourceMonitor, used_bytes
+
+
+def test_records_peaks(tmp_path, monkeypatch):
+    monkeypatch.setenv('AWS_LAMBDA_FUNCTION_MEMORY_SIZE', '512')
+    values = iter(range(1, 1000))
+
+    with ResourceMonitor(str(tmp_path), interval=0.01, probes={'counter': lambda: next(values)}) as monitor:
+        rss_before = current_rss_bytes()
+        block = b'\x01' * (64 * 1024 * 1024)
+        tmp_path.joinpath('scratch').write_bytes(bytes(8 * 1024 * 1024))
+        time.sleep(0.05)
+        tmp_path.joinpath('scratch').unlink()
+        del block
+
+    usage = monitor.usage()
+    assert usage['peak_rss_bytes'] >= rss_before + 32 * 1024 * 1024
+    assert usage['peak_tmp_bytes'] >= used_bytes(str(tmp_path))
+    assert usage['peak_counter'] > 2
+    assert usage['tmp_capacity_bytes'] >= usage['peak_tmp_bytes']
+    assert usage['memory_limit_bytes'] == 512 * 1024 * 1024
+
+
+def test_memory_limit_unknown_outside_lambda(tmp_path, monkeypatch):
+    monkeypatch.delenv('AWS_LAMBDA_FUNCTION_MEMORY_SIZE', raising=False)
+
+    with ResourceMonitor(str(tmp_path)) as monitor:
+        pass
+
+    assert monitor.usage()['memory_limit_bytes'] is None
+    assert monitor.usage()['peak_rss_bytes'] > 0
@@ -1,22 +1,40 @@
+import base64
+import hashlib
+import io
 import json
 import pathlib
 import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from unittest.mock import patch, MagicMock
 
+import boto3
 import pytest
+import requests
 from dateutil import parser
+from moto import mock_s3, mock_ssm
 
 from bignbit.utils import (
     format_iso_expiration_date,
     sha512sum,
+    sha512sum_fileobj,
+    upload_fileobj_to_s3,
     extract_mgrs_grid_code,
     CustomDateTimeEncoder,
     json_dumps_with_datetime,
     extract_granule_dates,
     parse_datetime,
     parse_doy,
-    get_harmony_client
+    get_harmony_client,
+    get_aws_client,
+    clear_aws_clients,
+    get_edl_creds,
+    prefetch_edl_creds,
+    CMRClient,
+    get_cmr_client,
+    set_cmr_deadline,
+    s3_object_checksum,
+    stored_checksum
 )
 
 
@@ -518,3 +536,358 @@ def test_get_harmony_client_sit_defaults_to_uat(mock_get_edl_creds, mock_client)
     result = get_harmony_client('SIT')
 
     assert result == mock_client_instance
+
+
+def test_sha512sum_fileobj_matches_sha512sum():
+    """Test hashing a file-like object gives the same result as hashing the file."""
+    content = b'fileobj content' * 20000
+    with tempfile.NamedTemporaryFile(mode='wb', delete=False) as f:
+        f.write(content)
+        temp_path = pathlib.Path(f.name)
+
+    try:
+        assert sha512sum_fileobj(io.BytesIO(content)) == sha512sum(temp_path)
+        assert sha512sum_fileobj(io.BytesIO(content)) == hashlib.sha512(content).hexdigest()
+    finally:
+        temp_path.unlink()
+
+
+@mock_s3
+def test_upload_fileobj_to_s3():
+    """Test uploading a file-like object to s3."""
+    s3_client = boto3.client('s3', region_name='us-east-1')
+    s3_client.create_bucket(Bucket='test-bucket')
+
+    result = upload_fileobj_to_s3(io.BytesIO(b'in memory'), 'test-bucket', 'path/to/object.tif')
+
+    assert result == 's3://test-bucket/path/to/object.tif'
+    assert s3_client.get_object(Bucket='test-bucket', Key='path/to/object.tif')['Body'].read() == b'in memory'
+
+
+@mock_s3
+def test_upload_fileobj_to_s3_with_metadata():
+    """Test user-defined metadata is stored with the uploaded object."""
+    s3_client = boto3.client('s3', region_name='us-east-1')
+    s3_client.create_bucket(Bucket='test-bucket')
+
+    upload_fileobj_to_s3(io.BytesIO(b'in memory'), 'test-bucket', 'path/to/object.tif', {'sha512': 'abc'})
+
+    assert s3_client.head_object(Bucket='test-bucket', Key='path/to/object.tif')['Metadata'] == {'sha512': 'abc'}
+
+
+@mock_s3
+def test_s3_object_checksum_uses_single_part_etag():
+    """Test the MD5 of a single part object comes from its ETag without downloading it."""
+    s3_client = boto3.client('s3', region_name='us-east-1')
+    s3_client.create_bucket(Bucket='test-bucket')
+    s3_client.put_object(Bucket='test-bucket', Key='image.png', Body=b'image data')
+
+    with patch.object(s3_client, 'get_object') as get_object:
+        checksum = s3_object_checksum('test-bucket', 'image.png', s3_client)
+
+    get_object.assert_not_called()
+    assert checksum == ('md5', hashlib.md5(b'image data').hexdigest())
+
+
+@mock_s3
+def test_s3_object_checksum_prefers_metadata_checksum():
+    """Test a checksum written into the object metadata by its producer is used."""
+    s3_client = boto3.client('s3', region_name='us-east-1')
+    s3_client.create_bucket(Bucket='test-bucket')
+    sha512 = hashlib.sha512(b'image data').hexdigest()
+    s3_client.put_object(Bucket='test-bucket', Key='image.png', Body=b'image data', Metadata={'sha512': sha512})
+
+    assert s3_object_checksum('test-bucket', 'image.png', s3_client) == ('sha512', sha512)
+
+
+@mock_s3
+def test_s3_object_checksum_streams_multipart_objects():
+    """Test objects with a multipart ETag are downloaded and hashed."""
+    s3_client = boto3.client('s3', region_name='us-east-1')
+    s3_client.create_bucket(Bucket='test-bucket')
+    parts = [b'a' * 5 * 1024 * 1024, b'b' * 1024]
+    upload_id = s3_client.create_multipart_upload(Bucket='test-bucket', Key='image.png')['UploadId']
+    etags = [s3_client.upload_part(Bucket='test-bucket', Key='image.png', UploadId=upload_id, PartNumber=number,
+                                   Body=part)['ETag'] for number, part in enumerate(parts, 1)]
+    s3_client.complete_multipart_upload(
+        Bucket='test-bucket', Key='image.png', UploadId=upload_id,
+        MultipartUpload={'Parts': [{'ETag': etag, 'PartNumber': number} for number, etag in enumerate(etags, 1)]})
+
+    assert s3_object_checksum('test-bucket', 'image.png', s3_client) == ('md5', hashlib.md5(b''.join(parts)).hexdigest())
+
+
+def test_stored_checksum():
+    """Test which stored checksums are trusted."""
+    md5 = hashlib.md5(b'data').hexdigest()
+    sha256 = hashlib.sha256(b'data')
+
+    assert stored_checksum({'ETag': f'"{md5}"'}) == ('md5', md5)
+    assert stored_checksum({'ETag': f'"{md5}"', 'ServerSideEncryption': 'AES256'}) == ('md5', md5)
+    assert stored_checksum({'ETag': f'"{md5}"', 'ServerSideEncryption': 'aws:kms'}) is None
+    assert stored_checksum({'ETag': f'"{md5}"', 'SSECustomerAlgorithm': 'AES256'}) is None
+    assert stored_checksum({'ETag': f'"{md5}-2"'}) is None
+    assert stored_checksum({'ETag': f'"{md5}"', 'ChecksumSHA256': base64.b64encode(sha256.digest()).decode(),
+                            'ChecksumType': 'FULL_OBJECT'}) == ('sha256', sha256.hexdigest())
+    assert stored_checksum({'ETag': f'"{md5}-2"', 'ChecksumSHA256': base64.b64encode(sha256.digest()).decode() + '-2',
+                            'ChecksumType': 'COMPOSITE'}) is None
+    assert stored_checksum({'ETag': f'"{md5}-2"', 'Metadata': {'md5': 'not a digest'}}) is None
+    assert stored_checksum({'ETag': f'"{md5}-2"', 'Metadata': {'MD5': md5.upper()}}) == ('md5', md5)
+
+
+
+def test_get_aws_client_is_cached_per_service_and_region():
+    """Test clients are created once per service and region and shared between threads."""
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        clients = list(executor.map(lambda _: get_aws_client('s3', 'us-west-2'), range(32)))
+
+    assert all(client is clients[0] for client in clients)
+    assert get_aws_client('s3', 'us-east-1') is not clients[0]
+    assert get_aws_client('sqs', 'us-west-2') is not clients[0]
+    clear_aws_clients()
+    assert get_aws_client('s3', 'us-west-2') is not clients[0]
+
+
+def test_get_aws_client_configuration(monkeypatch):
+    """Test pool size, retries and timeouts of the clients are read from the environment."""
+    monkeypatch.setenv('AWS_MAX_POOL_CONNECTIONS', '64')
+    monkeypatch.setenv('AWS_RETRY_MODE', 'adaptive')
+    monkeypatch.setenv('AWS_MAX_ATTEMPTS', '5')
+    monkeypatch.setenv('AWS_READ_TIMEOUT', '10')
+
+    config = get_aws_client('s3', 'us-west-2').meta.config
+
+    assert config.max_pool_connections == 64
+    assert config.retries == {'mode': 'adaptive', 'total_max_attempts': 5}
+    assert config.read_timeout == 10
+
+
+@pytest.fixture
+def edl_ssm(monkeypatch):
+    """SSM parameters holding default and UAT EDL credentials, with an empty credentials cache"""
+    monkeypatch.setattr('bignbit.utils.EDL_CREDS', {})
+    monkeypatch.setenv('EDL_USER_SSM', 'edl-user')
+    monkeypatch.setenv('EDL_PASS_SSM', 'edl-pass')
+    with mock_ssm():
+        ssm = boto3.client('ssm', region_name='us-west-2')
+        for name, value in (('edl-user', 'user'), ('edl-pass', 'pass'), ('uat-user', 'uat_user'), ('uat-pass', 'uat_pass')):
+            ssm.put_parameter(Name=name, Value=value, Type='SecureString')
+        yield ssm
+
+
+def test_get_edl_creds_reads_parameters_in_one_call(edl_ssm):
+    """Test the username and password are read with a single GetParameters call and then cached."""
+    get_parameters = MagicMock(wraps=get_aws_client('ssm', 'us-west-2').get_parameters)
+    with patch.object(get_aws_client('ssm', 'us-west-2'), 'get_parameters', get_parameters):
+        assert get_edl_creds() == ('user', 'pass')
+        assert get_edl_creds() == ('user', 'pass')
+
+    get_parameters.assert_called_once_with(Names=['edl-user', 'edl-pass'], WithDecryption=True)
+
+
+def test_get_edl_creds_picks_up_rotated_credentials_after_ttl(edl_ssm, monkeypatch):
+    """Test cached credentials are read again once they are older than EDL_CREDS_TTL_SECONDS."""
+    assert get_edl_creds() == ('user', 'pass')
+    edl_ssm.put_parameter(Name='edl-pass', Value='rotated', Type='SecureString', Overwrite=True)
+    assert get_edl_creds() == ('user', 'pass')
+
+    monkeypatch.setenv('EDL_CREDS_TTL_SECONDS', '0')
+    assert get_edl_creds() == ('user', 'rotated')
+
+
+def test_get_edl_creds_per_cmr_environment(edl_ssm, monkeypatch):
+    """Test EDL_USER_SSM_<ENV> and EDL_PASS_SSM_<ENV> select the credentials of a CMR environment."""
+    monkeypatch.setenv('EDL_USER_SSM_UAT', 'uat-user')
+    monkeypatch.setenv('EDL_PASS_SSM_UAT', 'uat-pass')
+
+    assert get_edl_creds('uat') == ('uat_user', 'uat_pass')
+    assert get_edl_creds('OPS') == ('user', 'pass')
+    assert get_edl_creds() == ('user', 'pass')
+
+
+def test_get_edl_creds_missing_parameter(edl_ssm, monkeypatch):
+    """Test a missing SSM parameter is reported by name."""
+    monkeypatch.setenv('EDL_PASS_SSM', 'missing-pass')
+    with pytest.raises(ValueError, match='missing-pass'):
+        get_edl_creds()
+
+
+def test_prefetch_edl_creds(edl_ssm, monkeypatch):
+    """Test prefetching fills the cache, and neither fails when unconfigured nor when the parameters are missing."""
+    prefetch_edl_creds()
+    edl_ssm.delete_parameter(Name='edl-user')
+    assert get_edl_creds() == ('user', 'pass')
+
+    monkeypatch.setattr('bignbit.utils.EDL_CREDS', {})
+    prefetch_edl_creds()
+    monkeypatch.delenv('EDL_USER_SSM')
+    prefetch_edl_creds()
+
+
+def cmr_response(status_code=200, document=None, headers=None):
+    """Mock requests.Response from CMR"""
+    response = MagicMock(status_code=status_code, headers=headers or {})
+    response.json.return_value = document
+    if status_code >= 400:
+        response.raise_for_status.side_effect = requests.HTTPError(f'{status_code} Error')
+    return response
+
+
+@pytest.fixture
+def cmr_client(monkeypatch):
+    """CMRClient with stubbed credentials that does not sleep between retries"""
+    monkeypatch.setattr('bignbit.utils.get_edl_creds', lambda *args: ('user', 'pass'))
+    monkeypatch.setattr('bignbit.utils.get_cmr_user_token', lambda *args: 'token')
+    monkeypatch.setattr('bignbit.utils.time.sleep', MagicMock())
+    return CMRClient('UAT', max_attempts=3, cache_size=2, cache_ttl_seconds=60)
+
+
+def test_cmr_client_retries_transient_failures(cmr_client):
+    """Test connection errors and 5xx/429 responses are retried on the same session."""
+    granule = {'GranuleUR': 'granule'}
+    with patch.object(cmr_client.session, 'get', side_effect=[
+        requests.ConnectionError('reset'), cmr_response(503), cmr_response(200, granule)
+    ]) as get:
+        assert cmr_client.get_granule_umm_json('G123-POCLOUD') == granule
+
+    assert get.call_count == 3
+    assert get.call_args.args[0] == 'https://cmr.uat.earthdata.nasa.gov/search/concepts/G123-POCLOUD.umm_json'
+    assert get.call_args.kwargs['headers'] == {'Authorization': 'Bearer token'}
+
+
+def test_cmr_client_gives_up_after_max_attempts(cmr_client):
+    """Test the last error is raised once every attempt failed, and client errors are not retried."""
+    with patch.object(cmr_client.session, 'get', side_effect=[cmr_response(500)] * 3) as get:
+        with pytest.raises(requests.HTTPError):
+            cmr_client.get_granule_umm_json('G123-POCLOUD')
+    assert get.call_count == 3
+
+    with patch.object(cmr_client.session, 'get', side_effect=[cmr_response(404)]) as get:
+        with pytest.raises(requests.HTTPError):
+            cmr_client.get_granule_umm_json('G404-POCLOUD')
+    assert get.call_count == 1
+
+
+def test_cmr_client_honors_retry_after(cmr_client):
+    """Test a Retry-After header sets the delay before the next attempt."""
+    with patch.object(cmr_client.session, 'get', side_effect=[
+        cmr_response(429, headers={'Retry-After': '2'}), cmr_response(200, {})
+    ]), patch('bignbit.utils.time.sleep') as sleep:
+        cmr_client.get_granule_umm_json('G123-POCLOUD')
+
+    sleep.assert_called_once_with(2.0)
+
+
+def test_cmr_client_stops_retrying_at_the_lambda_deadline(cmr_client, monkeypatch):
+    """Test retries give up, raising the CMR error, in time for the Lambda to report it before timing out."""
+    clock = [1000.0]
+    monkeypatch.setattr('bignbit.utils.time.monotonic', lambda: clock[0])
+    monkeypatch.setattr('bignbit.utils.time.sleep', lambda seconds: clock.__setitem__(0, clock[0] + seconds))
+    monkeypatch.setattr('bignbit.utils.random.uniform', lambda low, high: high)
+    monkeypatch.setenv('CMR_DEADLINE_MARGIN_SECONDS', '2')
+    set_cmr_deadline(MagicMock(get_remaining_time_in_millis=lambda: 30000))
+    cmr_client.max_attempts = 10
+    cmr_client.backoff_seconds = 1
+
+    def slow_failure(url, timeout, **kwargs):
+        clock[0] += timeout
+        return cmr_response(503)
+
+    try:
+        with patch.object(cmr_client.session, 'get', side_effect=slow_failure) as get:
+            with pytest.raises(requests.HTTPError):
+                cmr_client.get_granule_umm_json('G123-POCLOUD')
+    finally:
+        set_cmr_deadline(None)
+
+    # 10s attempt, 1s backoff, 10s attempt, 2s backoff, then an attempt shortened to the 5s left before the deadline
+    assert [call.kwargs['timeout'] for call in get.call_args_list] == [10, 10, 5]
+    assert clock[0] <= 1000.0 + 30 - 2
+
+
+def test_cmr_client_caches_documents(cmr_client, monkeypatch):
+    """Test documents are served from an LRU cache until they expire, as copies."""
+    documents = {f'G{number}': {'GranuleUR': f'granule{number}'} for number in range(3)}
+    with patch.object(cmr_client.session, 'get',
+                      side_effect=lambda url, **kwargs: cmr_response(200, documents[url.rsplit('/', 1)[1].split('.')[0]])) as get:
+        first = cmr_client.get_granule_umm_json('G0')
+        first['GranuleUR'] = 'modified'
+        assert cmr_client.get_granule_umm_json('G0') == {'GranuleUR': 'granule0'}
+        cmr_client.get_granule_umm_json('G1')
+        cmr_client.get_granule_umm_json('G2')
+        assert get.call_count == 3
+        assert cmr_client.cache_stats() == {'hits': 1, 'misses': 3, 'size': 2}
+
+        # G0 was the least recently used document
+        cmr_client.get_granule_umm_json('G0')
+        assert get.call_count == 4
+
+        cmr_client.cache_ttl_seconds = 0
+        cmr_client.get_granule_umm_json('G0')
+        assert get.call_count == 5
+
+
+def test_cmr_client_search_collections_cache_key(cmr_client):
+    """Test collection searches are cached per query."""
+    with patch.object(cmr_client.session, 'get', side_effect=lambda url, **kwargs: cmr_response(200, kwargs['params'])) as get:
+        assert cmr_client.search_collections(provider='POCLOUD', short_name='A', version='1')['short_name'] == 'A'
+        assert cmr_client.search_collections(version='1', short_name='A', provider='POCLOUD')['short_name'] == 'A'
+        assert cmr_client.search_collections(provider='POCLOUD', short_name='B', version='1')['short_name'] == 'B'
+    assert get.call_count == 2
+
+
+def test_get_cmr_client_is_shared_per_environment():
+    """Test one client, and so one session and cache, is kept per CMR environment."""
+    assert get_cmr_client('UAT') is get_cmr_client('UAT')
+    assert get_cmr_client('UAT') is not get_cmr_client('OPS')
+    assert get_cmr_client('OPS').search_url == 'https://cmr.earthdata.nasa.gov/search'
+
+
+def granule_search_response(concept_ids, hits=None, search_after=None):
+    """Mock CMR granules.umm_json search response"""
+    headers = {'CMR-Hits': str(len(concept_ids) if hits is None else hits)}
+    if search_after:
+        headers['CMR-Search-After'] = search_after
+    return cmr_response(200, {'items': [{'meta': {'concept-id': concept_id}, 'umm': {'GranuleUR': f'ur-{concept_id}'}}
+                                        for concept_id in concept_ids]}, headers)
+
+
+def test_cmr_client_get_granules_umm_json_batches_and_dedupes(cmr_client):
+    """Test repeated ids are searched once, in concept_id[] batches POSTed as forms, and missing granules are left
+    out."""
+    with patch.object(cmr_client.session, 'get') as get, patch.object(cmr_client.session, 'post', side_effect=[
+        granule_search_response(['G1', 'G2'], search_after='["a"]'), granule_search_response(['G3'])
+    ]) as post:
+        documents = cmr_client.get_granules_umm_json(['G1', 'G2', 'G1', 'G2', 'G3', 'G4'], batch_size=2)
+
+    get.assert_not_called()
+    assert documents == {concept_id: {'GranuleUR': f'ur-{concept_id}'} for concept_id in ('G1', 'G2', 'G3')}
+    assert [call.kwargs['data'] for call in post.call_args_list] == [
+        {'concept_id[]': ['G1', 'G2'], 'page_size': 2}, {'concept_id[]': ['G3', 'G4'], 'page_size': 2}
+    ]
+    assert post.call_args_list[0].args[0] == 'https://cmr.uat.earthdata.nasa.gov/search/granules.umm_json'
+    assert not post.call_args_list[0].kwargs['params']
+    request = requests.Request('POST', post.call_args_list[0].args[0], data=post.call_args_list[0].kwargs['data'],
+                               headers=post.call_args_list[0].kwargs['headers']).prepare()
+    assert request.url == 'https://cmr.uat.earthdata.nasa.gov/search/granules.umm_json'
+    assert request.headers['Content-Type'] == 'application/x-www-form-urlencoded'
+    assert request.body == 'concept_id%5B%5D=G1&concept_id%5B%5D=G2&page_size=2'
+
+
+def test_cmr_client_get_granules_umm_json_follows_search_after(cmr_client):
+    """Test a batch spanning pages is followed with the CMR-Search-After header."""
+    cmr_client.cache_size = 10
+    with patch.object(cmr_client.session, 'post', side_effect=[
+        granule_search_response(['G1'], hits=2, search_after='["a"]'), granule_search_response(['G2'], hits=2)
+    ]) as post:
+        assert set(cmr_client.get_granules_umm_json(['G1', 'G2'])) == {'G1', 'G2'}
+
+    assert 'CMR-Search-After' not in post.call_args_list[0].kwargs['headers']
+    assert post.call_args_list[1].kwargs['headers']['CMR-Search-After'] == '["a"]'
+
+    # Bulk results are shared with get_granule_umm_json through the cache
+    with patch.object(cmr_client.session, 'get') as get, patch.object(cmr_client.session, 'post') as post:
+        assert cmr_client.get_granule_umm_json('G2') == {'GranuleUR': 'ur-G2'}
+        assert cmr_client.get_granules_umm_json(['G1', 'G2']) == {'G1': {'GranuleUR': 'ur-G1'},
+                                                                  'G2': {'GranuleUR': 'ur-G2'}}
+    get.assert_not_called()
+    post.assert_not_called()